@@ -1,18 +1,37 @@
 import os
 import sys
 import json
+import time
+import zlib
+import random
 import signal
+import asyncio
 import logging
 
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.autoreload
+from tornado.iostream import StreamClosedError
+from tornado.httpserver import HTTPServer
 from tornado.platform.asyncio import AsyncIOMainLoop
 from tornado.httputil import HTTPServerRequest
-from tornado.web import RequestHandler, Application, Finish
+from tornado.web import RequestHandler, Application, Finish, GZipContentEncoding, stream_request_body
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 
 import mylog
-from redis_connection_async import RedisConnectionAsync
-from records_service import RecordsService
+import json_response
+from redis_connection_async import RedisConnectionAsync, RedisUnavailable
+from records_service import RecordsService, parse_fields, parse_consistency
+from records_cache import RecordsCache
+from index_sweeper import IndexSweeper
+from record_archive import RecordArchive
+from archive_mover import ArchiveMover
+from write_buffer import WriteBuffer, WriteBufferFull
+from metrics import Metrics, Gauge, stats_gauge
+from rate_limit import RateLimiter
+from record_events import RecordEvents, parse_event_id
+from record_codec import CodecStats
 
 
 def is_dev_mode() -> bool:
@@ -24,7 +43,7 @@ def parse_json_body(request: HTTPServerRequest) -> dict:
     try:
         return json.loads(request.body)
     except Exception as exc:
-        raw = (request.body[:2048] if request.body else b"")
+        raw = bytes(request.body[:2048]) if request.body else b""
         logging.warning("JSON parse error: %s; raw_body=%r", exc, raw)
         raise ValueError(f"Invalid JSON: {exc}")
 
@@ -40,32 +59,291 @@ def optional_any(d: dict, key: str):
     return d.get(key)
 
 
+# Items per chunk when a /records response is streamed (flushed) to the client
+RESPONSE_STREAM_CHUNK = int(os.environ.get("RESPONSE_STREAM_CHUNK", "20"))
+
+# Seconds between keep-alive comments on an idle /records/events stream
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+# Max records accepted by POST /records/batch in a single request
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+
+# Max request body size in bytes, after gzip decoding (larger bodies get 413 before parsing)
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+BATCH_MAX_BODY_BYTES = int(os.environ.get("BATCH_MAX_BODY_BYTES", str(64 * 1024 * 1024)))
+
+# gzip responses for clients that send Accept-Encoding: gzip
+RESPONSE_GZIP = os.environ.get("RESPONSE_GZIP", "1").lower() not in {"0", "false", "no"}
+RESPONSE_GZIP_LEVEL = int(os.environ.get("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_GZIP_MIN_BYTES = int(os.environ.get("RESPONSE_GZIP_MIN_BYTES", "1024"))
+
+
+class ResponseCompression(GZipContentEncoding):
+    """Tornado's gzip transform, also for NDJSON exports, with configurable level/threshold.
+    Streamed (flushed) responses are compressed chunk by chunk."""
+
+    CONTENT_TYPES = GZipContentEncoding.CONTENT_TYPES | {"application/x-ndjson"}
+    GZIP_LEVEL = RESPONSE_GZIP_LEVEL
+    MIN_LENGTH = RESPONSE_GZIP_MIN_BYTES
+
+
 class SecureHandler(RequestHandler):
-    def prepare(self):
-        expected_key = os.environ.get("API_SECRET_KEY")
-        if not expected_key:
-            logging.error("API_SECRET_KEY not set in environment variables.")
+    # Requests currently being served by this process (used to drain on shutdown)
+    inflight = 0
+
+    async def prepare(self):
+        SecureHandler.inflight += 1
+        self._inflight_counted = True
+
+        # Shed load first, before the key check, any body bytes or any Redis work.
+        if RateLimiter.overloaded(SecureHandler.inflight):
+            RateLimiter.shed_total += 1
+            self.set_status(503)
+            self.set_header("Retry-After", "1")
+            self.write({"error": "Service Unavailable: server overloaded"})
+            raise Finish()
+
+        if not RateLimiter.configured():
+            logging.error("No API key configured (API_SECRET_KEY / API_KEYS).")
             self.set_status(500)
             self.write({"error": "Internal Server Error: API key not configured"})
             raise Finish()
 
-        received_key = self.request.headers.get("X-API-KEY")
-        if received_key != expected_key:
+        client = RateLimiter.client(self.request.headers.get("X-API-KEY"))
+        if client is None:
             self.set_status(401)
             self.write({"error": "Unauthorized"})
             raise Finish()
 
+        # Fail fast while Redis is known to be down instead of piling requests on the loop.
+        if RedisConnectionAsync.breaker.is_open():
+            self.set_error_status(RedisUnavailable())
+            self.write({"error": "Service Unavailable: storage is temporarily unreachable"})
+            raise Finish()
+
+        limited, retry_after = await RateLimiter.admit(client)
+        if limited:
+            self.set_status(429)
+            self.set_header("Retry-After", str(max(1, int(retry_after + 0.999))))
+            self.write({"error": f"Too Many Requests ({limited} limit of client '{client.name}')"})
+            raise Finish()
+        client.inflight += 1
+        self._client = client
+
+    def set_error_status(self, exc: Exception) -> None:
+        """500 for unexpected failures, 503 + Retry-After when Redis is unreachable or the
+        write buffer is full."""
+        if isinstance(exc, (RedisConnectionError, RedisTimeoutError, WriteBufferFull)):
+            self.set_status(503)
+            self.set_header("Retry-After", str(max(1, int(RedisConnectionAsync.breaker.retry_after() + 0.999))))
+        else:
+            self.set_status(500)
+
+    def version_etag(self, version, *params) -> str:
+        """Weak ETag from a stored version token and the request parameters shaping the response
+        (weak: the same version is sent gzip-encoded or not)."""
+        return f'W/"{version}-{zlib.crc32(repr(params).encode("utf-8")):08x}"'
+
+    async def not_modified(self, load_version, *params) -> bool:
+        """Answer 304 when If-None-Match matches the current version, which costs one small Redis
+        read instead of loading and encoding the payloads. `load_version()` returns the version
+        token (None when there is none to compare, e.g. buffered writes)."""
+        if not self.request.headers.get("If-None-Match"):
+            return False
+        version = await load_version()
+        if version is None:
+            return False
+        self.set_header("Etag", self.version_etag(version, *params))
+        if self.check_etag_header():
+            self.set_status(304)
+            return True
+        self.clear_header("Etag")
+        return False
+
+    def set_version_etag(self, version, *params) -> None:
+        if version is not None:
+            self.set_header("Etag", self.version_etag(version, *params))
+
+    def write_json(self, obj) -> None:
+        """Write obj as JSON, splicing stored RawJSON payloads instead of re-encoding them."""
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(json_response.dumps(obj))
+
+    async def stream_json(self, head: dict, items_key: str, items) -> None:
+        """Like write_json for `{**head, items_key: items}`, flushing every RESPONSE_STREAM_CHUNK items."""
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        for chunk in json_response.iter_chunks(head, items_key, items, RESPONSE_STREAM_CHUNK):
+            self.write(chunk)
+            await self.flush()
+
+    def detach_inflight(self) -> None:
+        """Stop counting this request as in flight (long-lived streams would otherwise hold off
+        load shedding limits and shutdown drains for as long as they stay open)."""
+        if getattr(self, "_inflight_counted", False):
+            SecureHandler.inflight -= 1
+            self._inflight_counted = False
+        client = getattr(self, "_client", None)
+        if client is not None:
+            client.inflight -= 1
+            self._client = None
+
+    def on_finish(self):
+        self.detach_inflight()
+
 
 class HealthHandler(RequestHandler):
     def get(self):
         global VERSION
-        self.write({"status": "ok", "message": "pong", "version": VERSION})
+        payload = {
+            "status": "ok",
+            "message": "pong",
+            "version": VERSION,
+            "redis": RedisConnectionAsync.breaker_stats(),
+            "codec": CodecStats.as_dict(),
+        }
+        if RecordsCache.enabled():
+            payload["cache"] = RecordsCache.stats()
+        if IndexSweeper.passes:
+            payload["sweeper"] = IndexSweeper.stats()
+        if RecordArchive.enabled():
+            payload["archive"] = {**RecordArchive.stats(), **ArchiveMover.stats()}
+        if WriteBuffer.enabled():
+            payload["write_buffer"] = WriteBuffer.stats()
+        if RateLimiter.enabled():
+            payload["rate_limit"] = RateLimiter.stats()
+        if RecordEvents.enabled():
+            payload["events"] = RecordEvents.stats()
+        replicas = RedisConnectionAsync.replica_stats()
+        if replicas:
+            payload["replicas"] = replicas
+        self.write(payload)
+
+
+class MetricsHandler(RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(Metrics.render())
 
 
-class RecordHandler(SecureHandler):
+def register_metrics():
+    """Gauges read at scrape time from the state the process already keeps."""
+    Metrics.register(Gauge(
+        "http_requests_inflight", "Requests currently being served by this process.", (),
+        lambda: [((), SecureHandler.inflight)],
+    ))
+    Metrics.register(Gauge(
+        "redis_pool_connections", "Redis pool connections by client and state.", ("client", "state"),
+        RedisConnectionAsync.pool_usage,
+    ))
+    Metrics.register(Gauge(
+        "redis_circuit_breaker", "Breaker state (1 = current state) and counters.", ("stat",),
+        lambda: [
+            (("open",), int(RedisConnectionAsync.breaker.state == "open")),
+            (("half_open",), int(RedisConnectionAsync.breaker.state == "half_open")),
+            (("opened_total",), RedisConnectionAsync.breaker.opened_total),
+            (("rejected_total",), RedisConnectionAsync.breaker.rejected_total),
+        ],
+    ))
+    Metrics.register(Gauge(
+        "redis_replica", "Read replicas: healthy (1/0) and reads that fell back to the primary.",
+        ("replica", "stat"),
+        lambda: [
+            item
+            for r in RedisConnectionAsync.replica_stats()
+            for item in (((r["name"], "healthy"), int(r["healthy"])), ((r["name"], "fallbacks"), r["fallbacks"]))
+        ],
+    ))
+    Metrics.register(Gauge(
+        "event_loop_lag_last_seconds", "Last measured event-loop lag (max since start in 'max').", ("kind",),
+        lambda: [(("last",), Metrics.loop_lag_last), (("max",), Metrics.loop_lag_max)],
+    ))
+    Metrics.register(stats_gauge(
+        "records_cache", "Read cache counters (see /ping).", RecordsCache.stats,
+        ("size", "hits", "misses", "evictions", "expirations", "invalidations"),
+    ))
+    Metrics.register(stats_gauge(
+        "records_codec", "Storage codec byte counters for values written by this process.", CodecStats.as_dict,
+        ("values", "compressed", "raw_bytes", "stored_bytes", "saved_bytes"),
+    ))
+    Metrics.register(stats_gauge(
+        "index_sweeper", "Background index sweeper counters.", IndexSweeper.stats,
+        ("passes", "indexes_scanned", "members_checked", "members_removed", "members_trimmed"),
+    ))
+    Metrics.register(stats_gauge(
+        "records_archive", "Archive tier counters (mover counters in the mover process only).",
+        lambda: {**RecordArchive.stats(), **ArchiveMover.stats()},
+        ("file_bytes", "reads", "hits", "passes", "moved", "kept", "purged"),
+    ))
+    Metrics.register(stats_gauge(
+        "write_buffer", "Write-behind buffer counters.", WriteBuffer.stats,
+        ("pending", "in_flight", "writes", "coalesced", "flushed", "batches", "failures", "waits", "rejected"),
+    ))
+    Metrics.register(Gauge(
+        "api_client_requests", "Requests per API key: admitted, rate limited, in flight.", ("client", "stat"),
+        lambda: [
+            item
+            for name, c in RateLimiter.stats()["clients"].items()
+            for item in (((name, "allowed"), c["allowed"]), ((name, "limited"), c["limited"]),
+                         ((name, "inflight"), c["inflight"]))
+        ],
+    ))
+    Metrics.register(Gauge(
+        "http_requests_shed", "Requests shed with 503 because too many were in flight.", (),
+        lambda: [((), RateLimiter.shed_total)],
+    ))
+    Metrics.register(stats_gauge(
+        "record_events", "Change event fan-out counters (see /ping).", RecordEvents.stats,
+        ("streams", "subscribers", "reads", "delivered", "dropped"),
+    ))
+    Metrics.register(Gauge(
+        "log_records_dropped", "Log records dropped because the logging queue was full.", (),
+        lambda: [((), mylog.DroppingQueueHandler.dropped)],
+    ))
+
+
+@stream_request_body
+class JsonBodyHandler(SecureHandler):
+    """SecureHandler whose request body is streamed in (already gzip-decoded by the server) and
+    capped at `max_body_bytes`: an oversized body gets 413 (and the connection is closed) as
+    soon as it crosses the limit, before anything is parsed or held in memory in full."""
+
+    max_body_bytes = MAX_BODY_BYTES
+
+    async def prepare(self):
+        await super().prepare()
+        self._body = bytearray()
+        length = self.request.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_body_bytes:
+            self._reject_body()
+            raise Finish()
+
+    def data_received(self, chunk: bytes) -> None:
+        if self._finished:
+            return
+        if len(self._body) + len(chunk) > self.max_body_bytes:
+            self._body = bytearray()
+            self._reject_body()
+            return
+        self._body += chunk
+
+    def _reject_body(self) -> None:
+        logging.warning("Request body over %d bytes rejected (%s %s)",
+                        self.max_body_bytes, self.request.method, self.request.uri)
+        self.set_status(413)
+        self.finish({"error": f"Request body too large (max {self.max_body_bytes} bytes)."})
+
+    def json_body(self) -> dict:
+        """Parse the received body (Finish if it was already rejected)."""
+        if self._finished:
+            raise Finish()
+        self.request.body, self._body = self._body, bytearray()
+        return parse_json_body(self.request)
+
+
+class RecordHandler(JsonBodyHandler):
     async def post(self):
         try:
-            body = parse_json_body(self.request)
+            body = self.json_body()
             logging.debug(f"RecordHandler POST body: {body.get('game')}")
             user_id = require_str(body, "user_id")
             match_id = require_str(body, "match")
@@ -81,7 +359,7 @@ class RecordHandler(SecureHandler):
             res = await RecordsService.upsert(user_id, match_id, game, input_data, output_data)
         except Exception as e:
             logging.exception("[upsert] failed")
-            self.set_status(500)
+            self.set_error_status(e)
             self.write({"error": "failed to upsert record", "description": str(e)})
             return
 
@@ -90,31 +368,103 @@ class RecordHandler(SecureHandler):
     async def get(self):
         user_id = self.get_argument("user_id", default="")
         match_id = self.get_argument("match", default="")
+        game = self.get_argument("game", default="")
 
-        if not user_id or not match_id:
+        if not user_id or not match_id or not game:
             self.set_status(400)
-            self.write({"error": "user_id and match are required"})
+            self.write({"error": "user_id, game and match are required"})
             return
 
         try:
-            rec = await RecordsService.get_one(user_id, match_id)
-        except Exception:
+            fields = parse_fields(self.get_argument("fields", default=None))
+            primary = parse_consistency(self.get_argument("consistency", default=None))
+        except ValueError as e:
+            self.set_status(400)
+            self.write({"error": str(e)})
+            return
+
+        params = (user_id, game, match_id, fields)
+        try:
+            if await self.not_modified(
+                lambda: RecordsService.record_version(user_id, game, match_id, primary), *params
+            ):
+                return
+            rec, version = await RecordsService.get_one_versioned(
+                user_id, game, match_id, fields, raw_json=True, primary=primary
+            )
+        except Exception as e:
             logging.exception("[get_one] failed")
-            self.set_status(500)
+            self.set_error_status(e)
             self.write({"error": "failed to fetch record"})
             return
 
         if rec:
-            self.write(rec)
+            self.set_version_etag(version, *params)
+            self.write_json(rec)
         else:
             self.set_status(404)
             self.write({"error": "not found"})
 
 
-class RecordSetOutputHandler(SecureHandler):
+class RecordsBatchHandler(JsonBodyHandler):
+    max_body_bytes = BATCH_MAX_BODY_BYTES
+
+    async def post(self):
+        try:
+            body = self.json_body()
+            records = body.get("records") if isinstance(body, dict) else None
+            if not isinstance(records, list) or not records:
+                raise ValueError("Missing or invalid 'records' (must be a non-empty list).")
+            if len(records) > BATCH_MAX_ITEMS:
+                raise ValueError(f"Too many records: {len(records)} (max {BATCH_MAX_ITEMS}).")
+        except ValueError as e:
+            self.set_status(400)
+            self.write({"error": str(e)})
+            return
+
+        # Validate everything up front; invalid items are reported, valid ones are written.
+        results: list = [None] * len(records)
+        valid: list = []
+        positions: list = []
+        for i, item in enumerate(records):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Record must be an object.")
+                valid.append({
+                    "user_id": require_str(item, "user_id"),
+                    "match_id": require_str(item, "match"),
+                    "game": require_str(item, "game"),
+                    "input": optional_any(item, "input"),
+                    "output": optional_any(item, "output"),
+                })
+                positions.append(i)
+            except ValueError as e:
+                results[i] = {"ok": False, "index": i, "error": str(e)}
+
+        try:
+            written = await RecordsService.upsert_many(valid)
+        except Exception as e:
+            logging.exception("[upsert_many] failed")
+            self.set_error_status(e)
+            self.write({"error": "failed to upsert records", "description": str(e)})
+            return
+
+        for i, res in zip(positions, written):
+            results[i] = {"index": i, **res}
+
+        self.write({
+            "status": "ok",
+            "count": len(records),
+            "written": len(written),
+            "failed": len(records) - len(written),
+            "results": results,
+        })
+
+
+class RecordSetOutputHandler(JsonBodyHandler):
     async def put(self):
         try:
-            body = parse_json_body(self.request)
+            body = self.json_body()
             user_id = require_str(body, "user_id")
             match_id = require_str(body, "match")
             game = require_str(body, "game")
@@ -128,17 +478,24 @@ class RecordSetOutputHandler(SecureHandler):
 
         try:
             res = await RecordsService.set_output(user_id, match_id, game, output_data)
-        except Exception:
+        except Exception as e:
             logging.exception("[set_output] failed")
-            self.set_status(500)
+            self.set_error_status(e)
             self.write({"error": "failed to set output"})
             return
 
         self.write({"status": "ok", **res})
 
 
-class RecordsGetRecentHandler(SecureHandler):
-    async def _respond_recent(self, user_id: str, game: str, limit_value, offset_value) -> None:
+class RecordsGetRecentHandler(JsonBodyHandler):
+    async def _respond_items(self, head: dict, items: list, stream: bool) -> None:
+        if stream:
+            await self.stream_json({**head, "count": len(items)}, "items", items)
+        else:
+            self.write_json({**head, "count": len(items), "items": items})
+
+    async def _respond_recent(self, user_id: str, game: str, limit_value, offset_value, fields=None,
+                              stream: bool = False, primary: bool = False) -> None:
         if not user_id:
             self.set_status(400)
             self.write({"error": "user_id is required"})
@@ -156,111 +513,613 @@ class RecordsGetRecentHandler(SecureHandler):
             self.write({"error": str(e)})
             return
 
+        params = ("recent", user_id, game, limit, offset, fields, stream)
         try:
-            items = await RecordsService.get_recent(user_id, game, limit, offset)
-        except Exception:
+            if await self.not_modified(lambda: RecordsService.index_version(user_id, game, primary), *params):
+                return
+            items, version = await RecordsService.get_recent_versioned(user_id, game, limit, offset, fields,
+                                                                       raw_json=True, primary=primary)
+        except Exception as e:
             logging.exception("[get_recent] failed")
-            self.set_status(500)
+            self.set_error_status(e)
+            self.write({"error": "failed to fetch recent records"})
+            return
+
+        self.set_version_etag(version, *params)
+        await self._respond_items({"user_id": user_id, "offset": offset, "limit": limit}, items, stream)
+
+    async def _respond_page(self, user_id: str, game: str, limit_value, cursor, fields=None,
+                            stream: bool = False, primary: bool = False) -> None:
+        """Cursor (keyset) pagination: the client sends back `next_cursor` to get the next page."""
+        try:
+            limit = int(limit_value if limit_value is not None else 10)
+            if limit <= 0:
+                raise ValueError(f"Invalid pagination: limit={limit} (must > 0)")
+            if cursor is not None and not isinstance(cursor, str):
+                raise ValueError("Invalid cursor: must be a string")
+            params = ("page", user_id, game, limit, cursor or None, fields, stream)
+            if await self.not_modified(lambda: RecordsService.index_version(user_id, game, primary), *params):
+                return
+            items, next_cursor, version = await RecordsService.get_page_versioned(
+                user_id, game, limit, cursor or None, fields, raw_json=True, primary=primary
+            )
+        except ValueError as e:
+            logging.warning("Pagination error on /records: %s (limit=%r, cursor=%r)", e, limit_value, cursor)
+            self.set_status(400)
+            self.write({"error": str(e)})
+            return
+        except Exception as e:
+            logging.exception("[get_page] failed")
+            self.set_error_status(e)
             self.write({"error": "failed to fetch recent records"})
             return
 
-        self.write({"user_id": user_id, "count": len(items), "items": items, "offset": offset, "limit": limit})
+        head = {"user_id": user_id, "limit": limit, "cursor": cursor or None, "next_cursor": next_cursor}
+        self.set_version_etag(version, *params)
+        await self._respond_items(head, items, stream)
 
     async def post(self):
         try:
-            # (2) Log request  body
+            body = self.json_body()
+            # (2) Log request body (only complete once json_body has taken the streamed bytes)
             logging.debug(
                 "POST /records from %s body=%r",
                 self.request.remote_ip,
-                self.request.body[:1024]
+                bytes(self.request.body[:1024])
             )
-
-            body = parse_json_body(self.request)
             user_id = require_str(body, "user_id")
             game = require_str(body, "game")
             limit_value = body.get("limit", 10)
             offset_value = body.get("offset", 0)
+            fields = parse_fields(body.get("fields"))
+            stream = bool(body.get("stream", False))
+            primary = parse_consistency(body.get("consistency"))
         except ValueError as e:
             logging.warning("Validation error on /records: %s", e, exc_info=False)
             self.set_status(400)
             self.write({"error": str(e)})
             return
 
-        await self._respond_recent(user_id, game, limit_value, offset_value)
+        # Sending "cursor" (null/"" for the first page) opts into keyset pagination;
+        # otherwise the limit/offset contract is unchanged.
+        if "cursor" in body:
+            await self._respond_page(user_id, game, limit_value, body["cursor"], fields, stream, primary)
+            return
+
+        await self._respond_recent(user_id, game, limit_value, offset_value, fields, stream, primary)
+
+
+class RecordsFeedHandler(SecureHandler):
+    """GET /records/feed?user_id=..[&limit=10][&offset=0][&fields=..][&consistency=..]
+
+    Most recent records of a user across all games in one request, replacing one /records call
+    per game (each item has its `game` unless `fields` leaves it out).
+    """
+
+    async def get(self):
+        user_id = self.get_argument("user_id", default="")
+        if not user_id:
+            self.set_status(400)
+            self.write({"error": "user_id is required"})
+            return
+
+        limit_value = self.get_argument("limit", default="10")
+        offset_value = self.get_argument("offset", default="0")
+        try:
+            limit = int(limit_value)
+            offset = int(offset_value)
+            if limit <= 0 or offset < 0:
+                raise ValueError(f"Invalid pagination: limit={limit} (must > 0), offset={offset} (must >= 0)")
+            fields = parse_fields(self.get_argument("fields", default=None))
+            primary = parse_consistency(self.get_argument("consistency", default=None))
+        except ValueError as e:
+            logging.warning("Validation error on /records/feed: %s (limit=%r, offset=%r)", e, limit_value, offset_value)
+            self.set_status(400)
+            self.write({"error": str(e)})
+            return
+
+        params = (user_id, limit, offset, fields)
+        try:
+            if await self.not_modified(lambda: RecordsService.feed_version(user_id, primary), *params):
+                return
+            items, version = await RecordsService.get_feed_versioned(user_id, limit, offset, fields,
+                                                                     raw_json=True, primary=primary)
+        except Exception as e:
+            logging.exception("[get_feed] failed")
+            self.set_error_status(e)
+            self.write({"error": "failed to fetch recent records"})
+            return
+
+        self.set_version_etag(version, *params)
+        self.write_json({"user_id": user_id, "offset": offset, "limit": limit, "count": len(items), "items": items})
+
+
+class RecordsStatsHandler(SecureHandler):
+    """GET /records/stats?user_id=..&game=..   one user in one game (+ the game's distinct users)
+    GET /records/stats?user_id=..            one user, per game and totals
+    GET /records/stats?game=..               the game's distinct users
+
+    Served from counters kept up to date by every upsert, so the cost doesn't depend on the
+    number of records. Counters only cover writes made since they were introduced.
+    """
+
+    async def get(self):
+        user_id = self.get_argument("user_id", default="")
+        game = self.get_argument("game", default="")
+        if not user_id and not game:
+            self.set_status(400)
+            self.write({"error": "user_id or game is required"})
+            return
+
+        try:
+            primary = parse_consistency(self.get_argument("consistency", default=None))
+        except ValueError as e:
+            self.set_status(400)
+            self.write({"error": str(e)})
+            return
+
+        try:
+            if user_id and game:
+                stats = await RecordsService.get_stats(user_id, game, primary)
+            elif user_id:
+                stats = await RecordsService.get_user_stats(user_id, primary)
+            else:
+                stats = await RecordsService.get_game_stats(game, primary)
+        except Exception as e:
+            logging.exception("[get_stats] failed")
+            self.set_error_status(e)
+            self.write({"error": "failed to fetch stats"})
+            return
+
+        self.write(stats)
+
+
+class RecordsExportHandler(SecureHandler):
+    """GET /records/export?user_id=..[&game=..][&fields=..][&consistency=..]
+
+    Streams every stored record of a user (one game, or all of them) as NDJSON, one record per
+    line, flushing after each batch read from Redis. The flush waits for the
+    client to drain the socket, so a slow reader slows the export down instead of growing
+    buffers, and a client that disconnects stops it.
+    """
+
+    def on_connection_close(self):
+        self._client_gone = True
+
+    async def get(self):
+        user_id = self.get_argument("user_id", default="")
+        game = self.get_argument("game", default="") or None
+        if not user_id:
+            self.set_status(400)
+            self.write({"error": "user_id is required"})
+            return
+
+        try:
+            fields = parse_fields(self.get_argument("fields", default=None))
+            primary = parse_consistency(self.get_argument("consistency", default=None))
+        except ValueError as e:
+            self.set_status(400)
+            self.write({"error": str(e)})
+            return
+
+        self._client_gone = False
+        exported = 0
+        started = False
+        records = RecordsService.export(user_id, game, fields, primary)
+        try:
+            async for batch in records:
+                if self._client_gone:
+                    break
+                if not started:
+                    self.set_header("Content-Type", "application/x-ndjson; charset=UTF-8")
+                    started = True
+                self.write(b"".join(json_response.dumps(rec) + b"\n" for rec in batch))
+                await self.flush()
+                exported += len(batch)
+        except StreamClosedError:
+            self._client_gone = True
+        except Exception as e:
+            logging.exception("[export] failed after %d record(s)", exported)
+            if not started:
+                self.set_error_status(e)
+                self.write({"error": "failed to export records"})
+                return
+            # Headers are gone: drop the connection so the client sees a truncated response.
+            self.request.connection.close()
+            return
+        finally:
+            await records.aclose()
+
+        if self._client_gone:
+            logging.info("[export] client went away after %d record(s) (user_id=%s)", exported, user_id)
+            return
+        if not started:
+            self.set_header("Content-Type", "application/x-ndjson; charset=UTF-8")
+        logging.debug("[export] %d record(s) (user_id=%s, game=%s)", exported, user_id, game)
+
+
+class RecordsEventsHandler(SecureHandler):
+    """GET /records/events?user_id=..&game=..[&fields=..]
+
+    Server-sent events (text/event-stream) for one user index: a `created` or `updated` event
+    per write, with the record (read from the primary, projected to `fields`) as data and the
+    stream entry id as event id. A client that reconnects with Last-Event-ID (or ?last_id=)
+    first gets the events it missed, as far back as the stream keeps them
+    (RECORDS_EVENTS_MAXLEN / RECORDS_EVENTS_TTL); a client that falls too far behind is
+    disconnected and resumes the same way.
+    """
+
+    def on_connection_close(self):
+        sub = getattr(self, "_sub", None)
+        if sub is not None:
+            sub.close()
+
+    async def get(self):
+        user_id = self.get_argument("user_id", default="")
+        game = self.get_argument("game", default="")
+        if not user_id or not game:
+            self.set_status(400)
+            self.write({"error": "user_id and game are required"})
+            return
+        if not RecordEvents.enabled():
+            self.set_status(404)
+            self.write({"error": "change events are disabled"})
+            return
+
+        last_id = self.request.headers.get("Last-Event-ID") or self.get_argument("last_id", default=None)
+        try:
+            fields = parse_fields(self.get_argument("fields", default=None))
+            last_seen = parse_event_id(last_id) if last_id else None
+        except ValueError as e:
+            self.set_status(400)
+            self.write({"error": str(e)})
+            return
+
+        try:
+            # Subscribe before reading what was missed, so nothing falls in between.
+            self._sub = await RecordEvents.subscribe(user_id, game)
+            missed = await RecordEvents.since(user_id, game, last_id) if last_id else []
+        except Exception as e:
+            if getattr(self, "_sub", None) is not None:
+                RecordEvents.unsubscribe(self._sub)
+            logging.exception("[events] subscribe failed")
+            self.set_error_status(e)
+            self.write({"error": "failed to subscribe to record events"})
+            return
+
+        self.detach_inflight()
+        self.set_header("Content-Type", "text/event-stream; charset=UTF-8")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("X-Accel-Buffering", "no")
+        try:
+            self.write(b": connected\n\n")
+            await self.flush()
+            for event in missed:
+                last_seen = await self._send(user_id, game, fields, event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(self._sub.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    self.write(b": ping\n\n")
+                    await self.flush()
+                    continue
+                if event is None:
+                    break  # closed: client gone, too far behind, or shutting down
+                if last_seen is not None and parse_event_id(event[0]) <= last_seen:
+                    continue  # already sent from the missed events
+                last_seen = await self._send(user_id, game, fields, event)
+        except StreamClosedError:
+            pass
+        except Exception:
+            logging.exception("[events] stream failed (user_id=%s, game=%s)", user_id, game)
+            self.request.connection.close()
+        finally:
+            RecordEvents.unsubscribe(self._sub)
+
+    async def _send(self, user_id: str, game: str, fields, event):
+        event_id, data = event
+        rec = await RecordsService.get_one(user_id, game, data["match_id"], fields, raw_json=True, primary=True)
+        if rec is not None:  # (expired since)
+            kind = b"created" if data.get("created") == "1" else b"updated"
+            self.write(b"id: " + event_id.encode() + b"\nevent: " + kind + b"\ndata: "
+                       + json_response.dumps(rec) + b"\n\n")
+            await self.flush()
+        return parse_event_id(event_id)
 
 
 def make_app() -> Application:
     def _log_request(handler):
         status = handler.get_status()
+        Metrics.observe_request(type(handler).__name__, handler.request.method,
+                                status, handler.request.request_time())
+        if not mylog.should_log_access(status):
+            return
+
+        # INFO para <400, WARNING para 4xx, ERROR para 5xx
+        level = logging.INFO if status < 400 else (logging.WARNING if status < 500 else logging.ERROR)
+        if not logging.root.isEnabledFor(level):
+            return
+
         rt_ms = handler.request.request_time() * 1000.0
         ip = handler.request.remote_ip
         method = handler.request.method
         uri = handler.request.uri
         reason = getattr(handler, "_reason", "")
 
-        # INFO para <400, WARNING para 4xx, ERROR para 5xx
-        logger = logging.info if status < 400 else (logging.warning if status < 500 else logging.error)
-
         if status >= 400:
-            logger("%d %s %s (%s) %.2fms; reason=%s",
-                   status, method, uri, ip, rt_ms, reason)
+            logging.log(level, "%d %s %s (%s) %.2fms; reason=%s",
+                        status, method, uri, ip, rt_ms, reason)
         else:
-            logger("%d %s %s (%s) %.2fms",
-                   status, method, uri, ip, rt_ms)
+            logging.log(level, "%d %s %s (%s) %.2fms",
+                        status, method, uri, ip, rt_ms)
 
     return Application(
         [
             (r"/ping", HealthHandler),
+            (r"/metrics", MetricsHandler),
             (r"/record", RecordHandler),
             (r"/records", RecordsGetRecentHandler),
+            (r"/records/batch", RecordsBatchHandler),
             (r"/record/output", RecordSetOutputHandler),
+            (r"/records/feed", RecordsFeedHandler),
+            (r"/records/export", RecordsExportHandler),
+            (r"/records/stats", RecordsStatsHandler),
+            (r"/records/events", RecordsEventsHandler),
         ],
+        transforms=[ResponseCompression] if RESPONSE_GZIP else [],
         log_function=_log_request,
     )
 
 
-def install_signal_handlers(ioloop: tornado.ioloop.IOLoop):
+# Seconds a worker waits for in-flight requests before closing Redis on SIGTERM/SIGINT
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "10"))
+
+
+async def drain_and_stop(server: HTTPServer, ioloop: tornado.ioloop.IOLoop):
+    """Stop accepting connections, wait for in-flight requests, then close Redis and the loop."""
+    server.stop()
+
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    while SecureHandler.inflight > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    if SecureHandler.inflight > 0:
+        logging.warning("Drain timeout after %.1fs; %d request(s) still in flight",
+                        SHUTDOWN_DRAIN_SECONDS, SecureHandler.inflight)
+    else:
+        logging.info("All in-flight requests drained")
+
+    await server.close_all_connections()
+    await stop_background_tasks()
+    await RedisConnectionAsync.close()
+    ioloop.stop()
+
+
+def install_signal_handlers(ioloop: tornado.ioloop.IOLoop, server: HTTPServer):
+    stopping = False
+
+    def _shutdown():
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        return drain_and_stop(server, ioloop)
+
     def _signal(sig, frame):
         logging.info(f"Received signal {sig}, shutting down...")
-        ioloop.add_callback_from_signal(ioloop.stop)
+        ioloop.add_callback_from_signal(_shutdown)
 
     signal.signal(signal.SIGTERM, _signal)
     signal.signal(signal.SIGINT, _signal)
 
 
+# Max worker restarts before the supervisor gives up (same default as tornado.process)
+MAX_WORKER_RESTARTS = int(os.environ.get("MAX_WORKER_RESTARTS", "100"))
+
+
+def fork_workers(num_workers: int) -> int:
+    """Pre-fork supervisor: fork N workers sharing the bound sockets and restart dead ones.
+
+    Returns the worker id inside each child. The parent never returns: it forwards
+    SIGTERM/SIGINT to the workers (so each one drains) and exits once all of them
+    have exited cleanly. Workers re-install their own signal handlers after fork and log to
+    their own file (server.<worker id>.log; the supervisor keeps server.log).
+    """
+    if num_workers <= 0:
+        num_workers = tornado.process.cpu_count()
+
+    children = {}
+    stopping = False
+
+    def _start(worker_id: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            mylog.use_worker_file(worker_id)
+            return worker_id
+        children[pid] = worker_id
+        return None
+
+    def _forward(sig, frame):
+        nonlocal stopping
+        logging.info(f"Supervisor received signal {sig}, stopping {len(children)} worker(s)...")
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _forward)
+    signal.signal(signal.SIGINT, _forward)
+
+    logging.info(f"Starting {num_workers} worker(s)")
+    for i in range(num_workers):
+        worker_id = _start(i)
+        if worker_id is not None:
+            return worker_id
+
+    restarts = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in children:
+            continue
+        worker_id = children.pop(pid)
+
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+            logging.info(f"Worker {worker_id} (pid {pid}) exited normally")
+            continue
+        if stopping:
+            logging.warning(f"Worker {worker_id} (pid {pid}) exited with status {status} during shutdown")
+            continue
+
+        restarts += 1
+        if restarts > MAX_WORKER_RESTARTS:
+            logging.error("Too many worker restarts, giving up")
+            sys.exit(1)
+        logging.warning(f"Worker {worker_id} (pid {pid}) died (status {status}), restarting")
+        worker_id = _start(worker_id)
+        if worker_id is not None:
+            return worker_id
+
+    logging.info("All workers stopped")
+    sys.exit(0)
+
+
+# Startup connection attempts before giving up (0 = keep retrying)
+REDIS_STARTUP_RETRIES = int(os.environ.get("REDIS_STARTUP_RETRIES", "0"))
+
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.environ.get(name, default).lower() in {"1", "true", "yes", "on"}
+
+
+def _parse_nodes(value: str):
+    """Parse "host:port,host:port" into [(host, port), ...]; the port defaults to 6379."""
+    nodes = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            host, _, port = item.rpartition(":") if ":" in item else (item, "", "6379")
+            nodes.append((host, int(port)))
+    return nodes
+
+
 async def start_async_redis():
-    try:
-        await RedisConnectionAsync.start(
-            host=os.environ.get("REDIS_SERVER", "localhost"),
-            port=int(os.environ.get("REDIS_PORT", "6379")),
-            password=os.environ.get("REDIS_PASSWORD", "") or None,
-        )
-    except Exception:
-        logging.exception("Failed to connect to Redis at startup.")
-        sys.exit(1)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            await RedisConnectionAsync.start(
+                host=os.environ.get("REDIS_SERVER", "localhost"),
+                port=int(os.environ.get("REDIS_PORT", "6379")),
+                password=os.environ.get("REDIS_PASSWORD", "") or None,
+                max_connections=int(os.environ.get("REDIS_MAX_CONNECTIONS", "50")),
+                pool_blocking=_env_flag("REDIS_POOL_BLOCKING"),
+                pool_timeout=float(os.environ.get("REDIS_POOL_TIMEOUT", "1")),
+                connect_timeout=float(os.environ.get("REDIS_CONNECT_TIMEOUT", "2")),
+                command_timeout=float(os.environ.get("REDIS_COMMAND_TIMEOUT", "2")),
+                retries=int(os.environ.get("REDIS_RETRIES", "2")),
+                breaker_failures=int(os.environ.get("REDIS_BREAKER_FAILURES", "5")),
+                breaker_reset=float(os.environ.get("REDIS_BREAKER_RESET", "5")),
+                cluster=_env_flag("REDIS_CLUSTER"),
+                replicas=_parse_nodes(os.environ.get("REDIS_REPLICAS", "")),
+                replica_check_interval=float(os.environ.get("REDIS_REPLICA_CHECK_INTERVAL", "2")),
+                replica_max_lag=int(os.environ.get("REDIS_REPLICA_MAX_LAG", "0")),
+            )
+            return
+        except Exception as exc:
+            if REDIS_STARTUP_RETRIES and attempt >= REDIS_STARTUP_RETRIES:
+                logging.exception("Failed to connect to Redis at startup.")
+                sys.exit(1)
+            # Exponential backoff with jitter, capped at 30s
+            delay = min(30.0, 0.5 * 2 ** min(attempt, 6)) * random.uniform(0.5, 1.0)
+            logging.warning("Redis not reachable at startup (attempt %d): %s; retrying in %.1fs",
+                            attempt, exc, delay)
+            await asyncio.sleep(delay)
+
+
+async def start_background_tasks(worker_id):
+    Metrics.start_loop_monitor()
+    RecordsCache.start_listener()
+    RedisConnectionAsync.start_replica_checks()
+    WriteBuffer.start(RecordsService.write_many)
+    # Maintenance runs in one process only (worker 0, or the single-process server).
+    if worker_id in (None, 0):
+        IndexSweeper.start()
+        ArchiveMover.start()
+
+
+async def stop_background_tasks():
+    await WriteBuffer.stop()  # flushes what is still buffered, so before Redis is closed
+    await Metrics.stop_loop_monitor()
+    await IndexSweeper.stop()
+    await ArchiveMover.stop()
+    RecordArchive.close()
+    await RecordEvents.stop_listener()
+    await RecordsCache.stop_listener()
+    await RedisConnectionAsync.stop_replica_checks()
 
 
 if __name__ == "__main__":
     VERSION = '4c'
     mylog.start()
 
+    # Config errors fail here, once, before forking (not in every worker, which the supervisor
+    # would keep restarting).
+    try:
+        RateLimiter.load()
+    except ValueError as exc:
+        logging.error(str(exc))
+        sys.exit(1)
+
+    # WORKERS=1 (default) keeps the single-process server; 0 means one worker per CPU.
+    workers = int(os.environ.get("WORKERS", "1"))
+    sockets = tornado.netutil.bind_sockets(int(os.environ.get("PORT", "8890")))
+
+    task_id = None
+    if workers != 1:
+        # Parent stays in fork_workers supervising; each child continues with its worker id.
+        task_id = fork_workers(workers)
+
     AsyncIOMainLoop().install()
     loop = tornado.ioloop.IOLoop.current()
 
+    # Each worker owns its Redis client/pool (created after fork).
     loop.run_sync(start_async_redis)
+    loop.run_sync(lambda: start_background_tasks(task_id))
 
+    register_metrics()
     app = make_app()
-    app.listen(int(os.environ.get("PORT", "8890")))
+    # Gzip request bodies are decoded by the server; max_body_size bounds both the wire and the
+    # decoded size (handlers then apply their own, lower, limits).
+    server = HTTPServer(app, decompress_request=True,
+                        max_body_size=max(MAX_BODY_BYTES, BATCH_MAX_BODY_BYTES))
+    server.add_sockets(sockets)
+
+    # With several workers behind one socket a scrape of /metrics hits a random worker;
+    # METRICS_PORT gives each worker its own /metrics listener on METRICS_PORT + worker id.
+    metrics_port = int(os.environ.get("METRICS_PORT", "0"))
+    if metrics_port:
+        Application([(r"/metrics", MetricsHandler)]).listen(metrics_port + (task_id or 0))
 
-    if is_dev_mode():
+    if is_dev_mode() and task_id is None:
         tornado.autoreload.start()
         logging.info("Autoreload enabled (dev mode).")
 
-    install_signal_handlers(loop)
-    logging.info(f"Server started version {VERSION}")
+    install_signal_handlers(loop, server)
+    if task_id is None:
+        logging.info(f"Server started version {VERSION}")
+    else:
+        logging.info(f"Worker {task_id} (pid {os.getpid()}) started version {VERSION}")
 
     try:
         loop.start()
     finally:
         loop.run_sync(RedisConnectionAsync.close)
         logging.info("Server stopped")
+        mylog.stop()
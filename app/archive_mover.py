@@ -0,0 +1,164 @@
+# archive_mover.py
+# Background mover of the archive tier: old records go from Redis to the SQLite archive
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from redis_connection_async import RedisConnectionAsync
+from records_service import TTL_SECONDS, USER_INDEX_PATTERN, key_record_from_index, key_user_archived
+from record_archive import RecordArchive, Row
+
+# Seconds between passes over all indexes
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get("RECORDS_ARCHIVE_INTERVAL", "600"))
+# Records per move (ZRANGEBYSCORE + HGETALL pipeline + one SQLite transaction + one drop call)
+ARCHIVE_BATCH = int(os.environ.get("RECORDS_ARCHIVE_BATCH", "500"))
+# Pause between batches so a pass never monopolizes the loop or Redis
+ARCHIVE_PAUSE_SECONDS = float(os.environ.get("RECORDS_ARCHIVE_PAUSE", "0.01"))
+
+# Drops archived records from Redis, unless they were written after being read for the
+# archive (their copy in Redis then stays the current one, and stays in the index). Dropped
+# match_ids go to the user index's archived set, which tells UPSERT_SCRIPT to restore them.
+# KEYS: user index, user/game archived set, then one record hash per record
+# ARGV: archived set ttl, then per record: match_id, rev ('' if none), updated_at as archived
+# Returns the number of records dropped.
+ARCHIVE_DROP_SCRIPT = """
+local dropped = 0
+for i = 3, #KEYS do
+    local base = (i - 3) * 3 + 1
+    local cur = redis.call('HMGET', KEYS[i], 'rev', 'updated_at')
+    if (cur[1] or '') == ARGV[base + 2] and cur[2] == ARGV[base + 3] then
+        redis.call('DEL', KEYS[i])
+        redis.call('ZREM', KEYS[1], ARGV[base + 1])
+        redis.call('SADD', KEYS[2], ARGV[base + 1])
+        dropped = dropped + 1
+    end
+end
+if dropped > 0 then
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+end
+return dropped
+"""
+RedisConnectionAsync.register_script("archive_drop", ARCHIVE_DROP_SCRIPT)
+
+
+class ArchiveMover:
+    """Walks the user indexes (SCAN) and moves records whose index score is older than
+    RECORDS_ARCHIVE_AFTER_DAYS into the archive: read the hashes, write them to SQLite
+    (committed), then drop them from Redis with ARCHIVE_DROP_SCRIPT. A crash in between
+    leaves a record in both tiers, which reads handle (Redis wins); nothing is dropped
+    before it is stored. Runs in one process only; each pass also purges expired rows.
+
+    Only current-layout indexes are moved: legacy ones expire on their own, and their record
+    keys aren't in the index's cluster slot.
+    """
+
+    _task: Optional[asyncio.Task] = None
+
+    passes = 0
+    moved = 0
+    kept = 0
+    purged = 0
+
+    @classmethod
+    def start(cls) -> None:
+        if not RecordArchive.enabled() or ARCHIVE_INTERVAL_SECONDS <= 0 or cls._task is not None:
+            return
+        cls._task = asyncio.create_task(cls._run())
+        logging.info(f"[archive] Mover started (every {ARCHIVE_INTERVAL_SECONDS:.0f}s)")
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        try:
+            await cls._task
+        except asyncio.CancelledError:
+            pass
+        cls._task = None
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            "passes": cls.passes,
+            "moved": cls.moved,
+            "kept": cls.kept,
+            "purged": cls.purged,
+        }
+
+    @classmethod
+    async def _run(cls) -> None:
+        while True:
+            await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+            try:
+                moved = cls.moved
+                await cls.move_once()
+                logging.info(f"[archive] Pass done, moved {cls.moved - moved} record(s)")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("[archive] Pass failed")
+
+    @classmethod
+    async def move_once(cls) -> None:
+        """One pass over every user index, then the purge of expired archive rows."""
+        r = RedisConnectionAsync.client()
+        cutoff = RecordArchive.cutoff()
+        async for idx_key in r.scan_iter(match=USER_INDEX_PATTERN, count=ARCHIVE_BATCH, _type="zset"):
+            if idx_key.startswith("user:{"):
+                await cls.move_index(idx_key, cutoff)
+        cls.purged += await RecordArchive.purge_expired() or 0
+        cls.passes += 1
+
+    @classmethod
+    async def move_index(cls, idx_key: str, cutoff: float) -> None:
+        r = RedisConnectionAsync.client()
+        raw = RedisConnectionAsync.raw_client()
+        start = 0  # entries before it were kept in Redis (rewritten meanwhile, or already expired)
+        while True:
+            entries = await r.zrangebyscore(idx_key, "-inf", f"({cutoff!r}", start=start, num=ARCHIVE_BATCH,
+                                            withscores=True)
+            if not entries:
+                return
+
+            pipe = raw.pipeline(transaction=False)
+            for mid, _ in entries:
+                key = key_record_from_index(idx_key, mid)
+                await pipe.hgetall(key)
+                await pipe.pttl(key)
+            replies = await pipe.execute()
+
+            # (current layout: user:{<user_id>}:<game>:records)
+            user_id, _, game = idx_key[len("user:{"):-len(":records")].partition("}:")
+            now = time.time()
+            rows: List[Row] = []
+            drop_keys: List[str] = []
+            drop_args: List[Any] = [TTL_SECONDS]
+            for (mid, score), h, pttl in zip(entries, replies[0::2], replies[1::2]):
+                if b"updated_at" not in h:
+                    continue  # expired: the IndexSweeper removes the entry
+                rev = h.get(b"rev", b"").decode("ascii")
+                updated_at = h[b"updated_at"].decode("utf-8")
+                created_at = h.get(b"created_at")
+                expires_at = now + (pttl / 1000 if pttl > 0 else TTL_SECONDS)
+                rows.append((user_id, game, mid, score, created_at.decode("utf-8") if created_at else None,
+                             updated_at, h.get(b"input"), h.get(b"output"), rev or None, expires_at))
+                drop_keys.append(key_record_from_index(idx_key, mid))
+                drop_args += [mid, rev, updated_at]
+
+            dropped = 0
+            if rows:
+                await RecordArchive.store(rows)
+                dropped = await RedisConnectionAsync.run_script(
+                    "archive_drop", [idx_key, key_user_archived(user_id, game), *drop_keys], drop_args
+                )
+            cls.moved += dropped
+            cls.kept += len(rows) - dropped
+            start += len(entries) - dropped
+            if len(entries) < ARCHIVE_BATCH:
+                return
+            await asyncio.sleep(ARCHIVE_PAUSE_SECONDS)
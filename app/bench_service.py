@@ -0,0 +1,156 @@
+# bench_service.py
+# Micro-benchmarks for RecordsService against an in-process Redis stand-in (or a local Redis)
+#
+#   python bench_service.py                 # fakeredis if installed (pip install fakeredis lupa)
+#   python bench_service.py --redis         # Redis at REDIS_SERVER:REDIS_PORT (default localhost:6379)
+#   python bench_service.py -n 5000 --payload-bytes 4096 --only upsert,get_recent
+#
+# fakeredis runs in this process, so absolute numbers mostly measure the service code and the
+# client (encoding, codec, pipelines); compare runs of the same setup, not setups.
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from redis_connection_async import RedisConnectionAsync, InstrumentedRedis
+from records_service import RecordsService, key_game_users
+from loadtest import percentile
+
+try:  # optional in-process stand-in
+    import fakeredis  # pip install fakeredis lupa
+except ImportError:  # pragma: no cover - depends on the environment
+    fakeredis = None
+
+BENCH_USER = "bench-user"
+BENCH_GAME = "bench"
+
+
+async def connect(use_redis: bool) -> str:
+    if use_redis or fakeredis is None:
+        host = os.environ.get("REDIS_SERVER", "localhost")
+        port = int(os.environ.get("REDIS_PORT", "6379"))
+        await RedisConnectionAsync.start(host=host, port=port, password=os.environ.get("REDIS_PASSWORD") or None,
+                                         retries=0)
+        return f"redis {host}:{port}"
+
+    # Same client classes as production, on top of fakeredis connection pools.
+    server = fakeredis.FakeServer()
+    RedisConnectionAsync._client = InstrumentedRedis(
+        connection_pool=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True).connection_pool
+    )
+    RedisConnectionAsync._raw_client = InstrumentedRedis(
+        connection_pool=fakeredis.aioredis.FakeRedis(server=server).connection_pool
+    )
+    await RedisConnectionAsync.load_scripts()
+    return "fakeredis (in-process)"
+
+
+async def measure(name: str, n: int, op: Callable[[int], Awaitable[Any]], batch: int = 1) -> Dict[str, Any]:
+    """Run op(i) n times sequentially; latencies are per call, ops/s counts batch items per call."""
+    for i in range(min(50, n)):  # warm-up
+        await op(i)
+    latencies: List[float] = []
+    start = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        await op(i)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "bench": name,
+        "calls": n,
+        "ops_per_s": round(n * batch / elapsed, 1),
+        "p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "p95_us": round(percentile(latencies, 95) * 1e6, 1),
+        "p99_us": round(percentile(latencies, 99) * 1e6, 1),
+    }
+
+
+async def run(n: int, payload_bytes: int, only: Optional[List[str]], use_redis: bool) -> List[Dict[str, Any]]:
+    backend = await connect(use_redis)
+    print(f"Backend: {backend}; n={n}, payload={payload_bytes}B", file=sys.stderr)
+
+    payload = {"data": "x" * payload_bytes, "values": list(range(10))}
+    mids = [f"m-{i}" for i in range(n + 50)]
+
+    # Index to read from, so the read benchmarks don't depend on the write ones
+    await RecordsService.upsert_many([
+        {"user_id": BENCH_USER, "match_id": f"seed-{i}", "game": BENCH_GAME, "input": payload, "output": payload}
+        for i in range(100)
+    ])
+
+    benches: Dict[str, Callable[[], Awaitable[Dict[str, Any]]]] = {
+        "upsert": lambda: measure("upsert", n, lambda i: RecordsService.upsert(
+            BENCH_USER, mids[i], BENCH_GAME, input_data=payload)),
+        "set_output": lambda: measure("set_output", n, lambda i: RecordsService.set_output(
+            BENCH_USER, mids[i], BENCH_GAME, payload)),
+        "upsert_many_50": lambda: measure("upsert_many_50", max(1, n // 50), lambda i: RecordsService.upsert_many([
+            {"user_id": BENCH_USER, "match_id": f"batch-{i}-{j}", "game": BENCH_GAME, "input": payload}
+            for j in range(50)
+        ]), batch=50),
+        "get_one": lambda: measure("get_one", n, lambda i: RecordsService.get_one(
+            BENCH_USER, BENCH_GAME, f"seed-{i % 100}")),
+        "get_one_raw": lambda: measure("get_one_raw", n, lambda i: RecordsService.get_one(
+            BENCH_USER, BENCH_GAME, f"seed-{i % 100}", raw_json=True)),
+        "get_recent_10": lambda: measure("get_recent_10", n, lambda i: RecordsService.get_recent(
+            BENCH_USER, BENCH_GAME, 10, 0)),
+        "get_recent_100": lambda: measure("get_recent_100", max(1, n // 10), lambda i: RecordsService.get_recent(
+            BENCH_USER, BENCH_GAME, 100, 0)),
+        "get_page_10": lambda: measure("get_page_10", n, lambda i: RecordsService.get_page(
+            BENCH_USER, BENCH_GAME, 10)),
+    }
+    unknown = set(only or ()) - set(benches)
+    if unknown:
+        raise ValueError(f"Unknown benchmark(s): {', '.join(sorted(unknown))}. Available: {', '.join(benches)}")
+
+    results = []
+    try:
+        for name, bench in benches.items():
+            if only and name not in only:
+                continue
+            results.append(await bench())
+    finally:
+        if use_redis or fakeredis is None:
+            # The bench user's keys share its hash tag; the game's distinct-users HLL is the one
+            # key outside it.
+            client = RedisConnectionAsync.client()
+            async for key in client.scan_iter(match=f"*{{{BENCH_USER}}}*"):
+                await client.delete(key)
+            await client.delete(key_game_users(BENCH_GAME))
+        await RedisConnectionAsync.close()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="RecordsService micro-benchmarks.")
+    ap.add_argument("-n", type=int, default=2000, help="calls per benchmark")
+    ap.add_argument("--payload-bytes", type=int, default=512, help="filler size of input/output payloads")
+    ap.add_argument("--only", help="comma-separated benchmark names")
+    ap.add_argument("--redis", action="store_true", help="use the Redis at REDIS_SERVER:REDIS_PORT")
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    args = ap.parse_args(argv)
+
+    only = [b.strip() for b in args.only.split(",")] if args.only else None
+    try:
+        results = asyncio.run(run(args.n, args.payload_bytes, only, args.redis))
+    except ValueError as e:
+        ap.error(str(e))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        cols = ("calls", "ops_per_s", "p50_us", "p95_us", "p99_us")
+        print(f"{'bench':<18}" + "".join(f"{c:>12}" for c in cols))
+        for r in results:
+            print(f"{r['bench']:<18}" + "".join(f"{r[c]:>12}" for c in cols))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+# import_records.py
+# Bulk import / backfill: loads NDJSON records straight into Redis through RecordsService
+#
+#   python import_records.py backup.ndjson                    # checkpoint in backup.ndjson.checkpoint
+#   python import_records.py part-*.ndjson --batch 2000 --concurrency 8
+#   python import_records.py big.ndjson --restart             # ignore the checkpoint, start over
+#
+# One record per line, in the shape /records/export writes (or the /record body):
+#   {"user_id": "u1", "match_id": "m1", "game": "fruits", "input": {...}, "output": {...},
+#    "created_at": "2024-05-01 10:00:00", "updated_at": "2024-05-01 10:02:00"}
+# "match" is accepted for "match_id" and an explicit "score" (epoch seconds) overrides the one
+# derived from updated_at. Timestamps are kept, so records land at their original index position.
+# Lines that don't parse are counted, reported and skipped.
+#
+# The checkpoint stores, per file, the byte offset up to which every record is written; it only
+# advances past batches Redis confirmed, so an interrupted import resumes there. The batches that
+# were in flight are sent again, but records are written "only if newer": one whose index score
+# is already at or past the imported one is skipped (counted as "already there"), so a resumed
+# import doesn't bump rev/stats twice or re-emit change events. A record that was trimmed
+# from its index (RECORDS_INDEX_MAX) is written again.
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from redis_connection_async import RedisConnectionAsync
+from records_service import RecordsService, score_from_timestamp, _now_iso_gmt_minus3
+
+load_dotenv()
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 2.0
+
+# Batch = (sequence number, items, byte offset right after its last line)
+Batch = Tuple[int, List[Dict[str, Any]], int]
+
+
+def parse_line(line: bytes) -> Dict[str, Any]:
+    """Turn one NDJSON line into a write_many item; raises ValueError if it isn't a record."""
+    obj = json.loads(line)
+    if not isinstance(obj, dict):
+        raise ValueError("not a JSON object")
+
+    item: Dict[str, Any] = {}
+    for key, aliases in (("user_id", ("user_id",)), ("match_id", ("match_id", "match")), ("game", ("game",))):
+        value = next((obj[a] for a in aliases if a in obj), None)
+        if not isinstance(value, str) or not value:
+            raise ValueError(f"missing or invalid '{key}'")
+        item[key] = value
+
+    item["input"] = obj.get("input")
+    item["output"] = obj.get("output")
+    if item["input"] is None and item["output"] is None:
+        raise ValueError("record has neither input nor output")
+
+    updated_at = obj.get("updated_at") or obj.get("created_at") or _now_iso_gmt_minus3()
+    created_at = obj.get("created_at") or updated_at
+    if not isinstance(updated_at, str) or not isinstance(created_at, str):
+        raise ValueError("invalid created_at/updated_at")
+    score = obj.get("score")
+    if score is None:
+        score = score_from_timestamp(updated_at)
+    elif isinstance(score, bool) or not isinstance(score, (int, float)):
+        raise ValueError("invalid 'score'")
+
+    item["updated_at"] = updated_at
+    item["created_at"] = created_at
+    item["score"] = float(score)
+    item["only_newer"] = True
+    return item
+
+
+class Checkpoint:
+    """Per-file byte offsets of fully imported data, saved atomically (write + rename)."""
+
+    def __init__(self, path: str, restart: bool):
+        self.path = path
+        self.offsets: Dict[str, int] = {}
+        if not restart and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.offsets = json.load(f).get("files", {})
+
+    def get(self, file: str) -> int:
+        return int(self.offsets.get(os.path.abspath(file), 0))
+
+    def save(self, file: str, offset: int) -> None:
+        self.offsets[os.path.abspath(file)] = offset
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.offsets, "saved_at": time.time()}, f)
+        os.replace(tmp, self.path)
+
+
+class Progress:
+    def __init__(self, total_bytes: int):
+        self.total_bytes = total_bytes
+        self.started = time.perf_counter()
+        self.last_print = self.started
+        self.records = 0
+        self.created = 0
+        self.existing = 0  # already at or past the imported version (resumed/repeated imports)
+        self.skipped = 0
+        self.retries = 0
+        self.bytes_done = 0
+        self.bytes_resumed = 0  # already imported by an earlier run (not part of the throughput)
+
+    def line(self) -> str:
+        elapsed = max(1e-9, time.perf_counter() - self.started)
+        pct = f" {100 * self.bytes_done / self.total_bytes:5.1f}%" if self.total_bytes else ""
+        return (f"[import]{pct} {self.records} records ({self.created} new, {self.existing} already there), "
+                f"{self.skipped} skipped, "
+                f"{self.records / elapsed:,.0f} rec/s, {(self.bytes_done - self.bytes_resumed) / elapsed / 1e6:.1f} MB/s, "
+                f"{elapsed:.0f}s")
+
+    def maybe_print(self) -> None:
+        now = time.perf_counter()
+        if now - self.last_print >= PROGRESS_INTERVAL:
+            self.last_print = now
+            print(self.line(), file=sys.stderr, flush=True)
+
+
+async def read_batches(path: str, start: int, batch_size: int, queue: asyncio.Queue, progress: Progress) -> int:
+    """Parse `path` from byte `start` into batches on `queue`; returns the number of batches."""
+    seq = 0
+    items: List[Dict[str, Any]] = []
+    offset = start
+    with open(path, "rb") as f:
+        f.seek(start)
+        for lineno, line in enumerate(f, 1):
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                items.append(parse_line(line))
+            except ValueError as e:
+                progress.skipped += 1
+                where = f"line {lineno}" if start == 0 else f"line {lineno} after offset {start}"
+                print(f"[import] {path}: {where} skipped: {e}", file=sys.stderr)
+                continue
+            if len(items) >= batch_size:
+                await queue.put((seq, items, offset))
+                seq += 1
+                items = []
+    # Last batch (possibly empty: it still carries the final offset, past trailing skipped lines)
+    await queue.put((seq, items, offset))
+    return seq + 1
+
+
+async def write_batch(items: List[Dict[str, Any]], retries: int, progress: Progress) -> List[Any]:
+    for attempt in range(retries + 1):
+        try:
+            return await RecordsService.write_many(items)
+        except (RedisConnectionError, RedisTimeoutError) as e:
+            if attempt == retries:
+                raise
+            progress.retries += 1
+            delay = max(min(30.0, 0.5 * 2 ** attempt), RedisConnectionAsync.breaker.retry_after())
+            print(f"[import] batch failed ({e}); retrying in {delay:.1f}s", file=sys.stderr)
+            await asyncio.sleep(delay)
+    return []
+
+
+async def import_file(path: str, checkpoint: Checkpoint, batch_size: int, concurrency: int,
+                      retries: int, progress: Progress) -> None:
+    start = checkpoint.get(path)
+    size = os.path.getsize(path)
+    if start > size:
+        raise ValueError(f"{path}: checkpoint offset {start} is past the end of the file ({size} bytes); "
+                         f"the file changed, use --restart")
+    progress.bytes_done += start
+    progress.bytes_resumed += start
+    if start == size:
+        print(f"[import] {path}: already imported", file=sys.stderr)
+        return
+    if start:
+        print(f"[import] {path}: resuming at byte {start}", file=sys.stderr)
+
+    # Bounded queue: the reader never gets more than a few batches ahead of the writers.
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    done: Dict[int, int] = {}  # completed batch seq -> end offset, until the watermark passes it
+    next_seq = 0
+    last_offset = start
+
+    async def writer():
+        nonlocal next_seq, last_offset
+        while True:
+            batch: Optional[Batch] = await queue.get()
+            if batch is None:
+                return
+            seq, items, end = batch
+            if items:
+                res = await write_batch(items, retries, progress)
+                progress.records += len(items)
+                progress.created += sum(1 for r in res if r == 1)
+                progress.existing += sum(1 for r in res if r == -2)
+            done[seq] = end
+            # Batches finish out of order; only the contiguous prefix is safe to checkpoint.
+            advanced = False
+            while next_seq in done:
+                end = done.pop(next_seq)
+                progress.bytes_done += end - last_offset
+                last_offset = end
+                next_seq += 1
+                advanced = True
+            if advanced:
+                checkpoint.save(path, last_offset)
+            progress.maybe_print()
+
+    async def feed():
+        await read_batches(path, start, batch_size, queue, progress)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    # A failed writer fails the import right away (the reader would otherwise block on the queue).
+    tasks = [asyncio.create_task(feed()), *(asyncio.create_task(writer()) for _ in range(concurrency))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+async def run(files: List[str], checkpoint_path: Optional[str], restart: bool,
+              batch_size: int, concurrency: int, retries: int) -> Progress:
+    await RedisConnectionAsync.start(
+        host=os.environ.get("REDIS_SERVER", "localhost"),
+        port=int(os.environ.get("REDIS_PORT", "6379")),
+        password=os.environ.get("REDIS_PASSWORD", "") or None,
+        max_connections=max(concurrency + 2, 10),
+        command_timeout=float(os.environ.get("REDIS_COMMAND_TIMEOUT", "30")),
+        cluster=os.environ.get("REDIS_CLUSTER", "0").lower() in {"1", "true", "yes", "on"},
+    )
+    progress = Progress(sum(os.path.getsize(f) for f in files))
+    shared = Checkpoint(checkpoint_path, restart) if checkpoint_path else None
+    try:
+        for path in files:
+            checkpoint = shared or Checkpoint(path + ".checkpoint", restart)
+            await import_file(path, checkpoint, batch_size, concurrency, retries, progress)
+    finally:
+        await RedisConnectionAsync.close()
+    return progress
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Import NDJSON records straight into Redis (resumable).")
+    ap.add_argument("files", nargs="+", help="NDJSON files, one record per line")
+    ap.add_argument("--batch", type=int, default=1000, help="records per pipeline")
+    ap.add_argument("--concurrency", "-c", type=int, default=4, help="pipelines in flight")
+    ap.add_argument("--checkpoint", help="checkpoint file (default: <file>.checkpoint next to each file)")
+    ap.add_argument("--restart", action="store_true", help="ignore existing checkpoints")
+    ap.add_argument("--retries", type=int, default=5, help="attempts per batch on connection errors/timeouts")
+    args = ap.parse_args(argv)
+
+    if args.batch <= 0 or args.concurrency <= 0:
+        ap.error("--batch and --concurrency must be > 0")
+    missing = [f for f in args.files if not os.path.isfile(f)]
+    if missing:
+        ap.error(f"no such file: {', '.join(missing)}")
+
+    started = time.perf_counter()
+    try:
+        progress = asyncio.run(run(args.files, args.checkpoint, args.restart,
+                                   args.batch, args.concurrency, args.retries))
+    except KeyboardInterrupt:
+        print("[import] interrupted; run again to resume from the checkpoint", file=sys.stderr)
+        return 130
+    except ValueError as e:
+        ap.error(str(e))
+
+    print(progress.line(), file=sys.stderr)
+    print(f"[import] done in {time.perf_counter() - started:.1f}s"
+          f"{f', {progress.retries} retried batch(es)' if progress.retries else ''}", file=sys.stderr)
+    return 1 if progress.skipped else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
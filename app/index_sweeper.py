@@ -0,0 +1,157 @@
+# index_sweeper.py
+# Background cleanup of per-user indexes: drops members whose record hash expired
+from __future__ import annotations
+
+import os
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from redis_connection_async import RedisConnectionAsync
+from records_service import (
+    INDEX_MAX_LEN, LEGACY_KEY_READS, TTL_SECONDS, USER_INDEX_PATTERN, key_record_from_index, key_user_games,
+)
+
+# Seconds between full passes over all indexes (0 disables the sweeper)
+SWEEP_INTERVAL_SECONDS = float(os.environ.get("INDEX_SWEEP_INTERVAL", "300"))
+# SCAN/ZSCAN COUNT hint; also the most members checked by one SWEEP_SCRIPT call
+SWEEP_BATCH = int(os.environ.get("INDEX_SWEEP_BATCH", "200"))
+# Pause between batches so a pass never monopolizes the loop or Redis
+SWEEP_PAUSE_SECONDS = float(os.environ.get("INDEX_SWEEP_PAUSE", "0.01"))
+
+# Removes index members whose record hash is gone. Checked and removed in one atomic call, so
+# a record re-created meanwhile never loses its (re-added) index entry.
+# KEYS: user index, then one record hash per member
+# ARGV: the members, in KEYS order
+# Returns the number of members removed.
+SWEEP_SCRIPT = """
+local removed = 0
+for i = 2, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 0 then
+        removed = removed + redis.call('ZREM', KEYS[1], ARGV[i - 1])
+    end
+end
+return removed
+"""
+RedisConnectionAsync.register_script("index_sweep", SWEEP_SCRIPT)
+
+
+class IndexSweeper:
+    """Walks `user:*:records` incrementally (SCAN + ZSCAN) and ZREMs stale members.
+
+    Readers just skip index entries whose record is gone; this task is what actually
+    removes them, and it also enforces RECORDS_INDEX_MAX on indexes that grew before
+    the cap was configured. While LEGACY_KEY_READS is on it also adds each index's game to
+    its user's games set, which upserts only keep from the time the set was introduced (so
+    the feed and exports, which read just that set, also see older indexes).
+    """
+
+    _task: Optional[asyncio.Task] = None
+
+    passes = 0
+    indexes_scanned = 0
+    members_checked = 0
+    members_removed = 0
+    members_trimmed = 0
+    games_added = 0
+    _registered: Set[str] = set()  # indexes whose game this process already put in the games set
+
+    @classmethod
+    def start(cls) -> None:
+        if SWEEP_INTERVAL_SECONDS <= 0 or cls._task is not None:
+            return
+        cls._task = asyncio.create_task(cls._run())
+        logging.info(f"[sweeper] Started (every {SWEEP_INTERVAL_SECONDS:.0f}s)")
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        try:
+            await cls._task
+        except asyncio.CancelledError:
+            pass
+        cls._task = None
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            "passes": cls.passes,
+            "indexes_scanned": cls.indexes_scanned,
+            "members_checked": cls.members_checked,
+            "members_removed": cls.members_removed,
+            "members_trimmed": cls.members_trimmed,
+            "games_added": cls.games_added,
+        }
+
+    @classmethod
+    async def _run(cls) -> None:
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+            try:
+                removed = cls.members_removed
+                await cls.sweep_once()
+                logging.info(f"[sweeper] Pass done, removed {cls.members_removed - removed} stale member(s)")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("[sweeper] Pass failed")
+
+    @classmethod
+    async def sweep_once(cls) -> None:
+        """One incremental pass over every user index."""
+        r = RedisConnectionAsync.client()
+        async for idx_key in r.scan_iter(match=USER_INDEX_PATTERN, count=SWEEP_BATCH, _type="zset"):
+            if RedisConnectionAsync.cluster and not idx_key.startswith("user:{"):
+                continue  # legacy layout: its record keys aren't in the index's slot (and predate cluster mode)
+            await cls.sweep_index(idx_key)
+            cls.indexes_scanned += 1
+        cls.passes += 1
+
+    @classmethod
+    async def sweep_index(cls, idx_key: str) -> None:
+        r = RedisConnectionAsync.client()
+        cursor = 0
+        while True:
+            cursor, members = await r.zscan(idx_key, cursor, count=SWEEP_BATCH)
+            if members:
+                mids = [mid for mid, _ in members]
+                keys = [key_record_from_index(idx_key, mid) for mid in mids]
+                cls.members_removed += await RedisConnectionAsync.run_script("index_sweep", [idx_key, *keys], mids)
+                cls.members_checked += len(mids)
+
+            if cursor == 0:
+                break
+            await asyncio.sleep(SWEEP_PAUSE_SECONDS)
+
+        if INDEX_MAX_LEN > 0:
+            cls.members_trimmed += await r.zremrangebyrank(idx_key, 0, -INDEX_MAX_LEN - 1)
+        if LEGACY_KEY_READS:
+            await cls.register_game(idx_key)
+
+    @classmethod
+    async def register_game(cls, idx_key: str) -> None:
+        """SADD the index's game to its user's games set (once per index and process)."""
+        if idx_key in cls._registered:
+            return
+        r = RedisConnectionAsync.client()
+        if idx_key.startswith("user:{"):
+            user_id, _, game = idx_key[len("user:{"):-len(":records")].partition("}:")
+        else:
+            # Legacy layout: ':' may be part of the user_id or the game, so take them from a record.
+            newest = await r.zrevrange(idx_key, 0, 0)
+            if not newest:
+                return
+            user_id, game = await r.hmget(key_record_from_index(idx_key, newest[0]), ["user_id", "game"])
+            if not user_id or not game:
+                return
+        games_key = key_user_games(user_id)
+        added = await r.sadd(games_key, game)
+        if added:
+            # Only a set the sweeper just created (or grew) needs a TTL; upserts keep it afterwards.
+            await r.expire(games_key, TTL_SECONDS)
+            cls.games_added += added
+        if len(cls._registered) > 100_000:
+            cls._registered.clear()
+        cls._registered.add(idx_key)
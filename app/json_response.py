@@ -0,0 +1,71 @@
+# json_response.py
+# JSON response encoding that splices stored JSON fragments (RawJSON) without re-parsing them
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Iterable, Iterator, List
+
+from record_codec import RawJSON
+
+_encode_plain = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def _encode_into(obj: Any, out: Callable[[bytes], None]) -> None:
+    if isinstance(obj, RawJSON):
+        out(obj)
+    elif isinstance(obj, dict):
+        out(b"{")
+        first = True
+        for k, v in obj.items():
+            if not first:
+                out(b",")
+            first = False
+            out(_encode_plain(str(k)).encode("utf-8"))
+            out(b":")
+            _encode_into(v, out)
+        out(b"}")
+    elif isinstance(obj, (list, tuple)):
+        out(b"[")
+        first = True
+        for v in obj:
+            if not first:
+                out(b",")
+            first = False
+            _encode_into(v, out)
+        out(b"]")
+    else:
+        out(_encode_plain(obj).encode("utf-8"))
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode obj as UTF-8 JSON; RawJSON values are written verbatim."""
+    parts: List[bytes] = []
+    _encode_into(obj, parts.append)
+    return b"".join(parts)
+
+
+def iter_chunks(head: dict, items_key: str, items: Iterable[Any], chunk_items: int) -> Iterator[bytes]:
+    """Yield the JSON of `{**head, items_key: items}` in pieces of about `chunk_items` items,
+    so a handler can flush between them. The items list is written last."""
+    parts: List[bytes] = []
+    out = parts.append
+
+    head_json = dumps(head)
+    out(head_json[:-1])  # drop the closing brace
+    if len(head_json) > 2:
+        out(b",")
+    out(_encode_plain(items_key).encode("utf-8"))
+    out(b":[")
+
+    n = 0
+    for item in items:
+        if n:
+            out(b",")
+        _encode_into(item, out)
+        n += 1
+        if n % chunk_items == 0:
+            yield b"".join(parts)
+            parts.clear()
+
+    out(b"]}")
+    yield b"".join(parts)
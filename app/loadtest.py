@@ -0,0 +1,290 @@
+# loadtest.py
+# Async load generator: replays recorded NDJSON traffic or a synthetic mix against a running server
+#
+#   python loadtest.py --mix record=3,output=3,recent=3,get=1 --concurrency 50 --duration 30
+#   python loadtest.py --replay traffic.ndjson --rate 500
+#
+# Replay lines are JSON objects: {"method": "POST", "path": "/record", "body": {...}}
+# (body optional, dict bodies are sent as JSON). Lines that don't parse are skipped.
+from __future__ import annotations
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from dotenv import load_dotenv
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+load_dotenv()
+
+BASE_URL = os.getenv("BASE_URL", "http://localhost:8890")
+API_KEY = os.getenv("API_SECRET_KEY", "")
+
+# Request = (label, method, path, body bytes or None)
+Request = Tuple[str, str, str, Optional[bytes]]
+
+DEFAULT_MIX = "record=3,output=3,recent=3,get=1"
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list (0 for an empty one)."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SyntheticTraffic.KINDS:
+            raise ValueError(f"Unknown request kind '{name}' (choose from {', '.join(SyntheticTraffic.KINDS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class SyntheticTraffic:
+    """Endless, seeded stream of the service's usual calls.
+
+    `record` creates a new match (input only), `output` sets the output of a match created
+    earlier (the input-then-output flow), `recent` lists a user's records, `get` reads one.
+    """
+
+    KINDS = ("record", "output", "recent", "get")
+
+    def __init__(self, mix: Dict[str, float], users: int, game: str, payload_bytes: int, seed: int):
+        self.rng = random.Random(seed)
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.users = [f"load-user-{i}" for i in range(users)]
+        self.game = game
+        self.filler = "x" * payload_bytes
+        self.matches: Dict[str, List[str]] = defaultdict(list)
+        self.counter = 0
+
+    def __iter__(self) -> Iterator[Request]:
+        return self
+
+    def __next__(self) -> Request:
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        user = self.rng.choice(self.users)
+        known = self.matches[user]
+        if kind in ("output", "get") and not known:
+            kind = "record"
+
+        if kind == "record":
+            self.counter += 1
+            match = f"m-{self.counter}"
+            known.append(match)
+            if len(known) > 1000:
+                del known[:500]
+            body = {"user_id": user, "game": self.game, "match": match,
+                    "input": {"bet": self.rng.randint(1, 100), "data": self.filler}}
+            return kind, "POST", "/record", json.dumps(body).encode()
+        if kind == "output":
+            body = {"user_id": user, "game": self.game, "match": self.rng.choice(known[-50:]),
+                    "output": {"win": self.rng.randint(0, 500), "data": self.filler}}
+            return kind, "PUT", "/record/output", json.dumps(body).encode()
+        if kind == "recent":
+            body = {"user_id": user, "game": self.game, "limit": 10}
+            return kind, "POST", "/records", json.dumps(body).encode()
+        path = f"/record?user_id={user}&game={self.game}&match={self.rng.choice(known)}"
+        return kind, "GET", path, None
+
+
+def replay(f: TextIO, loop_forever: bool) -> Iterator[Request]:
+    """Requests from an open NDJSON file, in order (again and again with loop_forever)."""
+    while True:
+        sent = 0
+        for line in f:
+            try:
+                item = json.loads(line)
+                method = item.get("method", "GET").upper()
+                req_path = item["path"]
+            except (ValueError, KeyError, AttributeError):
+                continue
+            body = item.get("body")
+            if body is not None and not isinstance(body, str):
+                body = json.dumps(body)
+            label = f"{method} {req_path.split('?')[0]}"
+            sent += 1
+            yield label, method, req_path, body.encode() if body is not None else None
+        if not loop_forever or not sent:
+            return
+        f.seek(0)
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.started = time.perf_counter()
+        self.finished = self.started
+
+    def add(self, label: str, status: int, seconds: float) -> None:
+        self.latencies[label].append(seconds)
+        self.statuses[label][status] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = max(1e-9, self.finished - self.started)
+
+        def stats(lat: List[float], statuses: Dict[int, int]) -> Dict[str, Any]:
+            lat = sorted(lat)
+            # 4xx count too: a run whose requests are rejected (401, 404, 429) measured nothing useful
+            errors = sum(n for code, n in statuses.items() if code >= 400)
+            return {
+                "requests": len(lat),
+                "errors": errors,
+                "rps": round(len(lat) / elapsed, 1),
+                "p50_ms": round(percentile(lat, 50) * 1000, 2),
+                "p95_ms": round(percentile(lat, 95) * 1000, 2),
+                "p99_ms": round(percentile(lat, 99) * 1000, 2),
+                "max_ms": round((lat[-1] if lat else 0) * 1000, 2),
+                "status": dict(sorted(statuses.items())),
+            }
+
+        all_lat = [v for lat in self.latencies.values() for v in lat]
+        all_status: Dict[int, int] = defaultdict(int)
+        for st in self.statuses.values():
+            for code, n in st.items():
+                all_status[code] += n
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "total": stats(all_lat, all_status),
+            "by_request": {label: stats(lat, self.statuses[label]) for label, lat in sorted(self.latencies.items())},
+        }
+
+
+async def run(
+    requests: Iterator[Request],
+    base_url: str,
+    api_key: str,
+    concurrency: int,
+    rate: float,
+    duration: float,
+    max_requests: int,
+    timeout: float,
+) -> Results:
+    """Send requests with `concurrency` workers until duration/max_requests is reached.
+    With rate > 0 requests start on a fixed schedule (open loop) instead of back to back, and
+    latency counts from the scheduled start: a request that had to wait for a free worker
+    (because the server stalled) includes that wait, instead of hiding it (coordinated omission)."""
+    AsyncHTTPClient.configure(None, max_clients=concurrency)
+    client = AsyncHTTPClient()
+    headers = {"Content-Type": "application/json", "X-API-KEY": api_key}
+    results = Results()
+    deadline = results.started + duration if duration > 0 else None
+    issued = 0
+
+    def next_request() -> Optional[Tuple[int, Request]]:
+        nonlocal issued
+        if max_requests and issued >= max_requests:
+            return None
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        try:
+            req = next(requests)
+        except StopIteration:
+            return None
+        issued += 1
+        return issued - 1, req
+
+    async def worker():
+        while True:
+            item = next_request()
+            if item is None:
+                return
+            seq, (label, method, path, body) = item
+            if rate > 0:
+                start = results.started + seq / rate
+                delay = start - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                start = time.perf_counter()
+            try:
+                resp = await client.fetch(HTTPRequest(
+                    base_url + path, method=method, headers=headers, body=body,
+                    request_timeout=timeout, allow_nonstandard_methods=True,
+                ), raise_error=False)
+                status = resp.code
+            except Exception:
+                status = 599
+            results.add(label, status, time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    results.finished = time.perf_counter()
+    client.close()
+    return results
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    cols = ("requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    print(f"\nElapsed: {summary['elapsed_s']}s")
+    print(f"{'request':<24}" + "".join(f"{c:>10}" for c in cols))
+    rows = [*summary["by_request"].items(), ("TOTAL", summary["total"])]
+    for label, st in rows:
+        print(f"{label:<24}" + "".join(f"{st[c]:>10}" for c in cols))
+    print("Status codes:", summary["total"]["status"])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Load generator for the records service.")
+    ap.add_argument("--url", default=BASE_URL, help="server base URL (env BASE_URL)")
+    ap.add_argument("--api-key", default=API_KEY, help="X-API-KEY (env API_SECRET_KEY)")
+    ap.add_argument("--replay", metavar="FILE", help="NDJSON file of recorded requests to replay")
+    ap.add_argument("--loop", action="store_true", help="replay the file again when it ends")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"synthetic mix weights (default {DEFAULT_MIX})")
+    ap.add_argument("--users", type=int, default=100, help="synthetic users")
+    ap.add_argument("--game", default="loadtest")
+    ap.add_argument("--payload-bytes", type=int, default=256, help="filler size of input/output payloads")
+    ap.add_argument("--seed", type=int, default=1, help="seed of the synthetic stream (same seed, same requests)")
+    ap.add_argument("--concurrency", "-c", type=int, default=20)
+    ap.add_argument("--rate", type=float, default=0, help="target requests/s (0 = as fast as possible)")
+    ap.add_argument("--duration", "-d", type=float, default=10, help="seconds to run (0 = no limit)")
+    ap.add_argument("--requests", "-n", type=int, default=0, help="stop after this many requests")
+    ap.add_argument("--timeout", type=float, default=10)
+    ap.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = ap.parse_args(argv)
+
+    if args.duration <= 0 and not args.requests and not (args.replay and not args.loop):
+        ap.error("nothing would stop the run: give --duration or --requests")
+
+    replay_file: Optional[TextIO] = None
+    try:
+        if args.replay:
+            # Opened here so a missing/unreadable file is a usage error, not a failure mid-run.
+            replay_file = open(args.replay, encoding="utf-8")
+            requests = replay(replay_file, args.loop)
+        else:
+            requests = SyntheticTraffic(parse_mix(args.mix), args.users, args.game, args.payload_bytes, args.seed)
+    except (OSError, ValueError) as e:
+        ap.error(str(e))
+
+    try:
+        results = asyncio.run(run(
+            requests, args.url.rstrip("/"), args.api_key, args.concurrency, args.rate,
+            args.duration, args.requests, args.timeout,
+        ))
+    finally:
+        if replay_file is not None:
+            replay_file.close()
+    summary = results.summary()
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    return 1 if summary["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# metrics.py
+# In-process metrics (counters, gauges, histograms) rendered in Prometheus text format
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() not in {"0", "false", "no"}
+# Event-loop lag sampling period in seconds
+LOOP_LAG_INTERVAL = float(os.environ.get("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+# Latency buckets (seconds) shared by HTTP and Redis histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for lv, v in self._values.items():
+            yield f"{self.name}{_fmt_labels(self.labels, lv)} {_fmt_value(v)}"
+
+
+class Gauge:
+    """Gauge whose samples come from a callback at scrape time (nothing to update on hot paths)."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[LabelValues, float]]]):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for lv, v in self.collect():
+            yield f"{self.name}{_fmt_labels(self.labels, lv)} {_fmt_value(v)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, labels: LabelValues, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for lv, (counts, total, n) in self._series.items():
+            cumulative = 0
+            for bound, c in zip((*self.buckets, float("inf")), counts):
+                cumulative += c
+                le = 'le="' + _fmt_value(bound) + '"'
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, lv, le)} {cumulative}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, lv)} {_fmt_value(total)}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, lv)} {n}"
+
+
+class Metrics:
+    """Process-wide registry. Recording is a dict lookup plus a bisect, cheap enough to stay on."""
+
+    _registry: List = []
+    _loop_monitor: Optional[asyncio.Task] = None
+    loop_lag_last = 0.0
+    loop_lag_max = 0.0
+
+    http_latency = Histogram(
+        "http_request_duration_seconds", "HTTP request latency by route, method and status.",
+        ("route", "method", "status"),
+    )
+    redis_latency = Histogram(
+        "redis_command_duration_seconds", "Redis command/pipeline latency (PIPELINE = whole pipeline).",
+        ("command",),
+    )
+    redis_errors = Counter(
+        "redis_command_errors_total", "Redis commands/pipelines that raised.", ("command",),
+    )
+    loop_lag = Histogram(
+        "event_loop_lag_seconds", "Delay of a periodic loop callback beyond its schedule.", (),
+    )
+
+    @classmethod
+    def register(cls, metric) -> None:
+        cls._registry.append(metric)
+
+    @classmethod
+    def observe_request(cls, route: str, method: str, status: int, seconds: float) -> None:
+        if METRICS_ENABLED:
+            cls.http_latency.observe((route, method, str(status)), seconds)
+
+    @classmethod
+    def observe_redis(cls, command: str, seconds: float, failed: bool) -> None:
+        if not METRICS_ENABLED:
+            return
+        cls.redis_latency.observe((command,), seconds)
+        if failed:
+            cls.redis_errors.inc((command,))
+
+    @classmethod
+    def render(cls) -> str:
+        lines: List[str] = []
+        for metric in (cls.http_latency, cls.redis_latency, cls.redis_errors, cls.loop_lag, *cls._registry):
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logging.exception(f"[metrics] Failed to render {metric.name}")
+        lines.append("")
+        return "\n".join(lines)
+
+    # ---- event loop lag
+
+    @classmethod
+    def start_loop_monitor(cls) -> None:
+        if not METRICS_ENABLED or cls._loop_monitor is not None:
+            return
+        cls._loop_monitor = asyncio.create_task(cls._monitor_loop())
+
+    @classmethod
+    async def stop_loop_monitor(cls) -> None:
+        if cls._loop_monitor is None:
+            return
+        cls._loop_monitor.cancel()
+        try:
+            await cls._loop_monitor
+        except asyncio.CancelledError:
+            pass
+        cls._loop_monitor = None
+
+    @classmethod
+    async def _monitor_loop(cls) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(0.0, time.perf_counter() - start - LOOP_LAG_INTERVAL)
+            cls.loop_lag_last = lag
+            cls.loop_lag_max = max(cls.loop_lag_max, lag)
+            cls.loop_lag.observe((), lag)
+
+
+def stats_gauge(name: str, help_text: str, stats: Callable[[], Dict], keys: Sequence[str]) -> Gauge:
+    """Expose numeric entries of a stats() dict as one gauge labelled by key."""
+    def collect():
+        data = stats()
+        return [((k,), data[k]) for k in keys if isinstance(data.get(k), (int, float))]
+    return Gauge(name, help_text, ("stat",), collect)
@@ -1,9 +1,22 @@
 import os
+import json
 import time
+import queue
+import atexit
+import random
 import logging
+import threading
 import colorlog
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+# Configuração via ambiente
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()           # "text" ou "json" (JSON lines)
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))      # registros pendentes antes de descartar
+LOG_ACCESS_SAMPLE = float(os.environ.get("LOG_ACCESS_SAMPLE", "1"))  # fração de acessos 2xx/3xx logados
+LOG_REPEAT_LIMIT = int(os.environ.get("LOG_REPEAT_LIMIT", "20"))     # repetições de um WARNING+ por janela (0 = sem limite)
+LOG_REPEAT_WINDOW = float(os.environ.get("LOG_REPEAT_WINDOW", "60"))  # janela em segundos
 
 
 def silence_external_loggers():
@@ -22,12 +35,39 @@ def gmt_minus_3(*args):
     return time.gmtime(time.mktime(time.localtime()) - 3 * 3600)
 
 
+class JsonFormatter(logging.Formatter):
+    """Formata cada registro como uma linha JSON (timestamps em GMT-3)."""
+
+    def __init__(self):
+        super().__init__()
+        self.converter = gmt_minus_3
+
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%d %H:%M:%S") + f",{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "func": record.funcName,
+            "line": record.lineno,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
 def create_file_handler(log_file):
     """Cria handler de log para arquivo com rotação."""
-    file_formatter = logging.Formatter(
-        '%(asctime)s [%(levelname)s] (%(filename)s:%(funcName)s:%(lineno)d): %(message)s'
-    )
-    file_formatter.converter = gmt_minus_3
+    if LOG_FORMAT == "json":
+        file_formatter = JsonFormatter()
+    else:
+        file_formatter = logging.Formatter(
+            '%(asctime)s [%(levelname)s] (%(filename)s:%(funcName)s:%(lineno)d): %(message)s'
+        )
+        file_formatter.converter = gmt_minus_3
 
     file_handler = RotatingFileHandler(
         log_file,
@@ -40,6 +80,11 @@ def create_file_handler(log_file):
 
 def create_console_handler():
     """Cria handler de log para console com cores."""
+    if LOG_FORMAT == "json":
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(JsonFormatter())
+        return console_handler
+
     color_formatter = colorlog.ColoredFormatter(
         '%(log_color)s%(asctime)s [%(levelname)s] (%(filename)s:%(funcName)s:%(lineno)d): %(message)s',
         log_colors={
@@ -79,18 +124,183 @@ def infer_log_folder():
 LOG_FOLDER = infer_log_folder()
 LOG_FILE = LOG_FOLDER / "server.log"
 
+
+def worker_log_file(worker_id):
+    """Arquivo de cada worker: a rotação não é segura com vários processos no mesmo arquivo."""
+    return LOG_FOLDER / f"server.{worker_id}.log"
+
 # Criar diretório se necessário
 os.makedirs(LOG_FOLDER, exist_ok=True)
 
 
+class RepeatFilter(logging.Filter):
+    """Limita tempestades de erros: no máximo LOG_REPEAT_LIMIT registros WARNING+ iguais
+    (mesmo template/arquivo/linha) por janela; o excedente é contado e resumido depois, no
+    próximo registro igual ou, se a tempestade acabou, quando a janela vence (expired_summaries)."""
+
+    def __init__(self, limit, window):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._seen = {}  # chave -> [início da janela, emitidos, suprimidos, origem do registro]
+        self._lock = threading.Lock()  # filter roda no event loop; expired_summaries, na thread de resumos
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno < logging.WARNING:
+            return True
+
+        template = record.msg if isinstance(record.msg, str) else repr(record.msg)
+        key = (template, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state is not None and state[2]:
+                    record.msg = f"{record.msg} [+{state[2]} similar suppressed in last {self.window:.0f}s]"
+                if len(self._seen) > 1000:
+                    self._seen.clear()
+                origin = (record.name, record.levelno, record.pathname, record.lineno, record.funcName, template)
+                self._seen[key] = [now, 1, 0, origin]
+                return True
+
+            if state[1] < self.limit:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+    def expired_summaries(self, everything=False):
+        """Registros-resumo das janelas vencidas (todas, com everything) que suprimiram algo."""
+        now = time.monotonic()
+        summaries = []
+        with self._lock:
+            for key, state in list(self._seen.items()):
+                if not everything and now - state[0] < self.window:
+                    continue
+                del self._seen[key]
+                if state[2]:
+                    name, level, pathname, lineno, func, template = state[3]
+                    msg = f"{template} [{state[2]} similar suppressed in last {self.window:.0f}s]"
+                    summaries.append(logging.LogRecord(name, level, pathname, lineno, msg, None, None, func))
+        return summaries
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler que nunca bloqueia o event loop: com a fila cheia o registro é descartado."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Mensagem e traceback são resolvidos agora, no event loop: os argumentos (dicts, payloads)
+        # ainda podem mudar depois. Na thread do listener fica só a formatação final e a escrita.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+_listener = None
+_queue_handler = None
+_handlers = []
+_repeat_filter = None
+_summaries_stop = None  # threading.Event da thread de resumos do RepeatFilter
+
+
+def should_log_access(status):
+    """Amostragem dos logs de acesso: erros (>= 400) sempre; sucesso com LOG_ACCESS_SAMPLE."""
+    if status >= 400 or LOG_ACCESS_SAMPLE >= 1:
+        return True
+    return LOG_ACCESS_SAMPLE > 0 and random.random() < LOG_ACCESS_SAMPLE
+
+
+def _start_listener():
+    """Cria fila + thread do listener e a thread de resumos (de novo em processos filhos após fork)."""
+    global _listener, _summaries_stop
+    q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler.queue = q
+    _listener = QueueListener(q, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+    if _repeat_filter is not None and _repeat_filter.limit > 0:
+        _summaries_stop = threading.Event()
+        threading.Thread(target=_emit_summaries, args=(_summaries_stop,), name="log-summaries", daemon=True).start()
+
+
+def _emit_summaries(stop_event):
+    """Enfileira, a cada segundo, os resumos de tempestades que acabaram."""
+    while not stop_event.wait(1.0):
+        for record in _repeat_filter.expired_summaries():
+            _queue_handler.enqueue(record)
+
+
+def _stop_threads():
+    global _listener, _summaries_stop
+    if _summaries_stop is not None:
+        _summaries_stop.set()
+        _summaries_stop = None
+        for record in _repeat_filter.expired_summaries(everything=True):
+            _queue_handler.enqueue(record)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def start():
-    """Inicializa o sistema de logging global."""
+    """Inicializa o sistema de logging global.
+
+    Os handlers de arquivo/console rodam numa thread (QueueListener); o event loop apenas
+    enfileira os registros via DroppingQueueHandler.
+    """
+    global _queue_handler, _handlers, _repeat_filter
     silence_external_loggers()
 
-    file_handler = create_file_handler(str(LOG_FILE))
-    console_handler = create_console_handler()
+    _handlers = [create_file_handler(str(LOG_FILE)), create_console_handler()]
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _repeat_filter = RepeatFilter(LOG_REPEAT_LIMIT, LOG_REPEAT_WINDOW)
+    _queue_handler.addFilter(_repeat_filter)
+    _start_listener()
 
     logging.basicConfig(
-        level=logging.DEBUG,
-        handlers=[file_handler, console_handler]
+        level=getattr(logging, LOG_LEVEL, logging.DEBUG),
+        handlers=[_queue_handler]
     )
+
+    # A thread do listener não sobrevive ao fork: cada worker sobe a sua.
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork_in_child)
+    atexit.register(stop)
+
+
+def _after_fork_in_child():
+    if _queue_handler is not None:
+        # O lock pode ter sido copiado travado pela thread de resumos do pai; as contagens são do pai.
+        _repeat_filter._lock = threading.Lock()
+        _repeat_filter._seen = {}
+        _start_listener()
+
+
+def use_worker_file(worker_id):
+    """Num worker recém-criado: troca o server.log herdado do supervisor pelo arquivo do worker
+    (cada RotatingFileHandler só rotaciona o arquivo do seu próprio processo)."""
+    global _handlers
+    if _queue_handler is None:
+        return
+    _stop_threads()
+    # Fecha só a cópia herdada do descritor; o supervisor segue escrevendo no server.log.
+    _handlers[0].close()
+    _handlers = [create_file_handler(str(worker_log_file(worker_id))), *_handlers[1:]]
+    _start_listener()
+
+
+def stop():
+    """Emite os resumos pendentes, esvazia a fila e para as threads do listener e de resumos."""
+    _stop_threads()
@@ -0,0 +1,172 @@
+# rate_limit.py
+# API keys with per-key token buckets, an optional cross-worker limit in Redis, and load shedding
+from __future__ import annotations
+
+import os
+import time
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from redis_connection_async import RedisConnectionAsync
+
+# Keys as "name:secret[:rate[:burst]]", comma-separated; rate is requests/s (0 = unlimited).
+# API_SECRET_KEY, when set, is still accepted as the key of client "default".
+API_KEYS = os.environ.get("API_KEYS", "")
+# Defaults for keys that don't give their own rate/burst (burst defaults to 2 s worth of rate)
+RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", "0"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "0"))
+# Requests/s per key across all workers and instances, counted in Redis (0 disables the check)
+RATE_LIMIT_GLOBAL_RPS = float(os.environ.get("RATE_LIMIT_GLOBAL_RPS", "0"))
+# In-flight requests per process beyond which new ones are shed with 503 (0 disables shedding)
+SHED_INFLIGHT = int(os.environ.get("SHED_INFLIGHT", "0"))
+# In-flight requests per key and process beyond which that key gets 429 (0 = no per-key cap)
+SHED_INFLIGHT_PER_KEY = int(os.environ.get("SHED_INFLIGHT_PER_KEY", "0"))
+
+
+class TokenBucket:
+    """`rate` tokens/s up to `burst`; each request takes one."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """0 when a token was taken, else the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ApiClient:
+    __slots__ = ("name", "bucket", "inflight", "allowed", "limited")
+
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst or 2 * rate) if rate > 0 else None
+        self.inflight = 0
+        self.allowed = 0
+        self.limited = 0
+
+
+def _digest(secret: str) -> bytes:
+    return hashlib.sha256(secret.encode("utf-8")).digest()
+
+
+class RateLimiter:
+    """Process-wide API key registry and admission control.
+
+    Keys are looked up by their SHA-256 (one dict lookup, no timing leak of the secret). The
+    per-key token bucket is checked in-process first; only requests it lets through pay the
+    Redis round trip of the optional global limit (a fixed one-second window per key, shared
+    by every worker). If that Redis check fails the request is let through: the local bucket
+    still bounds each process.
+    """
+
+    _clients: Dict[bytes, ApiClient] = {}
+    _loaded = False
+
+    shed_total = 0
+    global_errors = 0
+
+    @classmethod
+    def load(cls, keys: str = API_KEYS, default_key: Optional[str] = None) -> None:
+        """Parse the key list (and API_SECRET_KEY); raises ValueError on a malformed entry."""
+        clients: Dict[bytes, ApiClient] = {}
+        default_key = os.environ.get("API_SECRET_KEY") if default_key is None else default_key
+        if default_key:
+            clients[_digest(default_key)] = ApiClient("default", RATE_LIMIT_RPS, RATE_LIMIT_BURST)
+        for n, item in enumerate(keys.split(","), 1):
+            item = item.strip()
+            if not item:
+                continue
+            parts = item.split(":")
+            if len(parts) < 2 or len(parts) > 4 or not parts[0] or not parts[1]:
+                # (the entry itself is not echoed: it may be a bare secret)
+                raise ValueError(f"Invalid API_KEYS entry #{n}: expected name:secret[:rate[:burst]]")
+            rate = float(parts[2]) if len(parts) > 2 and parts[2] else RATE_LIMIT_RPS
+            burst = float(parts[3]) if len(parts) > 3 and parts[3] else RATE_LIMIT_BURST
+            clients[_digest(parts[1])] = ApiClient(parts[0], rate, burst)
+        cls._clients = clients
+        cls._loaded = True
+
+    @classmethod
+    def enabled(cls) -> bool:
+        """Whether any limit applies (otherwise admission is just the key lookup)."""
+        return bool(SHED_INFLIGHT or SHED_INFLIGHT_PER_KEY or RATE_LIMIT_GLOBAL_RPS
+                    or any(c.bucket is not None for c in cls._clients.values()))
+
+    @classmethod
+    def configured(cls) -> bool:
+        if not cls._loaded:
+            cls.load()
+        return bool(cls._clients)
+
+    @classmethod
+    def client(cls, key: Optional[str]) -> Optional[ApiClient]:
+        if not key:
+            return None
+        if not cls._loaded:
+            cls.load()
+        return cls._clients.get(_digest(key))
+
+    @staticmethod
+    def overloaded(inflight: int) -> bool:
+        """True when this process is past SHED_INFLIGHT requests in flight."""
+        return 0 < SHED_INFLIGHT < inflight
+
+    @classmethod
+    async def admit(cls, client: ApiClient) -> Tuple[str, float]:
+        """("", 0) to go ahead, or ("concurrency" | "rate" | "global", retry after seconds)."""
+        if 0 < SHED_INFLIGHT_PER_KEY <= client.inflight:
+            client.limited += 1
+            return "concurrency", 1.0
+        if client.bucket is not None:
+            wait = client.bucket.take()
+            if wait:
+                client.limited += 1
+                return "rate", wait
+        if RATE_LIMIT_GLOBAL_RPS > 0:
+            wait = await cls._take_global(client.name)
+            if wait:
+                client.limited += 1
+                return "global", wait
+        client.allowed += 1
+        return "", 0.0
+
+    @classmethod
+    async def _take_global(cls, name: str) -> float:
+        now = time.time()
+        window = int(now)
+        key = f"ratelimit:{{{name}}}:{window}"
+        try:
+            pipe = RedisConnectionAsync.client().pipeline(transaction=False)
+            await pipe.incr(key)
+            await pipe.expire(key, 2)
+            count, _ = await pipe.execute()
+        except Exception as exc:
+            cls.global_errors += 1
+            logging.debug(f"[rate-limit] Global check failed, allowing: {exc}")
+            return 0.0
+        return 0.0 if count <= RATE_LIMIT_GLOBAL_RPS else window + 1 - now
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            "shed_inflight": SHED_INFLIGHT,
+            "shed": cls.shed_total,
+            "global_rps": RATE_LIMIT_GLOBAL_RPS,
+            "global_errors": cls.global_errors,
+            "clients": {
+                c.name: {"inflight": c.inflight, "allowed": c.allowed, "limited": c.limited}
+                for c in cls._clients.values()
+            },
+        }
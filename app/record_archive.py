@@ -0,0 +1,281 @@
+# record_archive.py
+# Optional cold tier: records past RECORDS_ARCHIVE_AFTER_DAYS live in a local SQLite file
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# SQLite file of the archive ("" disables tiering). All workers read it; the mover (worker 0)
+# fills it, and any worker deletes the rows of records a write brings back to Redis, so every
+# worker must see the same file.
+ARCHIVE_PATH = os.environ.get("RECORDS_ARCHIVE_PATH", "")
+# Records not written for this many days are moved out of Redis
+ARCHIVE_AFTER_DAYS = float(os.environ.get("RECORDS_ARCHIVE_AFTER_DAYS", "7"))
+
+# Archive columns; a record's hash fields map to the column of the same name
+COLUMNS = ("user_id", "game", "match_id", "score", "created_at", "updated_at", "input", "output", "rev",
+           "expires_at")
+HASH_COLUMNS = frozenset(("user_id", "match_id", "game", "input", "output", "created_at", "updated_at", "rev"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    user_id    TEXT NOT NULL,
+    game       TEXT NOT NULL,
+    match_id   TEXT NOT NULL,
+    score      REAL NOT NULL,
+    created_at TEXT,
+    updated_at TEXT NOT NULL,
+    input      BLOB,
+    output     BLOB,
+    rev        TEXT,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (user_id, game, match_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS records_by_score ON records (user_id, game, score DESC, match_id DESC);
+CREATE INDEX IF NOT EXISTS records_by_expiry ON records (expires_at);
+"""
+
+# A record archived again (written after a move, then aged out again) keeps its first created_at,
+# and the input/output it had if the new write didn't set them.
+UPSERT_SQL = f"""
+INSERT INTO records ({", ".join(COLUMNS)}) VALUES ({", ".join("?" for _ in COLUMNS)})
+ON CONFLICT (user_id, game, match_id) DO UPDATE SET
+    score = excluded.score, updated_at = excluded.updated_at,
+    input = COALESCE(excluded.input, records.input), output = COALESCE(excluded.output, records.output),
+    rev = excluded.rev, expires_at = excluded.expires_at,
+    created_at = COALESCE(records.created_at, excluded.created_at)
+"""
+
+Row = Tuple[Any, ...]  # values in COLUMNS order
+
+
+def _select(hash_fields: Sequence[str]) -> str:
+    # Only known names reach the SQL text (hash_fields come from RECORD_FIELDS).
+    unknown = set(hash_fields) - HASH_COLUMNS
+    if unknown:
+        raise ValueError(f"Not archived: {', '.join(sorted(unknown))}")
+    return ", ".join(hash_fields)
+
+
+def _as_hash_values(row: Sequence[Any]) -> List[Optional[bytes]]:
+    """Column values as the bytes an HMGET of the record hash would return."""
+    return [v.encode("utf-8") if isinstance(v, str) else v for v in row]
+
+
+class _Connection:
+    """One SQLite connection, used only from its own thread (sqlite3 objects must stay on
+    the thread that created them), so archive I/O never blocks the event loop."""
+
+    def __init__(self, path: str, writer: bool):
+        self.path = path
+        self.writer = writer
+        self.conn: Optional[sqlite3.Connection] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive-" + ("w" if writer else "r"))
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """fn(conn, *args) on the connection's thread; None while a reader has no file to open."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, fn, args)
+
+    def _call(self, fn: Callable[..., Any], args: Tuple[Any, ...]) -> Any:
+        if self.conn is None:
+            self.conn = self._open()
+            if self.conn is None:
+                return None
+        return fn(self.conn, *args)
+
+    def _open(self) -> Optional[sqlite3.Connection]:
+        if not self.writer:
+            if not os.path.exists(self.path):
+                return None  # nothing archived yet
+            return sqlite3.connect(pathlib.Path(self.path).absolute().as_uri() + "?mode=ro", uri=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Writers of several workers (mover, restores) take turns: each waits up to 5 s for the lock.
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        # WAL: readers in other workers are never blocked by the writers' transactions.
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def close(self) -> None:
+        def _close(conn: sqlite3.Connection) -> None:
+            conn.close()
+            self.conn = None
+        if self.conn is not None:
+            self.executor.submit(self._call, _close, ()).result()
+        self.executor.shutdown(wait=True)
+
+
+class RecordArchive:
+    """Read/write access to the archive file.
+
+    Records keep the bytes they had in Redis (input/output in the storage codec format,
+    compressed the same way), so reads build records with the same code as Redis reads.
+    Rows carry the expiry the record had in Redis and are ignored (then purged) past it,
+    so archiving never extends retention. A write to an archived record restores it into
+    Redis (see RecordsService.write_many) and deletes its row.
+    """
+
+    _reader: Optional[_Connection] = None
+    _writer: Optional[_Connection] = None
+
+    reads = 0
+    hits = 0
+    restored = 0
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return bool(ARCHIVE_PATH)
+
+    @classmethod
+    def cutoff(cls) -> float:
+        """Index score below which a record belongs in the archive."""
+        return time.time() - ARCHIVE_AFTER_DAYS * 86400
+
+    @classmethod
+    def _read(cls) -> _Connection:
+        if cls._reader is None:
+            cls._reader = _Connection(ARCHIVE_PATH, writer=False)
+        return cls._reader
+
+    @classmethod
+    def _write(cls) -> _Connection:
+        if cls._writer is None:
+            cls._writer = _Connection(ARCHIVE_PATH, writer=True)
+        return cls._writer
+
+    @classmethod
+    def close(cls) -> None:
+        for conn in (cls._reader, cls._writer):
+            if conn is not None:
+                conn.close()
+        cls._reader = cls._writer = None
+
+    # ---- reads
+
+    @classmethod
+    async def get(cls, user_id: str, game: str, match_id: str,
+                  hash_fields: Sequence[str]) -> Optional[List[Optional[bytes]]]:
+        """HMGET-like values of an archived record, None if it isn't archived (or expired)."""
+        sql = (f"SELECT {_select(hash_fields)} FROM records "
+               f"WHERE user_id = ? AND game = ? AND match_id = ? AND expires_at > ?")
+
+        def query(conn: sqlite3.Connection):
+            return conn.execute(sql, (user_id, game, match_id, time.time())).fetchone()
+
+        cls.reads += 1
+        row = await cls._read().run(query)
+        if row is None:
+            return None
+        cls.hits += 1
+        return _as_hash_values(row)
+
+    @classmethod
+    async def recent(cls, user_id: str, game: str, limit: int, offset: int,
+                     hash_fields: Sequence[str]) -> List[Tuple[str, float, List[Optional[bytes]]]]:
+        """(match_id, score, values) of archived records, newest first, offset/limit."""
+        sql = (f"SELECT match_id, score, {_select(hash_fields)} FROM records "
+               f"WHERE user_id = ? AND game = ? AND expires_at > ? "
+               f"ORDER BY score DESC, match_id DESC LIMIT ? OFFSET ?")
+
+        def query(conn: sqlite3.Connection):
+            return conn.execute(sql, (user_id, game, time.time(), limit, offset)).fetchall()
+
+        return await cls._rows(query)
+
+    @classmethod
+    async def after(cls, user_id: str, game: str, after: Optional[Tuple[float, str]], limit: int,
+                    hash_fields: Sequence[str], newest_first: bool = True
+                    ) -> List[Tuple[str, float, List[Optional[bytes]]]]:
+        """(match_id, score, values) of archived records past a (score, match_id) keyset cursor,
+        in index order (newest first) or oldest first."""
+        op, order = ("<", "DESC") if newest_first else (">", "ASC")
+        where = "" if after is None else f"AND (score {op} ? OR (score = ? AND match_id {op} ?)) "
+        sql = (f"SELECT match_id, score, {_select(hash_fields)} FROM records "
+               f"WHERE user_id = ? AND game = ? AND expires_at > ? {where}"
+               f"ORDER BY score {order}, match_id {order} LIMIT ?")
+        params: Tuple[Any, ...] = (user_id, game, time.time())
+        if after is not None:
+            params += (after[0], after[0], after[1])
+
+        def query(conn: sqlite3.Connection):
+            return conn.execute(sql, (*params, limit)).fetchall()
+
+        return await cls._rows(query)
+
+    @classmethod
+    async def recent_in_games(cls, user_id: str, games: Sequence[str], limit: int,
+                              hash_fields: Sequence[str]) -> List[Tuple[str, str, float, List[Optional[bytes]]]]:
+        """(game, match_id, score, values) of a user's archived records in `games`, newest first."""
+        sql = (f"SELECT game, match_id, score, {_select(hash_fields)} FROM records "
+               f"WHERE user_id = ? AND game IN ({', '.join('?' for _ in games)}) AND expires_at > ? "
+               f"ORDER BY score DESC, match_id DESC LIMIT ?")
+
+        def query(conn: sqlite3.Connection):
+            return conn.execute(sql, (user_id, *games, time.time(), limit)).fetchall()
+
+        cls.reads += 1
+        rows = await cls._read().run(query) or []
+        cls.hits += bool(rows)
+        return [(row[0], row[1], row[2], _as_hash_values(row[3:])) for row in rows]
+
+    @classmethod
+    async def _rows(cls, query: Callable[[sqlite3.Connection], List[Row]]
+                    ) -> List[Tuple[str, float, List[Optional[bytes]]]]:
+        cls.reads += 1
+        rows = await cls._read().run(query) or []
+        cls.hits += bool(rows)
+        return [(row[0], row[1], _as_hash_values(row[2:])) for row in rows]
+
+    # ---- writes
+
+    @classmethod
+    async def store(cls, rows: List[Row]) -> None:
+        """Insert or update records (values in COLUMNS order) in one transaction."""
+        def write(conn: sqlite3.Connection):
+            with conn:
+                conn.executemany(UPSERT_SQL, rows)
+
+        await cls._write().run(write)
+
+    @classmethod
+    async def discard(cls, keys: List[Tuple[str, str, str]]) -> None:
+        """Delete the rows of (user_id, game, match_id) records restored into Redis."""
+        def delete(conn: sqlite3.Connection) -> int:
+            with conn:
+                return conn.executemany(
+                    "DELETE FROM records WHERE user_id = ? AND game = ? AND match_id = ?", keys
+                ).rowcount
+
+        cls.restored += await cls._write().run(delete)
+
+    @classmethod
+    async def purge_expired(cls) -> int:
+        def delete(conn: sqlite3.Connection) -> int:
+            with conn:
+                return conn.execute("DELETE FROM records WHERE expires_at <= ?", (time.time(),)).rowcount
+
+        purged = await cls._write().run(delete)
+        if purged:
+            logging.info(f"[archive] Purged {purged} expired record(s)")
+        return purged
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        size = 0
+        if ARCHIVE_PATH and os.path.exists(ARCHIVE_PATH):
+            size = sum(os.path.getsize(p) for p in (ARCHIVE_PATH, ARCHIVE_PATH + "-wal") if os.path.exists(p))
+        return {
+            "path": ARCHIVE_PATH,
+            "after_days": ARCHIVE_AFTER_DAYS,
+            "file_bytes": size,
+            "reads": cls.reads,
+            "hits": cls.hits,
+            "restored": cls.restored,
+        }
@@ -0,0 +1,160 @@
+# record_codec.py
+# Versioned storage format for the large record fields (input/output)
+from __future__ import annotations
+
+import os
+import json
+import zlib
+from typing import Any, Dict, Optional
+
+try:  # optional compact binary encoding
+    import msgpack  # pip install msgpack
+except ImportError:  # pragma: no cover - depends on the deployment
+    msgpack = None
+
+# "json" (default): tagged JSON, zlib above the threshold; "msgpack": binary encoding;
+# "off": legacy plain-text values (what older versions of the service wrote)
+CODEC_MODE = os.environ.get("RECORDS_CODEC", "json").lower()
+# Payloads at least this big (bytes) are compressed
+CODEC_MIN_COMPRESS_BYTES = int(os.environ.get("RECORDS_CODEC_MIN_BYTES", "512"))
+CODEC_ZLIB_LEVEL = int(os.environ.get("RECORDS_CODEC_LEVEL", "6"))
+
+# Stored value layout: MAGIC + VERSION + encoding + compression + payload.
+# Legacy values are plain UTF-8 text and never start with a NUL byte.
+MAGIC = b"\x00RC"
+VERSION = b"\x01"
+ENC_JSON = b"j"
+ENC_MSGPACK = b"m"
+COMP_NONE = b"-"
+COMP_ZLIB = b"z"
+HEADER_LEN = len(MAGIC) + 3
+
+if CODEC_MODE == "msgpack" and msgpack is None:
+    raise RuntimeError("RECORDS_CODEC=msgpack requires the 'msgpack' package")
+
+
+class RawJSON(bytes):
+    """UTF-8 bytes that already hold a valid JSON document; responses splice them in as-is."""
+
+    __slots__ = ()
+
+
+class CodecStats:
+    """Bytes before/after encoding for the values written by this process."""
+
+    values = 0
+    compressed = 0
+    raw_bytes = 0
+    stored_bytes = 0
+
+    @classmethod
+    def as_dict(cls) -> Dict[str, Any]:
+        saved = cls.raw_bytes - cls.stored_bytes
+        return {
+            "mode": CODEC_MODE,
+            "values": cls.values,
+            "compressed": cls.compressed,
+            "raw_bytes": cls.raw_bytes,
+            "stored_bytes": cls.stored_bytes,
+            "saved_bytes": saved,
+            "saved_ratio": round(saved / cls.raw_bytes, 4) if cls.raw_bytes else 0.0,
+        }
+
+
+def _reject_constant(name: str):
+    raise ValueError(f"non-standard JSON constant {name}")
+
+
+def to_json_text(v: Any) -> str:
+    """Canonical JSON text for a payload, keeping the legacy read semantics: dicts/lists as
+    JSON, strings that already are JSON kept verbatim, anything else as a JSON string."""
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, ensure_ascii=False)
+    s = str(v)
+    try:
+        json.loads(s, parse_constant=_reject_constant)
+        return s
+    except ValueError:
+        return json.dumps(s, ensure_ascii=False)
+
+
+def encode(v: Any) -> bytes:
+    """Encode an input/output payload for storage in the record hash."""
+    text = to_json_text(v)
+
+    if CODEC_MODE == "off":
+        data = text.encode("utf-8")
+        CodecStats.values += 1
+        CodecStats.raw_bytes += len(data)
+        CodecStats.stored_bytes += len(data)
+        return data
+
+    raw = text.encode("utf-8")
+    if CODEC_MODE == "msgpack":
+        enc, payload = ENC_MSGPACK, msgpack.packb(json.loads(text), use_bin_type=True)
+    else:
+        enc, payload = ENC_JSON, raw
+
+    comp = COMP_NONE
+    if len(payload) >= CODEC_MIN_COMPRESS_BYTES:
+        packed = zlib.compress(payload, CODEC_ZLIB_LEVEL)
+        if len(packed) < len(payload):
+            comp, payload = COMP_ZLIB, packed
+
+    data = MAGIC + VERSION + enc + comp + payload
+
+    CodecStats.values += 1
+    CodecStats.compressed += comp == COMP_ZLIB
+    CodecStats.raw_bytes += len(raw)
+    CodecStats.stored_bytes += len(data)
+    return data
+
+
+def is_encoded(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+
+def decode(data: Optional[bytes]) -> Any:
+    """Decode a stored payload (tagged or legacy plain text) back into Python values."""
+    if data is None:
+        return None
+    if not is_encoded(data):
+        return _legacy_load(data)
+
+    enc, payload = _unwrap(data)
+    if enc == ENC_MSGPACK:
+        return msgpack.unpackb(payload, raw=False)
+    return json.loads(payload)
+
+
+def decode_fragment(data: Optional[bytes]) -> Any:
+    """Like `decode`, but tagged JSON comes back as RawJSON without being parsed.
+    Only values not stored as JSON text (msgpack, legacy plain text) are decoded."""
+    if data is None:
+        return None
+    if not is_encoded(data):
+        return _legacy_load(data)
+
+    enc, payload = _unwrap(data)
+    if enc == ENC_JSON:
+        return RawJSON(payload)
+    return msgpack.unpackb(payload, raw=False)
+
+
+def _unwrap(data: bytes):
+    version = data[3:4]
+    if version != VERSION:
+        raise ValueError(f"Unsupported record codec version {version!r}")
+    enc, comp = data[4:5], data[5:6]
+    payload = data[HEADER_LEN:]
+    if comp == COMP_ZLIB:
+        payload = zlib.decompress(payload)
+    return enc, payload
+
+
+def _legacy_load(data: bytes) -> Any:
+    s = data.decode("utf-8", errors="replace")
+    try:
+        return json.loads(s)
+    except Exception:
+        return s
@@ -0,0 +1,199 @@
+# record_events.py
+# Push delivery of record change events: one Redis Streams reader per process fans out to subscribers
+from __future__ import annotations
+
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from redis.crc import key_slot
+
+from redis_connection_async import RedisConnectionAsync
+from records_service import EVENTS_MAXLEN, key_user_events
+
+# Longest wait of one XREAD in ms (also how long a newly subscribed stream may wait to join the
+# read); keep it below REDIS_COMMAND_TIMEOUT
+EVENTS_BLOCK_MS = int(os.environ.get("RECORDS_EVENTS_BLOCK_MS", "500"))
+# Events queued for a subscriber that isn't keeping up before it is dropped (it reconnects and
+# resumes from its Last-Event-ID)
+EVENTS_QUEUE_MAX = int(os.environ.get("RECORDS_EVENTS_QUEUE", "100"))
+
+Event = Tuple[str, Dict[str, str]]  # (stream entry id, fields)
+
+
+def parse_event_id(value: str) -> Tuple[int, int]:
+    """Stream entry id "<ms>-<seq>" as a comparable tuple; raises ValueError if malformed."""
+    ms, sep, seq = value.partition("-")
+    if not sep or not ms.isdigit() or not seq.isdigit():
+        raise ValueError(f"Invalid event id '{value}'")
+    return int(ms), int(seq)
+
+
+class Subscription:
+    """One connection's view of a user/game stream: a bounded queue fed by the process listener.
+    `get` returns None once the subscription is closed (overflow, or the listener stopping)."""
+
+    __slots__ = ("key", "queue", "closed")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_MAX + 1)
+        self.closed = False
+
+    async def get(self) -> Optional[Event]:
+        return await self.queue.get()
+
+    def push(self, event: Event) -> bool:
+        if self.closed:
+            return False
+        if self.queue.qsize() >= EVENTS_QUEUE_MAX:
+            self.close()
+            return False
+        self.queue.put_nowait(event)
+        return True
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class RecordEvents:
+    """Fan-out of the events streams UPSERT_SCRIPT appends to.
+
+    Each process runs a single reader over the streams its connections subscribed to: one
+    XREAD BLOCK for all of them (in cluster mode, one non-blocking XREAD per slot in a pipeline,
+    then a pause, since a blocking read can't span slots). A stream is read from where it was
+    when its first subscriber arrived, and dropped from the read once its last one leaves.
+    """
+
+    _streams: Dict[str, Tuple[List[str], Set[Subscription]]] = {}
+    _listener: Optional[asyncio.Task] = None
+    _wakeup: Optional[asyncio.Event] = None
+
+    reads = 0
+    delivered = 0
+    dropped = 0
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return EVENTS_MAXLEN > 0
+
+    @classmethod
+    async def subscribe(cls, user_id: str, game: str) -> Subscription:
+        """Subscribe to the events written from now on (starts the listener on first use)."""
+        if cls._listener is None:
+            cls._wakeup = asyncio.Event()
+            cls._listener = asyncio.create_task(cls._listen())
+        key = key_user_events(user_id, game)
+        sub = Subscription(key)
+        if key not in cls._streams:
+            tail = await RedisConnectionAsync.client().xrevrange(key, count=1)
+            cursor = tail[0][0] if tail else "0-0"
+            # (another subscriber may have registered the stream during the await)
+            cls._streams.setdefault(key, ([cursor], set()))
+        cls._streams[key][1].add(sub)
+        cls._wakeup.set()
+        return sub
+
+    @classmethod
+    def unsubscribe(cls, sub: Subscription) -> None:
+        sub.close()
+        entry = cls._streams.get(sub.key)
+        if entry is None:
+            return
+        entry[1].discard(sub)
+        if not entry[1]:
+            del cls._streams[sub.key]
+
+    @staticmethod
+    async def since(user_id: str, game: str, last_id: str) -> List[Event]:
+        """Events still in the stream after `last_id` (what a reconnecting client missed)."""
+        after = parse_event_id(last_id)
+        entries = await RedisConnectionAsync.client().xrange(key_user_events(user_id, game), min=last_id)
+        return [e for e in entries if parse_event_id(e[0]) > after]
+
+    @classmethod
+    async def stop_listener(cls) -> None:
+        """Stop reading and close every subscription (their connections then end)."""
+        for _, subs in list(cls._streams.values()):
+            for sub in subs:
+                sub.close()
+        cls._streams.clear()
+        if cls._listener is None:
+            return
+        cls._listener.cancel()
+        try:
+            await cls._listener
+        except asyncio.CancelledError:
+            pass
+        cls._listener = None
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            "streams": len(cls._streams),
+            "subscribers": sum(len(subs) for _, subs in cls._streams.values()),
+            "reads": cls.reads,
+            "delivered": cls.delivered,
+            "dropped": cls.dropped,
+        }
+
+    @classmethod
+    async def _listen(cls) -> None:
+        while True:
+            if not cls._streams:
+                cls._wakeup.clear()
+                await cls._wakeup.wait()
+                continue
+            cursors = {key: entry[0][0] for key, entry in cls._streams.items()}
+            try:
+                batches = await cls._read(cursors)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("[events] Stream read failed; retrying in 1s")
+                await asyncio.sleep(1)
+                continue
+            cls.reads += 1
+            cls._dispatch(batches)
+
+    @classmethod
+    async def _read(cls, cursors: Dict[str, str]) -> List[Tuple[str, List[Event]]]:
+        client = RedisConnectionAsync.client()
+        if not RedisConnectionAsync.cluster:
+            res = await client.xread(cursors, count=EVENTS_QUEUE_MAX, block=EVENTS_BLOCK_MS)
+            return list(res.items()) if isinstance(res, dict) else (res or [])
+
+        by_slot: Dict[int, Dict[str, str]] = {}
+        for key, cursor in cursors.items():
+            by_slot.setdefault(key_slot(key.encode("utf-8")), {})[key] = cursor
+        pipe = client.pipeline(transaction=False)
+        for slot_cursors in by_slot.values():
+            await pipe.xread(slot_cursors, count=EVENTS_QUEUE_MAX)
+        batches = [item for res in await pipe.execute() if res
+                   for item in (res.items() if isinstance(res, dict) else res)]
+        if not any(entries for _, entries in batches):
+            await asyncio.sleep(EVENTS_BLOCK_MS / 1000)
+        return batches
+
+    @classmethod
+    def _dispatch(cls, batches: List[Tuple[str, List[Event]]]) -> None:
+        for key, entries in batches:
+            entry = cls._streams.get(key)
+            if entry is None or not entries:
+                continue  # unsubscribed while the read was in flight
+            entry[0][0] = entries[-1][0]
+            for sub in list(entry[1]):
+                for event in entries:
+                    if not sub.push(event):
+                        cls.dropped += 1
+                        entry[1].discard(sub)
+                        break
+                    cls.delivered += 1
+            if not entry[1]:
+                del cls._streams[key]
@@ -0,0 +1,185 @@
+# records_cache.py
+# Optional in-process LRU+TTL cache for record reads, invalidated per user across workers
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+from redis_connection_async import RedisConnectionAsync
+
+# Max cached entries per process (0 disables the cache)
+CACHE_MAX_ENTRIES = int(os.environ.get("RECORDS_CACHE_SIZE", "0"))
+# Seconds an entry stays valid; bounds staleness if an invalidation message is lost
+CACHE_TTL_SECONDS = float(os.environ.get("RECORDS_CACHE_TTL", "5"))
+# Pub/sub channel used to spread invalidations to the other workers/instances
+INVALIDATION_CHANNEL = "records:invalidate"
+
+
+class RecordsCache:
+    """Bounded LRU+TTL cache for get_recent/get_one results.
+
+    Entries are grouped by user_id: any write for a user drops all of that user's
+    entries (every page and every game), locally and, via pub/sub, in other processes.
+    A per-user generation counter keeps a read that raced with a write from caching
+    its (possibly stale) result.
+    """
+
+    _entries: "OrderedDict[Hashable, Tuple[float, str, Any]]" = OrderedDict()
+    _by_user: Dict[str, Set[Hashable]] = {}
+    _generations: Dict[str, int] = {}
+    _epoch = 0
+    _listener: Optional[asyncio.Task] = None
+
+    hits = 0
+    misses = 0
+    evictions = 0
+    expirations = 0
+    invalidations = 0
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return CACHE_MAX_ENTRIES > 0
+
+    @classmethod
+    def generation(cls, user_id: str) -> Tuple[int, int]:
+        """Token to pass back to `put`; it changes whenever the user is invalidated."""
+        return cls._epoch, cls._generations.get(user_id, 0)
+
+    @classmethod
+    def get(cls, key: Hashable) -> Optional[Any]:
+        if not cls.enabled():
+            return None
+
+        entry = cls._entries.get(key)
+        if entry is None:
+            cls.misses += 1
+            return None
+
+        expires_at, user_id, value = entry
+        if expires_at < time.monotonic():
+            cls._drop(key, user_id)
+            cls.expirations += 1
+            cls.misses += 1
+            return None
+
+        cls._entries.move_to_end(key)
+        cls.hits += 1
+        return value
+
+    @classmethod
+    def put(cls, user_id: str, key: Hashable, value: Any, generation: Tuple[int, int]) -> None:
+        if not cls.enabled():
+            return
+        if cls.generation(user_id) != generation:
+            return  # a write for this user happened while we were reading
+
+        cls._entries[key] = (time.monotonic() + CACHE_TTL_SECONDS, user_id, value)
+        cls._entries.move_to_end(key)
+        cls._by_user.setdefault(user_id, set()).add(key)
+
+        while len(cls._entries) > CACHE_MAX_ENTRIES:
+            old_key, (_, old_user, _) = cls._entries.popitem(last=False)
+            cls._forget(old_key, old_user)
+            cls.evictions += 1
+
+    @classmethod
+    def invalidate(cls, user_id: str) -> None:
+        """Drop every cached entry of a user in this process."""
+        if not cls.enabled():
+            return
+        cls._bump(user_id)
+        keys = cls._by_user.pop(user_id, None)
+        if keys:
+            for key in keys:
+                cls._entries.pop(key, None)
+        cls.invalidations += 1
+
+    @classmethod
+    def clear(cls) -> None:
+        """Drop everything cached in this process."""
+        cls._generations.clear()
+        cls._epoch += 1
+        cls._by_user.clear()
+        cls._entries.clear()
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            "enabled": cls.enabled(),
+            "size": len(cls._entries),
+            "max_size": CACHE_MAX_ENTRIES,
+            "ttl_seconds": CACHE_TTL_SECONDS,
+            "hits": cls.hits,
+            "misses": cls.misses,
+            "evictions": cls.evictions,
+            "expirations": cls.expirations,
+            "invalidations": cls.invalidations,
+        }
+
+    @classmethod
+    def _bump(cls, user_id: str) -> None:
+        # Keep the generation map bounded: starting a new epoch invalidates every token at once.
+        if len(cls._generations) >= 4 * CACHE_MAX_ENTRIES:
+            cls._generations.clear()
+            cls._epoch += 1
+        cls._generations[user_id] = cls._generations.get(user_id, 0) + 1
+
+    @classmethod
+    def _drop(cls, key: Hashable, user_id: str) -> None:
+        cls._entries.pop(key, None)
+        cls._forget(key, user_id)
+
+    @classmethod
+    def _forget(cls, key: Hashable, user_id: str) -> None:
+        keys = cls._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del cls._by_user[user_id]
+
+    # ---- cross-process invalidation (Redis pub/sub)
+
+    @classmethod
+    def start_listener(cls) -> None:
+        """Subscribe to the invalidation channel (no-op when the cache is disabled)."""
+        if not cls.enabled() or cls._listener is not None:
+            return
+        cls._listener = asyncio.create_task(cls._listen())
+
+    @classmethod
+    async def stop_listener(cls) -> None:
+        if cls._listener is None:
+            return
+        cls._listener.cancel()
+        try:
+            await cls._listener
+        except asyncio.CancelledError:
+            pass
+        cls._listener = None
+
+    @classmethod
+    async def _listen(cls) -> None:
+        while True:
+            pubsub = RedisConnectionAsync.client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                logging.info(f"[cache] Listening for invalidations on '{INVALIDATION_CHANNEL}'")
+                # Anything cached before (re)subscribing may have missed messages.
+                cls.clear()
+                async for msg in pubsub.listen():
+                    if msg.get("type") == "message":
+                        cls.invalidate(msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("[cache] Invalidation listener failed; retrying in 1s")
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
@@ -2,15 +2,131 @@
 # Business logic for (user_id, match_id) records on Redis
 from __future__ import annotations
 
+import os
 import json
 import time
-from typing import Any, Dict, List, Optional
+import asyncio
+import heapq
+import logging
+import itertools
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
-from redis_connection_async import RedisConnectionAsync
+from redis.exceptions import NoScriptError, ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from redis_connection_async import RedisConnectionAsync, RedisNode
+from records_cache import RecordsCache, INVALIDATION_CHANNEL
+from write_buffer import WriteBuffer
+from record_archive import RecordArchive
+import record_codec
 
 # ---- NOVO: TTL padrão de 7 dias (em segundos)
 TTL_SECONDS = 42 * 24 * 60 * 60  # 42 days
 
+# Max entries kept per user index; older ones are trimmed on write (0 = unbounded)
+INDEX_MAX_LEN = int(os.environ.get("RECORDS_INDEX_MAX", "0"))
+
+# Also read the pre-hash-tag key layout (record:<uid>:..., user:<uid>:...:records). Writes only
+# use the new layout (a write to a legacy record moves it over, inside the upsert script, in
+# standalone mode: legacy keys predate cluster deployments), and old keys expire after
+# TTL_SECONDS, so this can be turned off then.
+LEGACY_KEY_READS = os.environ.get("RECORDS_LEGACY_KEYS", "1").lower() not in {"0", "false", "no"}
+
+# Change events kept per user/game stream for push clients to resume from (0 = no events), and
+# how long a stream outlives its last write
+EVENTS_MAXLEN = int(os.environ.get("RECORDS_EVENTS_MAXLEN", "100"))
+EVENTS_TTL = int(os.environ.get("RECORDS_EVENTS_TTL", str(24 * 60 * 60)))
+
+# Records exported per index read (ZRANGEBYSCORE + one HMGET pipeline) by RecordsService.export
+EXPORT_BATCH = int(os.environ.get("RECORDS_EXPORT_BATCH", "500"))
+
+# Whole upsert in one atomic server-side call (replaces HSETNX, HSET, ZADD and 2x EXPIRE),
+# including the per user/game stats hash. The record's `rev` and the stats' `writes` counters
+# are the version tokens behind ETags (see RecordsService.*_versioned).
+# A change event is appended to the user/game events stream (see record_events.py).
+# A record missing under its key may still exist elsewhere. A legacy-layout copy (optional 6th
+# key) is moved into the new hash first, in the same call, so a partial write keeps the other
+# fields, created_at and rev. For the archive, with the probe flag the script returns -1 without
+# writing if the match_id is in the user index's archived set, and the caller runs it again with
+# the archived row as seed (see RecordsService.write_many).
+# With the only-newer flag a write is skipped (-2, nothing changes) when the record exists and
+# its index score is already at or past the write's: replays (imports) don't apply twice.
+# KEYS: record hash, user index, user games set, user/game stats hash, user/game events stream,
+#       user/game archived set, optionally the legacy record hash
+# ARGV: match_id, score, created_at (kept only if the record is new), updated_at, ttl,
+#       max index length (0 = no trim), game, '1' if the write sets output,
+#       events stream max length (0 = no event), events stream ttl,
+#       '1' to probe, '1' for only-newer, number of seed ARGV entries (n),
+#       n seed field/value entries, then field/value pairs for HSET
+# Returns 1 when the record was created (created_at set), 0 otherwise, -1 when probing found
+# the record archived, -2 when the write was skipped as not newer.
+UPSERT_SCRIPT = """
+local seed_len = tonumber(ARGV[13])
+local exists = redis.call('EXISTS', KEYS[1])
+if exists == 0 then
+    if KEYS[7] and redis.call('EXISTS', KEYS[7]) == 1 then
+        redis.call('HSET', KEYS[1], unpack(redis.call('HGETALL', KEYS[7])))
+        redis.call('DEL', KEYS[7])
+    elseif ARGV[11] == '1' and redis.call('SISMEMBER', KEYS[6], ARGV[1]) == 1 then
+        return -1
+    end
+    redis.call('SREM', KEYS[6], ARGV[1])
+    if seed_len > 0 then
+        redis.call('HSET', KEYS[1], unpack(ARGV, 14, 13 + seed_len))
+    end
+elseif ARGV[12] == '1' then
+    local current = tonumber(redis.call('ZSCORE', KEYS[2], ARGV[1]))
+    if current and current >= tonumber(ARGV[2]) then
+        return -2
+    end
+end
+local had_output = redis.call('HEXISTS', KEYS[1], 'output')
+local created = redis.call('HSETNX', KEYS[1], 'created_at', ARGV[3])
+redis.call('HSET', KEYS[1], unpack(ARGV, 14 + seed_len))
+local rev = redis.call('HINCRBY', KEYS[1], 'rev', 1)
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[7])
+
+local score = tonumber(ARGV[2])
+redis.call('HINCRBY', KEYS[4], 'writes', 1)
+if created == 1 then
+    redis.call('HINCRBY', KEYS[4], 'matches', 1)
+    local first = tonumber(redis.call('HGET', KEYS[4], 'first_score'))
+    if not first or score < first then
+        redis.call('HSET', KEYS[4], 'first_score', ARGV[2], 'first_seen', ARGV[3])
+    end
+end
+if ARGV[8] == '1' and had_output == 0 then
+    redis.call('HINCRBY', KEYS[4], 'with_output', 1)
+end
+local last = tonumber(redis.call('HGET', KEYS[4], 'last_score'))
+if not last or score >= last then
+    redis.call('HSET', KEYS[4], 'last_score', ARGV[2], 'last_seen', ARGV[4])
+end
+
+for i = 1, 4 do
+    redis.call('EXPIRE', KEYS[i], ARGV[5])
+end
+local max_len = tonumber(ARGV[6])
+if max_len > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -max_len - 1)
+end
+
+local events_len = tonumber(ARGV[9])
+if events_len > 0 then
+    redis.call('XADD', KEYS[5], 'MAXLEN', '~', events_len, '*',
+               'match_id', ARGV[1], 'updated_at', ARGV[4], 'rev', rev, 'created', created)
+    redis.call('EXPIRE', KEYS[5], ARGV[10])
+end
+return created
+"""
+RedisConnectionAsync.register_script("upsert", UPSERT_SCRIPT)
+
+
+GMT_MINUS3 = timezone(timedelta(hours=-3))
+
 
 def _now_unix() -> float:
     """Epoch seconds (UTC). Used as sorted-set score for ordering."""
@@ -23,33 +139,242 @@ def _now_iso_gmt_minus3() -> str:
     return time.strftime("%Y-%m-%d %H:%M:%S", t)
 
 
+def score_from_timestamp(value: str) -> float:
+    """Index score (epoch seconds) of a stored timestamp, the inverse of _now_iso_gmt_minus3.
+    Timestamps with an explicit offset are honoured. Raises ValueError if it doesn't parse."""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=GMT_MINUS3)
+    return dt.timestamp()
+
+
+# The user_id is a hash tag ({...}): a user's records and indexes always share a Redis Cluster
+# slot, so the upsert script and the read pipelines never cross slots.
 def key_record(user_id: str, game: str, match_id: str) -> str:
-    return f"record:{user_id}:{game}:{match_id}"
+    return f"record:{{{user_id}}}:{game}:{match_id}"
 
 
 def key_user_index(user_id: str, game: str) -> str:
+    return f"user:{{{user_id}}}:{game}:records"
+
+
+def key_user_games(user_id: str) -> str:
+    """Set of the games a user has records in (lets exports and the feed find every index without SCAN)."""
+    return f"user:{{{user_id}}}:games"
+
+
+def key_user_stats(user_id: str, game: str) -> str:
+    """Hash of counters/aggregates of a user in a game, kept by UPSERT_SCRIPT."""
+    return f"user:{{{user_id}}}:{game}:stats"
+
+
+def key_user_events(user_id: str, game: str) -> str:
+    """Stream of change events (match_id, updated_at, rev, created) of a user index, kept by UPSERT_SCRIPT."""
+    return f"user:{{{user_id}}}:{game}:events"
+
+
+def key_user_archived(user_id: str, game: str) -> str:
+    """Set of the match_ids of a user index that ArchiveMover moved to the archive (removed by
+    UPSERT_SCRIPT when a write brings one back), so only those writes look the archive up."""
+    return f"user:{{{user_id}}}:{game}:archived"
+
+
+def key_game_users(game: str) -> str:
+    """HyperLogLog of the users that wrote records in a game (not per user, so its own slot)."""
+    return f"game:{{{game}}}:users"
+
+
+def legacy_key_record(user_id: str, game: str, match_id: str) -> str:
+    return f"record:{user_id}:{game}:{match_id}"
+
+
+def legacy_key_user_index(user_id: str, game: str) -> str:
     return f"user:{user_id}:{game}:records"
 
 
-def _maybe_json_dump(v: Any) -> str:
-    """Serialize dicts/lists as JSON; keep primitives/strings as-is."""
-    if isinstance(v, (dict, list)):
-        return json.dumps(v, ensure_ascii=False)
-    return str(v)
+# SCAN pattern matching every key_user_index (both layouts)
+USER_INDEX_PATTERN = "user:*:records"
 
 
-def _maybe_json_load(s: Optional[str]) -> Any:
-    if s is None:
-        return None
+def key_record_from_index(idx_key: str, match_id: str) -> str:
+    """Record key for a member of a user index (inverse of key_user_index, so ':' in ids is fine).
+    Works for both key layouts."""
+    return f"record:{idx_key[len('user:'):-len(':records')]}:{match_id}"
+
+
+def encode_cursor(score: float, match_id: str) -> str:
+    """Opaque pagination cursor for the index entry (score, match_id)."""
+    raw = json.dumps([score, match_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Inverse of encode_cursor; raises ValueError on anything malformed."""
     try:
-        return json.loads(s)
-    except Exception:
-        return s
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        score, match_id = json.loads(raw)
+        if not isinstance(match_id, str):
+            raise ValueError("bad match_id")
+        return float(score), match_id
+    except (binascii.Error, ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor.") from exc
+
+
+# Fields a record exposes, in response order; input/output are the JSON payloads
+RECORD_FIELDS = ("user_id", "match_id", "game", "input", "output", "created_at", "updated_at")
+JSON_FIELDS = frozenset(("input", "output"))
+# Everything an archive row holds of a record hash (what a write restores to Redis)
+ARCHIVED_HASH_FIELDS = (*RECORD_FIELDS, "rev")
+
+
+def parse_fields(value: Any) -> Optional[Tuple[str, ...]]:
+    """Normalize a `fields=` projection (list or comma-separated string); None means all fields."""
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, str):
+        value = [f.strip() for f in value.split(",") if f.strip()]
+    if not isinstance(value, list) or not all(isinstance(f, str) for f in value):
+        raise ValueError("Invalid 'fields': must be a list or comma-separated string.")
+    unknown = [f for f in value if f not in RECORD_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(RECORD_FIELDS)}.")
+    # keep canonical order, drop duplicates
+    return tuple(f for f in RECORD_FIELDS if f in value)
+
+
+def parse_consistency(value: Any) -> bool:
+    """`consistency` request option: "primary" (read your own writes) or "replica" (default,
+    may lag behind the primary). Returns True when the read must go to the primary."""
+    if value is None or value == "" or value == "replica":
+        return False
+    if value == "primary":
+        return True
+    raise ValueError("Invalid 'consistency': must be 'primary' or 'replica'.")
+
+
+def _hash_fields(fields: Tuple[str, ...]) -> List[str]:
+    """Hash fields to HMGET for a projection; updated_at is always set by upsert, so it doubles
+    as the existence probe (HMGET returns all-nil for a missing hash)."""
+    return list(fields) if "updated_at" in fields else [*fields, "updated_at"]
+
+
+def _record_version(rev: Optional[bytes], updated_at: Optional[bytes]) -> Optional[str]:
+    """Version token of a stored record: its revision counter (updated_at for records written
+    before it existed), None if the record doesn't exist."""
+    if rev is not None:
+        return rev.decode("ascii")
+    if updated_at is not None:
+        return "u" + updated_at.decode("utf-8")
+    return None
+
+
+def _build_record(
+    values: List[Optional[bytes]],
+    hash_fields: List[str],
+    fields: Tuple[str, ...],
+    user_id: str,
+    game: str,
+    match_id: str,
+    raw_json: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """Turn a raw (bytes) HMGET reply into a record dict with only the projected fields
+    (None if the record is missing). input/output go through the storage codec; with
+    raw_json they stay as RawJSON fragments for json_response instead of being parsed."""
+    decode_payload = record_codec.decode_fragment if raw_json else record_codec.decode
+    raw = dict(zip(hash_fields, values))
+    if raw.get("updated_at") is None:
+        return None
+
+    defaults = {"user_id": user_id, "match_id": match_id, "game": game}
+    rec: Dict[str, Any] = {}
+    for f in fields:
+        v = raw.get(f)
+        if f in JSON_FIELDS:
+            v = decode_payload(v)
+        elif v is None:
+            v = defaults.get(f)
+        else:
+            v = v.decode("utf-8")
+        rec[f] = v
+    return rec
+
+
+STATS_COUNTERS = ("matches", "with_output", "writes")
+
+
+def _feed_version(writes: List[Optional[str]]) -> str:
+    return f"{len(writes)}.{sum(int(w or 0) for w in writes)}"
+
+
+def _stats_from_hash(raw: Dict[str, str]) -> Dict[str, Any]:
+    """Public view of a stats hash (zeros/None when the user has no stats in that game)."""
+    stats: Dict[str, Any] = {f: int(raw.get(f, 0)) for f in STATS_COUNTERS}
+    stats["first_seen"] = raw.get("first_seen")
+    stats["last_seen"] = raw.get("last_seen")
+    return stats
 
 
 class RecordsService:
     """High-level API for record storage and queries."""
 
+    @staticmethod
+    def _upsert_call(
+        user_id: str,
+        match_id: str,
+        game: str,
+        input_data: Optional[Any],
+        output_data: Optional[Any],
+        updated_at: str,
+        score: float,
+        created_at: Optional[str] = None,
+        probe: bool = False,
+        seed: Optional[Dict[bytes, bytes]] = None,
+        only_newer: bool = False,
+    ) -> Tuple[List[str], List[Any]]:
+        """KEYS and ARGV for UPSERT_SCRIPT (created_at defaults to updated_at). `probe` makes the
+        script return -1 if the record was archived; `seed` is the hash to start it from then.
+        `only_newer` skips the write (-2) if the stored record is at or past `score`. In standalone
+        mode with LEGACY_KEY_READS the legacy record key is passed too (its copy is moved over)."""
+        mapping: List[Any] = [
+            "user_id", user_id,
+            "match_id", match_id,
+            "game", game,
+            "updated_at", updated_at,
+        ]
+        if input_data is not None:
+            mapping += ["input", record_codec.encode(input_data)]
+        if output_data is not None:
+            mapping += ["output", record_codec.encode(output_data)]
+
+        keys = [
+            key_record(user_id, game, match_id),
+            key_user_index(user_id, game),
+            key_user_games(user_id),
+            key_user_stats(user_id, game),
+            key_user_events(user_id, game),
+            key_user_archived(user_id, game),
+        ]
+        if LEGACY_KEY_READS and not RedisConnectionAsync.cluster:
+            keys.append(legacy_key_record(user_id, game, match_id))
+        args = [
+            match_id,
+            repr(score),
+            created_at or updated_at,
+            updated_at,
+            TTL_SECONDS,
+            INDEX_MAX_LEN,
+            game,
+            "1" if output_data is not None else "",
+            EVENTS_MAXLEN,
+            EVENTS_TTL,
+            "1" if probe else "",
+            "1" if only_newer else "",
+            2 * len(seed or ()),
+            *itertools.chain.from_iterable((seed or {}).items()),
+            *mapping,
+        ]
+        return keys, args
+
     @staticmethod
     async def upsert(
         user_id: str,
@@ -59,110 +384,985 @@ class RecordsService:
         output_data: Optional[Any] = None,
     ) -> Dict[str, Any]:
         """Create or update a record. Sets created_at on first write; always updates updated_at.
-        Also updates the per-user sorted index (ZSET) by the current epoch time.
+        Also updates the per-user sorted index (ZSET) by the current epoch time and the stats.
+        One round trip through write_many (EVALSHA of UPSERT_SCRIPT + PFADD), or goes through
+        the WriteBuffer when it is enabled.
         """
-        r = RedisConnectionAsync.client()
-        rec_key = key_record(user_id, game, match_id)
-        idx_key = key_user_index(user_id, game)
-
         updated_at = _now_iso_gmt_minus3()
         score = _now_unix()
 
-        mapping: Dict[str, str] = {
+        if WriteBuffer.enabled():
+            await WriteBuffer.add(user_id, match_id, game, input_data, output_data, updated_at, score)
+            return {
+                "ok": True,
+                "user_id": user_id,
+                "match_id": match_id,
+                "updated_at": updated_at,
+                "created_at_set": None,  # not known until the buffer is flushed
+                "buffered": True,
+            }
+
+        res = await RecordsService.write_many([{
             "user_id": user_id,
             "match_id": match_id,
             "game": game,
+            "input": input_data,
+            "output": output_data,
             "updated_at": updated_at,
-        }
-        if input_data is not None:
-            mapping["input"] = _maybe_json_dump(input_data)
-        if output_data is not None:
-            mapping["output"] = _maybe_json_dump(output_data)
-
-        pipe = r.pipeline()
-        # enqueue commands (await each to satisfy asyncio pipeline)
-        await pipe.hsetnx(rec_key, "created_at", updated_at)   # only on first write
-        await pipe.hset(rec_key, mapping=mapping)
-        await pipe.zadd(idx_key, {match_id: score})            # index by updated_at (epoch)
-
-        await pipe.expire(rec_key, TTL_SECONDS)                # record expira em 7 dias (rolling TTL)
-        await pipe.expire(idx_key, TTL_SECONDS)                # índice também expira se ficar inativo
-
-        res = await pipe.execute()
+            "score": score,
+        }])
+        created = res[0]
 
         return {
             "ok": True,
             "user_id": user_id,
             "match_id": match_id,
             "updated_at": updated_at,
-            "created_at_set": bool(res[0]),
+            "created_at_set": bool(created),
         }
 
+    @staticmethod
+    async def upsert_many(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Upsert a batch of records in a single pipeline (one round trip).
+
+        Each item is a dict with user_id, match_id, game and optional input/output.
+        Returns one result per item, in the same order, shaped like `upsert`.
+        """
+        if not items:
+            return []
+
+        updated_at = _now_iso_gmt_minus3()
+        score = _now_unix()
+
+        if WriteBuffer.enabled():
+            # Through the buffer too, or a flush of older buffered data could land after this batch.
+            for it in items:
+                await WriteBuffer.add(
+                    it["user_id"], it["match_id"], it["game"], it.get("input"), it.get("output"),
+                    updated_at, score,
+                )
+            return [
+                {
+                    "ok": True,
+                    "user_id": it["user_id"],
+                    "match_id": it["match_id"],
+                    "updated_at": updated_at,
+                    "created_at_set": None,
+                    "buffered": True,
+                }
+                for it in items
+            ]
+
+        items = [{**it, "updated_at": updated_at, "score": score} for it in items]
+        res = await RecordsService.write_many(items)
+
+        out: List[Dict[str, Any]] = []
+        for i, it in enumerate(items):
+            out.append({
+                "ok": True,
+                "user_id": it["user_id"],
+                "match_id": it["match_id"],
+                "updated_at": updated_at,
+                "created_at_set": bool(res[i]),
+            })
+        return out
+
+    @staticmethod
+    async def write_many(items: List[Dict[str, Any]]) -> List[Any]:
+        """Run UPSERT_SCRIPT for every item in one pipeline, with the PFADDs of the per-game user
+        counts and the cache invalidations; bypasses the WriteBuffer (it is its sink).
+        Items carry their own updated_at/score and optionally the created_at to set on new records
+        (buffered first writes, imports), and `only_newer` to skip records already at or past
+        their score (imports). Returns the script result of each item (-2: skipped).
+
+        A legacy-layout copy of a record is moved over by the script itself (see UPSERT_SCRIPT).
+        With the archive enabled, a write to a record that ArchiveMover archived (its match_id is
+        in the user index's archived set) is probed first: the script runs again seeded with the
+        archived row, which is deleted once Redis has it (a second round trip, for those only).
+
+        Cache invalidations are published after each user's last write: in the same pipeline in
+        standalone mode (commands run in order, and users whose writes are re-run are published
+        again), in a follow-up pipeline in cluster mode, where nodes run their part concurrently."""
+        if not items:
+            return []
+
+        def call(it: Dict[str, Any], probe: bool = False, seed: Optional[Dict[bytes, bytes]] = None):
+            return RecordsService._upsert_call(
+                it["user_id"],
+                it["match_id"],
+                it["game"],
+                it.get("input"),
+                it.get("output"),
+                it["updated_at"],
+                it["score"],
+                created_at=it.get("created_at"),
+                probe=probe,
+                seed=seed,
+                only_newer=it.get("only_newer", False),
+            )
+
+        calls = [call(it, probe=RecordArchive.enabled()) for it in items]
+        users = {it["user_id"] for it in items}
+        game_users: Dict[str, set] = {}
+        for it in items:
+            game_users.setdefault(it["game"], set()).add(it["user_id"])
+
+        publish_inline = RecordsCache.enabled() and not RedisConnectionAsync.cluster
+
+        async def publish(pipe, user_ids) -> None:
+            for user_id in user_ids:
+                await pipe.publish(INVALIDATION_CHANNEL, user_id)
+
+        sha = RedisConnectionAsync.script_sha("upsert")
+        # Plain EVALSHA in the pipeline (not a Script object): avoids a SCRIPT EXISTS round trip.
+        pipe = RedisConnectionAsync.raw_client().pipeline(transaction=False)
+        for keys, args in calls:
+            await pipe.evalsha(sha, len(keys), *keys, *args)
+        # Distinct users per game: global keys, so outside the (per-user slot) script.
+        for game, game_user_ids in game_users.items():
+            await pipe.pfadd(key_game_users(game), *game_user_ids)
+        if publish_inline:
+            await publish(pipe, users)
+        res = await pipe.execute(raise_on_error=False)
+
+        # NOSCRIPT (script cache flushed, failover, or in cluster mode one node restarted): reload
+        # and re-run only the calls that failed, since the others were applied already.
+        missing = [i for i, r in enumerate(res[:len(calls)]) if isinstance(r, NoScriptError)]
+        if missing:
+            logging.warning(f"[upsert_many] NOSCRIPT on {len(missing)} call(s), reloading scripts and retrying them")
+            await RedisConnectionAsync.load_scripts()
+            pipe = RedisConnectionAsync.raw_client().pipeline(transaction=False)
+            for i in missing:
+                keys, args = calls[i]
+                await pipe.evalsha(sha, len(keys), *keys, *args)
+            if publish_inline:
+                await publish(pipe, {items[i]["user_id"] for i in missing})
+            for i, r in zip(missing, await pipe.execute(raise_on_error=False)):
+                res[i] = r
+
+        # Probed records found archived: run again, seeded with their archived row (if it is
+        # still there), without probing.
+        absent = [i for i, r in enumerate(res[:len(calls)]) if r == -1]
+        if absent:
+            seeds = await RecordsService._archived_copies([items[i] for i in absent])
+            pipe = RedisConnectionAsync.raw_client().pipeline(transaction=False)
+            for i, seed in zip(absent, seeds):
+                keys, args = call(items[i], seed=seed)
+                await pipe.evalsha(sha, len(keys), *keys, *args)
+            if publish_inline:
+                await publish(pipe, {items[i]["user_id"] for i in absent})
+            restored: List[Dict[str, Any]] = []
+            for i, seed, r in zip(absent, seeds, await pipe.execute(raise_on_error=False)):
+                res[i] = r
+                if seed is not None and not isinstance(r, Exception):
+                    restored.append(items[i])
+            if restored:
+                await RecordsService._discard_archived(restored)
+
+        if RecordsCache.enabled() and not publish_inline:
+            pipe = RedisConnectionAsync.client().pipeline(transaction=False)
+            await publish(pipe, users)
+            await pipe.execute()
+        for user_id in users:
+            RecordsCache.invalidate(user_id)
+        for r in res:
+            if isinstance(r, Exception):
+                raise r
+        return res[:len(items)]
+
+    @staticmethod
+    async def _archived_copies(items: List[Dict[str, Any]]) -> List[Optional[Dict[bytes, bytes]]]:
+        """Archive row of each item's record, as a hash (None where there is none)."""
+        rows = await asyncio.gather(*(
+            RecordArchive.get(it["user_id"], it["game"], it["match_id"], ARCHIVED_HASH_FIELDS)
+            for it in items
+        ))
+        return [
+            None if values is None else
+            {f.encode("ascii"): v for f, v in zip(ARCHIVED_HASH_FIELDS, values) if v is not None}
+            for values in rows
+        ]
+
+    @staticmethod
+    async def _discard_archived(items: List[Dict[str, Any]]) -> None:
+        """Delete the archive rows of records a write brought back to Redis. The write already
+        succeeded, so a failure here is only logged: reads prefer Redis, and the mover merges the
+        row when the record is archived again."""
+        try:
+            await RecordArchive.discard([(it["user_id"], it["game"], it["match_id"]) for it in items])
+        except Exception:
+            logging.exception(f"[archive] Could not delete {len(items)} restored record(s) from the archive")
+
     @staticmethod
     async def set_output(user_id: str, match_id: str, game: str, output_data: Any) -> Dict[str, Any]:
         """Update only output; refresh updated_at and index."""
         return await RecordsService.upsert(user_id, match_id, game, input_data=None, output_data=output_data)
 
     @staticmethod
-    async def get_one(user_id: str, match_id: str) -> Optional[Dict[str, Any]]:
-        r = RedisConnectionAsync.client()
-        rec_key = key_record(user_id, match_id)
-        data = await r.hgetall(rec_key)
-        if not data:
+    async def _read(primary: bool, load: Callable[[RedisNode], Awaitable[Any]]) -> Any:
+        """Run load(node) on a read replica (on the primary when `primary`, or when there is
+        none), retrying once on the primary if the replica can't be reached."""
+        node = RedisConnectionAsync.read_node(primary)
+        if node.primary:
+            return await load(node)
+        try:
+            return await load(node)
+        except (RedisConnectionError, RedisTimeoutError) as exc:
+            RedisConnectionAsync.replica_failed(node, exc)
+            return await load(RedisConnectionAsync.primary_node())
+
+    @staticmethod
+    async def get_one(
+        user_id: str,
+        game: str,
+        match_id: str,
+        fields: Optional[Tuple[str, ...]] = None,
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """Single record read: one HMGET of the projected fields (all fields by default).
+        Served by a replica when there are any; `primary` reads the primary, bypassing the
+        cache, for a client that must see its own just-acknowledged write."""
+        rec, _ = await RecordsService.get_one_versioned(user_id, game, match_id, fields, raw_json, primary)
+        return rec
+
+    @staticmethod
+    async def get_one_versioned(
+        user_id: str,
+        game: str,
+        match_id: str,
+        fields: Optional[Tuple[str, ...]] = None,
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """get_one plus the version token read in the same HMGET (so it never claims a newer
+        version than the data it comes with); None while the record has buffered writes."""
+        fields = fields or RECORD_FIELDS
+        if WriteBuffer.enabled():
+            # Taken before reading Redis, so a flush finishing meanwhile can't hide the write.
+            layers = WriteBuffer.layers(user_id, game, match_id)
+            if layers:
+                rec, _ = await RecordsService._get_one_stored(user_id, game, match_id, fields, raw_json, primary)
+                return WriteBuffer.apply(rec, layers, fields, raw_json), None
+        return await RecordsService._get_one_stored(user_id, game, match_id, fields, raw_json, primary)
+
+    @staticmethod
+    async def record_version(user_id: str, game: str, match_id: str, primary: bool = False) -> Optional[str]:
+        """Just the version token of a record (one HMGET of two small fields), for If-None-Match."""
+        if WriteBuffer.enabled() and WriteBuffer.layers(user_id, game, match_id):
             return None
 
-        return {
-            "user_id": data.get("user_id") or user_id,
-            "match_id": data.get("match_id") or match_id,
-            "input": _maybe_json_load(data.get("input")),
-            "output": _maybe_json_load(data.get("output")),
-            "created_at": data.get("created_at"),
-            "updated_at": data.get("updated_at"),
-        }
+        async def load(node: RedisNode) -> Optional[str]:
+            rev, updated_at = await node.raw_client.hmget(key_record(user_id, game, match_id), ["rev", "updated_at"])
+            if updated_at is None and LEGACY_KEY_READS:
+                rev, updated_at = await node.raw_client.hmget(
+                    legacy_key_record(user_id, game, match_id), ["rev", "updated_at"]
+                )
+            if updated_at is None and RecordArchive.enabled():
+                rev, updated_at = await RecordArchive.get(user_id, game, match_id, ["rev", "updated_at"]) or (None, None)
+            return _record_version(rev, updated_at)
+
+        return await RecordsService._read(primary, load)
 
     @staticmethod
-    async def get_recent(user_id: str, game: str, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
-        """Return most-recent N records for a user, ordered by updated_at desc, with offset and limit."""
-        r = RedisConnectionAsync.client()
-        idx_key = key_user_index(user_id, game)
+    async def _get_one_stored(
+        user_id: str,
+        game: str,
+        match_id: str,
+        fields: Tuple[str, ...],
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        cache_key = ("one", user_id, game, match_id, fields, raw_json)
+        if not primary:
+            cached = RecordsCache.get(cache_key)
+            if cached is not None:
+                return cached
+        generation = RecordsCache.generation(user_id)
+
+        hash_fields = [*_hash_fields(fields), "rev"]
+
+        async def load(node: RedisNode) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+            values = await node.raw_client.hmget(key_record(user_id, game, match_id), hash_fields)
+            rec = _build_record(values, hash_fields, fields, user_id, game, match_id, raw_json)
+            if rec is None and LEGACY_KEY_READS:
+                values = await node.raw_client.hmget(legacy_key_record(user_id, game, match_id), hash_fields)
+                rec = _build_record(values, hash_fields, fields, user_id, game, match_id, raw_json)
+            if rec is None and RecordArchive.enabled():
+                values = await RecordArchive.get(user_id, game, match_id, hash_fields)
+                if values is not None:
+                    rec = _build_record(values, hash_fields, fields, user_id, game, match_id, raw_json)
+            if rec is None:
+                return None, None
+            return rec, _record_version(values[-1], values[hash_fields.index("updated_at")])
 
+        rec, version = await RecordsService._read(primary, load)
+        if rec is None:
+            return None, None
+
+        RecordsCache.put(user_id, cache_key, (rec, version), generation)
+        return rec, version
+
+    @staticmethod
+    async def get_recent(
+        user_id: str,
+        game: str,
+        limit: int = 10,
+        offset: int = 0,
+        fields: Optional[Tuple[str, ...]] = None,
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Return most-recent N records for a user, ordered by updated_at desc, with offset and limit.
+        `fields` projects each record to those fields (all by default); `raw_json` keeps
+        stored JSON payloads as RawJSON fragments; `primary` as in get_one."""
+        items, _ = await RecordsService.get_recent_versioned(user_id, game, limit, offset, fields, raw_json, primary)
+        return items
+
+    @staticmethod
+    async def get_recent_versioned(
+        user_id: str,
+        game: str,
+        limit: int = 10,
+        offset: int = 0,
+        fields: Optional[Tuple[str, ...]] = None,
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """get_recent plus the index version read in the same pipeline as the index; None while
+        the index has buffered writes."""
         # Sanitize inputs
         limit = max(1, min(limit, 100))
         offset = max(0, offset)
+        fields = fields or RECORD_FIELDS
+
+        buffered = WriteBuffer.buffered(user_id, game) if WriteBuffer.enabled() else None
+        if not buffered:
+            return await RecordsService._get_recent_stored(user_id, game, limit, offset, fields, raw_json, primary)
+
+        # Buffered records are the newest writes: they go first, replacing their stored copy.
+        # Stored records are read from the top so the offset applies to the merged list.
+        with_id = fields if "match_id" in fields else tuple(f for f in RECORD_FIELDS if f in fields or f == "match_id")
+        (stored, _), bases = await asyncio.gather(
+            RecordsService._get_recent_stored(
+                user_id, game, offset + limit + len(buffered), 0, with_id, raw_json, primary
+            ),
+            asyncio.gather(*(
+                RecordsService._get_one_stored(user_id, game, mid, fields, raw_json, primary) for mid in buffered
+            )),
+        )
+        newest = sorted(zip(buffered.items(), bases), key=lambda e: e[0][1][-1]["score"], reverse=True)
+        out = [WriteBuffer.apply(base, layers, fields, raw_json) for (_, layers), (base, _) in newest]
+        for rec in stored:
+            if rec["match_id"] not in buffered:
+                if with_id is not fields:
+                    rec = {f: rec[f] for f in fields}
+                out.append(rec)
+        return out[offset:offset + limit], None
+
+    @staticmethod
+    async def index_version(user_id: str, game: str, primary: bool = False) -> Optional[str]:
+        """Just the version of a user index (one HGET), for If-None-Match."""
+        if WriteBuffer.enabled() and WriteBuffer.buffered(user_id, game):
+            return None
+        writes = await RecordsService._read(
+            primary, lambda node: node.client.hget(key_user_stats(user_id, game), "writes")
+        )
+        return writes or "0"
+
+    @staticmethod
+    async def _get_recent_stored(
+        user_id: str,
+        game: str,
+        limit: int,
+        offset: int,
+        fields: Tuple[str, ...],
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], str]:
+        idx_key = key_user_index(user_id, game)
+        stats_key = key_user_stats(user_id, game)
+
+        cache_key = ("recent", user_id, game, limit, offset, fields, raw_json)
+        if not primary:
+            cached = RecordsCache.get(cache_key)
+            if cached is not None:
+                return cached
+        generation = RecordsCache.generation(user_id)
 
         # Calculate start and stop index for ZREVRANGE
         start_index = offset
         stop_index = offset + limit - 1
 
-        # Latest match_ids by score (descending)
-        match_ids = await r.zrevrange(idx_key, start_index, stop_index)
+        async def load(node: RedisNode) -> Tuple[List[Dict[str, Any]], str]:
+            # Latest match_ids by score (descending), and the index version
+            pipe = node.client.pipeline(transaction=False)
+            await pipe.hget(stats_key, "writes")
+            if LEGACY_KEY_READS:
+                await pipe.zrevrange(idx_key, 0, stop_index, withscores=True)
+                await pipe.zrevrange(legacy_key_user_index(user_id, game), 0, stop_index, withscores=True)
+                writes, current, legacy = await pipe.execute()
+                entries = await RecordsService._merge_legacy(user_id, game, current, legacy, node)
+                # (a short merge holds every entry of both indexes)
+                hot_count = len(entries)
+                entries = entries[start_index:stop_index + 1]
+                match_ids = [mid for mid, _, _ in entries]
+                record_keys = [key for _, _, key in entries]
+            else:
+                await pipe.zrevrange(idx_key, start_index, stop_index)
+                if RecordArchive.enabled():
+                    await pipe.zcard(idx_key)
+                writes, match_ids, *hot_count = await pipe.execute()
+                hot_count = hot_count[0] if hot_count else 0
+                record_keys = None
+            out = await RecordsService._fetch_records(user_id, game, match_ids, fields, raw_json, record_keys, node)
+            if len(match_ids) < limit and RecordArchive.enabled():
+                # The index ends inside this page: the rest comes from the archive, which only
+                # holds records older than anything still in the index.
+                rows = await RecordArchive.recent(user_id, game, limit - len(match_ids),
+                                                  max(0, offset - hot_count), _hash_fields(fields))
+                out += RecordsService._archived_records(
+                    user_id, game, await RecordsService._not_in_index(user_id, game, rows, node), fields, raw_json
+                )
+            return out, writes or "0"
+
+        out = await RecordsService._read(primary, load)
+
+        RecordsCache.put(user_id, cache_key, out, generation)
+        return out
+
+    @staticmethod
+    async def get_page(
+        user_id: str,
+        game: str,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        fields: Optional[Tuple[str, ...]] = None,
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Keyset pagination over the user index: return (items, next_cursor).
+
+        The cursor encodes the (score, match_id) of the last entry served, so each page is a
+        ZREVRANGEBYSCORE from that point: constant cost at any depth, and records re-scored by
+        a write while paging move to the top instead of shifting later pages.
+        next_cursor is None when there is nothing left. `primary` as in get_one.
+        """
+        items, next_cursor, _ = await RecordsService._get_page(
+            user_id, game, limit, cursor, fields, raw_json, primary, with_version=False
+        )
+        return items, next_cursor
+
+    @staticmethod
+    async def get_page_versioned(
+        user_id: str,
+        game: str,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        fields: Optional[Tuple[str, ...]] = None,
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+        """get_page plus the index version, read just before the index on the same server (one
+        more round trip; pages never include buffered writes, so there is always a version)."""
+        return await RecordsService._get_page(user_id, game, limit, cursor, fields, raw_json, primary, with_version=True)
+
+    @staticmethod
+    async def _get_page(
+        user_id: str,
+        game: str,
+        limit: int,
+        cursor: Optional[str],
+        fields: Optional[Tuple[str, ...]],
+        raw_json: bool,
+        primary: bool,
+        with_version: bool,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+        idx_key = key_user_index(user_id, game)
+
+        limit = max(1, min(limit, 100))
+        after = decode_cursor(cursor) if cursor else None
+
+        fields = fields or RECORD_FIELDS
+        cache_key = ("page", user_id, game, limit, cursor or "", fields, raw_json, with_version)
+        if not primary:
+            cached = RecordsCache.get(cache_key)
+            if cached is not None:
+                return cached
+        generation = RecordsCache.generation(user_id)
+
+        want = limit + 1  # one extra entry tells us whether there is a next page
+
+        async def load(node: RedisNode) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+            version = None
+            if with_version:
+                version = await node.client.hget(key_user_stats(user_id, game), "writes") or "0"
+            if LEGACY_KEY_READS:
+                current, legacy = await asyncio.gather(
+                    RecordsService._index_after(idx_key, after, want, node),
+                    RecordsService._index_after(legacy_key_user_index(user_id, game), after, want, node),
+                )
+                entries = await RecordsService._merge_legacy(user_id, game, current, legacy, node)
+                # de-duplication may have dropped entries while the legacy index still has more
+                dropped = len(entries) < len(current) + len(legacy)
+                more = len(entries) > limit or (dropped and len(legacy) >= want)
+            else:
+                entries = [
+                    (mid, score, None) for mid, score in await RecordsService._index_after(idx_key, after, want, node)
+                ]
+                more = len(entries) > limit
+
+            archived: Dict[str, List[Optional[bytes]]] = {}
+            if not more and RecordArchive.enabled():
+                # The index is exhausted: continue in the archive, from the last index entry.
+                last = (entries[-1][1], entries[-1][0]) if entries else after
+                rows = await RecordArchive.after(user_id, game, last, want - len(entries), _hash_fields(fields))
+                rows = await RecordsService._not_in_index(user_id, game, rows, node)
+                archived = {mid: values for mid, _, values in rows}
+                entries = sorted([*entries, *((mid, score, None) for mid, score, _ in rows)],
+                                 key=lambda e: (e[1], e[0]), reverse=True)
+                more = len(entries) > limit
+
+            page = entries[:limit]
+            next_cursor = encode_cursor(page[-1][1], page[-1][0]) if more and page else None
+
+            hot = [e for e in page if e[0] not in archived]
+            record_keys = [key for _, _, key in hot] if LEGACY_KEY_READS else None
+            out = await RecordsService._fetch_records(
+                user_id, game, [mid for mid, _, _ in hot], fields, raw_json, record_keys, node
+            )
+            if archived:
+                out += RecordsService._archived_records(
+                    user_id, game, [(mid, score, archived[mid]) for mid, score, _ in page if mid in archived],
+                    fields, raw_json,
+                )
+            return out, next_cursor, version
+
+        out, next_cursor, version = await RecordsService._read(primary, load)
+
+        RecordsCache.put(user_id, cache_key, (out, next_cursor, version), generation)
+        return out, next_cursor, version
+
+    @staticmethod
+    async def user_games(user_id: str) -> List[str]:
+        """Games a user has records in (one SMEMBERS). Upserts keep the set complete; indexes
+        written before it existed are added by the IndexSweeper while LEGACY_KEY_READS is on."""
+        return sorted(await RedisConnectionAsync.client().smembers(key_user_games(user_id)))
+
+    @staticmethod
+    async def get_feed(
+        user_id: str,
+        limit: int = 10,
+        offset: int = 0,
+        fields: Optional[Tuple[str, ...]] = None,
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Most recent records of a user across all games, newest first (offset/limit as in
+        get_recent). `fields`, `raw_json` and `primary` as in get_recent."""
+        items, _ = await RecordsService.get_feed_versioned(user_id, limit, offset, fields, raw_json, primary)
+        return items
+
+    @staticmethod
+    async def get_feed_versioned(
+        user_id: str,
+        limit: int = 10,
+        offset: int = 0,
+        fields: Optional[Tuple[str, ...]] = None,
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """get_feed plus a version of all the user's indexes (see feed_version); None while the
+        user has buffered writes."""
+        limit = max(1, min(limit, 100))
+        offset = max(0, offset)
+        fields = fields or RECORD_FIELDS
+
+        buffered = WriteBuffer.buffered_user(user_id) if WriteBuffer.enabled() else None
+        if not buffered:
+            return await RecordsService._get_feed_stored(user_id, limit, offset, fields, raw_json, primary)
+
+        # Same merge as get_recent, across games: buffered records first, replacing their stored copy.
+        with_id = fields if {"game", "match_id"} <= set(fields) else tuple(
+            f for f in RECORD_FIELDS if f in fields or f in ("game", "match_id")
+        )
+        (stored, _), bases = await asyncio.gather(
+            RecordsService._get_feed_stored(user_id, offset + limit + len(buffered), 0, with_id, raw_json, primary),
+            asyncio.gather(*(
+                RecordsService._get_one_stored(user_id, game, mid, fields, raw_json, primary)
+                for game, mid in buffered
+            )),
+        )
+        newest = sorted(zip(buffered.items(), bases), key=lambda e: e[0][1][-1]["score"], reverse=True)
+        out = [WriteBuffer.apply(base, layers, fields, raw_json) for (_, layers), (base, _) in newest]
+        for rec in stored:
+            if (rec["game"], rec["match_id"]) not in buffered:
+                if with_id is not fields:
+                    rec = {f: rec[f] for f in fields}
+                out.append(rec)
+        return out[offset:offset + limit], None
+
+    @staticmethod
+    async def feed_version(user_id: str, primary: bool = False) -> Optional[str]:
+        """Version of all the user's indexes: the number of games and the sum of their write
+        counters (any upsert of the user changes it), for If-None-Match."""
+        if WriteBuffer.enabled() and WriteBuffer.buffered_user(user_id):
+            return None
+        games = await RecordsService.user_games(user_id)
+
+        async def load(node: RedisNode) -> str:
+            pipe = node.client.pipeline(transaction=False)
+            for game in games:
+                await pipe.hget(key_user_stats(user_id, game), "writes")
+            return _feed_version(await pipe.execute() if games else [])
+
+        return await RecordsService._read(primary, load)
+
+    @staticmethod
+    async def _get_feed_stored(
+        user_id: str,
+        limit: int,
+        offset: int,
+        fields: Tuple[str, ...],
+        raw_json: bool = False,
+        primary: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], str]:
+        """k-way merge of the per-game indexes: the top offset+limit entries of every index in
+        one pipeline (after the version counters), merged by score, then one HMGET pipeline for
+        the page. Round trips don't depend on the number of games; work is bounded by
+        games x (offset + limit).
+
+        With the archive enabled, games whose index ends inside the window and that have archived
+        records (their archived set exists) continue in the archive: one query for all of them,
+        merged as one more sorted stream."""
+        cache_key = ("feed", user_id, limit, offset, fields, raw_json)
+        if not primary:
+            cached = RecordsCache.get(cache_key)
+            if cached is not None:
+                return cached
+        generation = RecordsCache.generation(user_id)
+
+        games = await RecordsService.user_games(user_id)
+        stop_index = offset + limit - 1
+
+        async def load(node: RedisNode) -> Tuple[List[Dict[str, Any]], str]:
+            if not games:
+                return [], _feed_version([])
+            pipe = node.client.pipeline(transaction=False)
+            for game in games:
+                await pipe.hget(key_user_stats(user_id, game), "writes")
+            for game in games:
+                await pipe.zrevrange(key_user_index(user_id, game), 0, stop_index, withscores=True)
+                if LEGACY_KEY_READS:
+                    await pipe.zrevrange(legacy_key_user_index(user_id, game), 0, stop_index, withscores=True)
+            if RecordArchive.enabled():
+                for game in games:
+                    await pipe.exists(key_user_archived(user_id, game))
+            replies = await pipe.execute()
+            version = _feed_version(replies[:len(games)])
+            ranges_end = len(games) * (3 if LEGACY_KEY_READS else 2)
+            ranges = replies[len(games):ranges_end]
+            marked = replies[ranges_end:] or [0] * len(games)
+
+            if LEGACY_KEY_READS:
+                per_game = await asyncio.gather(*(
+                    RecordsService._merge_legacy(user_id, game, ranges[2 * i], ranges[2 * i + 1], node)
+                    for i, game in enumerate(games)
+                ))
+            else:
+                per_game = [
+                    [(mid, score, key_record(user_id, game, mid)) for mid, score in ranges[i]]
+                    for i, game in enumerate(games)
+                ]
+            streams = [
+                [(game, mid, score, key, None) for mid, score, key in entries]
+                for game, entries in zip(games, per_game)
+            ]
+            hash_fields = _hash_fields(fields)
+            # The archive only holds records older than anything still in their game's index, so
+            # it can only reach the window through games whose index ends inside it.
+            short = [game for game, entries, m in zip(games, per_game, marked) if m and len(entries) <= stop_index]
+            if short:
+                rows = await RecordArchive.recent_in_games(user_id, short, stop_index + 1, hash_fields)
+                by_game: Dict[str, List[Tuple[str, float, List[Optional[bytes]]]]] = {}
+                for game, mid, score, values in rows:
+                    by_game.setdefault(game, []).append((mid, score, values))
+                kept = await asyncio.gather(*(
+                    RecordsService._not_in_index(user_id, game, game_rows, node) for game, game_rows in by_game.items()
+                ))
+                cold = {(game, mid) for game, game_rows in zip(by_game, kept) for mid, _, _ in game_rows}
+                streams.append([
+                    (game, mid, score, None, values) for game, mid, score, values in rows if (game, mid) in cold
+                ])
+            merged = heapq.merge(*streams, key=lambda e: (e[2], e[1]), reverse=True)
+            page = list(itertools.islice(merged, offset, stop_index + 1))
+            if not page:
+                return [], version
+
+            pipe = node.raw_client.pipeline(transaction=False)
+            for _, _, _, key, values in page:
+                if values is None:
+                    await pipe.hmget(key, hash_fields)
+            hot_values = iter(await pipe.execute())
+            out: List[Dict[str, Any]] = []
+            for game, mid, _, _, values in page:
+                if values is None:
+                    values = next(hot_values)
+                rec = _build_record(values, hash_fields, fields, user_id, game, mid, raw_json)
+                if rec is not None:
+                    out.append(rec)
+            return out, version
+
+        out = await RecordsService._read(primary, load)
+
+        RecordsCache.put(user_id, cache_key, out, generation)
+        return out
+
+    @staticmethod
+    async def get_stats(user_id: str, game: str, primary: bool = False) -> Dict[str, Any]:
+        """Stats of a user in a game plus the game's distinct users: one HGETALL and one PFCOUNT,
+        whatever the size of the history. `primary` as in get_one."""
+        async def load(node: RedisNode) -> Dict[str, Any]:
+            pipe = node.client.pipeline(transaction=False)
+            await pipe.hgetall(key_user_stats(user_id, game))
+            await pipe.pfcount(key_game_users(game))
+            raw, users = await pipe.execute()
+            return {"user_id": user_id, "game": game, **_stats_from_hash(raw), "game_users": users}
+
+        return await RecordsService._read(primary, load)
+
+    @staticmethod
+    async def get_user_stats(user_id: str, primary: bool = False) -> Dict[str, Any]:
+        """Stats of a user in each of their games, and the totals across games (one HGETALL per game)."""
+        games = await RecordsService.user_games(user_id)
+
+        async def load(node: RedisNode) -> List[Dict[str, Any]]:
+            pipe = node.client.pipeline(transaction=False)
+            for game in games:
+                await pipe.hgetall(key_user_stats(user_id, game))
+            return [_stats_from_hash(raw) for raw in await pipe.execute()] if games else []
+
+        per_game = dict(zip(games, await RecordsService._read(primary, load)))
+        totals: Dict[str, Any] = {f: sum(st[f] for st in per_game.values()) for f in STATS_COUNTERS}
+        firsts = [st["first_seen"] for st in per_game.values() if st["first_seen"] is not None]
+        lasts = [st["last_seen"] for st in per_game.values() if st["last_seen"] is not None]
+        totals["first_seen"] = min(firsts) if firsts else None
+        totals["last_seen"] = max(lasts) if lasts else None
+        return {"user_id": user_id, "games": per_game, "totals": totals}
+
+    @staticmethod
+    async def get_game_stats(game: str, primary: bool = False) -> Dict[str, Any]:
+        """Distinct users that wrote records in a game (HyperLogLog estimate, ~0.8% error)."""
+        users = await RecordsService._read(primary, lambda node: node.client.pfcount(key_game_users(game)))
+        return {"game": game, "game_users": users}
+
+    @staticmethod
+    async def export(
+        user_id: str,
+        game: Optional[str] = None,
+        fields: Optional[Tuple[str, ...]] = None,
+        primary: bool = False,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield every stored record of a user, game by game (all games when game is None), in
+        batches of EXPORT_BATCH with stored JSON as RawJSON. Memory use is one batch.
+
+        Each index is walked oldest first with a (score, match_id) keyset, so a record updated
+        during the export moves behind the cursor and is exported again rather than missed.
+        Archived records of each game follow its index. Writes still in the WriteBuffer are
+        not included.
+        """
+        fields = fields or RECORD_FIELDS
+        games = [game] if game is not None else await RecordsService.user_games(user_id)
+        for g in games:
+            indexes = [(legacy_key_user_index(user_id, g), True)] if LEGACY_KEY_READS else []
+            indexes.append((key_user_index(user_id, g), False))
+            for idx_key, legacy in indexes:
+                after: Optional[Tuple[float, str]] = None
+                while True:
+                    entries, records = await RecordsService._read(
+                        primary,
+                        lambda node: RecordsService._export_batch(user_id, g, idx_key, legacy, after, fields, node),
+                    )
+                    if records:
+                        yield records
+                    if len(entries) < EXPORT_BATCH:
+                        break
+                    after = (entries[-1][1], entries[-1][0])
+            if RecordArchive.enabled():
+                async for records in RecordsService._export_archived(user_id, g, fields, primary):
+                    yield records
+
+    @staticmethod
+    async def _export_archived(
+        user_id: str,
+        game: str,
+        fields: Tuple[str, ...],
+        primary: bool,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Archived records of a user index, oldest first, in batches of EXPORT_BATCH (those
+        written again since they were archived are exported from the index instead)."""
+        after: Optional[Tuple[float, str]] = None
+        while True:
+            rows = await RecordArchive.after(user_id, game, after, EXPORT_BATCH, _hash_fields(fields),
+                                             newest_first=False)
+            if not rows:
+                return
+            after = (rows[-1][1], rows[-1][0])
+            current = await RecordsService._read(
+                primary, lambda node: RecordsService._not_in_index(user_id, game, rows, node)
+            )
+            if current:
+                yield RecordsService._archived_records(user_id, game, current, fields, raw_json=True)
+            if len(rows) < EXPORT_BATCH:
+                return
+
+    @staticmethod
+    async def _export_batch(
+        user_id: str,
+        game: str,
+        idx_key: str,
+        legacy: bool,
+        after: Optional[Tuple[float, str]],
+        fields: Tuple[str, ...],
+        node: RedisNode,
+    ) -> Tuple[List[Tuple[str, float]], List[Dict[str, Any]]]:
+        """Next index entries after the cursor and their records (legacy entries of matches
+        rewritten under the new layout are left to the current index)."""
+        r = node.client
+        min_score: Any = "-inf" if after is None else after[0]
+        entries: List[Tuple[str, float]] = []
+        start = 0
+        while len(entries) < EXPORT_BATCH:
+            batch = await r.zrangebyscore(idx_key, min_score, "+inf", start=start, num=EXPORT_BATCH, withscores=True)
+            for mid, score in batch:
+                if after is not None and score == after[0] and mid <= after[1]:
+                    continue
+                entries.append((mid, score))
+            if len(batch) < EXPORT_BATCH:
+                break
+            start += len(batch)
+        entries = entries[:EXPORT_BATCH]
+
+        mids = [mid for mid, _ in entries]
+        record_keys = None
+        if legacy and mids:
+            moved = await r.zmscore(key_user_index(user_id, game), mids)
+            mids = [mid for mid, m in zip(mids, moved) if m is None]
+            record_keys = [legacy_key_record(user_id, game, mid) for mid in mids]
+        records = await RecordsService._fetch_records(user_id, game, mids, fields, True, record_keys, node)
+        return entries, records
+
+    @staticmethod
+    async def _index_after(
+        idx_key: str,
+        after: Optional[Tuple[float, str]],
+        want: int,
+        node: Optional[RedisNode] = None,
+    ) -> List[Tuple[str, float]]:
+        """Up to `want` (match_id, score) entries of an index, newest first, after a cursor."""
+        r = (node or RedisConnectionAsync.primary_node()).client
+        # Inclusive upper bound so entries sharing the cursor score are not lost; those already
+        # served (same score, member >= cursor member in ZREV order) are skipped below.
+        max_score: Any = "+inf" if after is None else after[0]
+        entries: List[Tuple[str, float]] = []
+        start = 0
+        while len(entries) < want:
+            batch = await r.zrevrangebyscore(idx_key, max_score, "-inf", start=start, num=want, withscores=True)
+            for mid, score in batch:
+                if after is not None and score == after[0] and mid >= after[1]:
+                    continue
+                entries.append((mid, score))
+            if len(batch) < want:
+                break
+            start += len(batch)
+        return entries[:want]
+
+    @staticmethod
+    async def _merge_legacy(
+        user_id: str,
+        game: str,
+        current: List[Tuple[str, float]],
+        legacy: List[Tuple[str, float]],
+        node: Optional[RedisNode] = None,
+    ) -> List[Tuple[str, float, str]]:
+        """Merge entries of the current and the legacy index into (match_id, score, record key),
+        newest first. A legacy entry whose match was rewritten under the new layout is dropped."""
+        entries = [(mid, score, key_record(user_id, game, mid)) for mid, score in current]
+        if legacy:
+            seen = {mid for mid, _ in current}
+            legacy = [(mid, score) for mid, score in legacy if mid not in seen]
+        if legacy:
+            migrated = await (node or RedisConnectionAsync.primary_node()).client.zmscore(
+                key_user_index(user_id, game), [mid for mid, _ in legacy]
+            )
+            entries += [
+                (mid, score, legacy_key_record(user_id, game, mid))
+                for (mid, score), moved in zip(legacy, migrated)
+                if moved is None
+            ]
+            entries.sort(key=lambda e: (e[1], e[0]), reverse=True)
+        return entries
+
+    @staticmethod
+    async def _not_in_index(
+        user_id: str,
+        game: str,
+        rows: List[Tuple[str, float, List[Optional[bytes]]]],
+        node: Optional[RedisNode] = None,
+    ) -> List[Tuple[str, float, List[Optional[bytes]]]]:
+        """Drop archive rows of matches that are back in the user index (written again after
+        being archived: the copy in Redis is the current one)."""
+        if not rows:
+            return rows
+        hot = await (node or RedisConnectionAsync.primary_node()).client.zmscore(
+            key_user_index(user_id, game), [mid for mid, _, _ in rows]
+        )
+        return [row for row, score in zip(rows, hot) if score is None]
+
+    @staticmethod
+    def _archived_records(
+        user_id: str,
+        game: str,
+        rows: List[Tuple[str, float, List[Optional[bytes]]]],
+        fields: Tuple[str, ...],
+        raw_json: bool = False,
+    ) -> List[Dict[str, Any]]:
+        hash_fields = _hash_fields(fields)
+        return [_build_record(values, hash_fields, fields, user_id, game, mid, raw_json) for mid, _, values in rows]
+
+    @staticmethod
+    async def _fetch_records(
+        user_id: str,
+        game: str,
+        match_ids: List[str],
+        fields: Tuple[str, ...],
+        raw_json: bool = False,
+        record_keys: Optional[List[str]] = None,
+        node: Optional[RedisNode] = None,
+    ) -> List[Dict[str, Any]]:
+        """Load the projected fields of index entries (one HMGET each, one pipeline), keeping
+        index order. Entries whose record already expired are skipped; removing them from the
+        index is left to the background IndexSweeper, so reads never write.
+        `record_keys` overrides the record key of each entry (legacy layout); `node` is the
+        server to read from (the primary by default).
+        """
         if not match_ids:
             return []
 
-        # Batch fetch via pipeline
-        pipe = r.pipeline()
-        for mid in match_ids:
-            await pipe.hgetall(key_record(user_id, game, mid))
+        hash_fields = _hash_fields(fields)
+        if record_keys is None:
+            record_keys = [key_record(user_id, game, mid) for mid in match_ids]
+
+        # Batch fetch via pipeline (raw client: payloads may be compressed/binary).
+        # No MULTI: plain reads don't need it, and cluster pipelines can't wrap one.
+        pipe = (node or RedisConnectionAsync.primary_node()).raw_client.pipeline(transaction=False)
+        for key in record_keys:
+            await pipe.hmget(key, hash_fields)
         raw_list = await pipe.execute()
 
         out: List[Dict[str, Any]] = []
-        stale_mids: List[str] = []
-
-        for mid, raw in zip(match_ids, raw_list):
-            if not raw:
-                stale_mids.append(mid)
-                continue
-            out.append({
-                "user_id": raw.get("user_id") or user_id,
-                "match_id": raw.get("match_id") or mid,
-                "game": game,
-                "input": _maybe_json_load(raw.get("input")),
-                "output": _maybe_json_load(raw.get("output")),
-                "created_at": raw.get("created_at"),
-                "updated_at": raw.get("updated_at"),
-            })
-
-        if stale_mids:
-            await r.zrem(idx_key, *stale_mids)
-
+        for mid, values in zip(match_ids, raw_list):
+            rec = _build_record(values, hash_fields, fields, user_id, game, mid, raw_json)
+            if rec is not None:
+                out.append(rec)
         return out
@@ -3,15 +3,210 @@
 
 from __future__ import annotations
 
+import time
+import asyncio
+import hashlib
 import logging
-from typing import Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 import redis.asyncio as aioredis  # pip install "redis>=4.2"
+from redis.asyncio.client import Pipeline
+from redis.asyncio.cluster import RedisCluster, ClusterPipeline
+from redis.asyncio.retry import Retry
+from redis.backoff import EqualJitterBackoff
+from redis.exceptions import NoScriptError, ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from metrics import Metrics
+
+
+class RedisUnavailable(RedisConnectionError):
+    """Raised without touching the network while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive connection failures open the breaker; calls then fail fast with
+    RedisUnavailable until `reset_timeout` passes, when a single trial call is let through
+    (half-open). A successful trial closes it again, a failed one re-opens it."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    def retry_after(self) -> float:
+        """Seconds until a trial call will be allowed (0 when closed)."""
+        if self.state == "closed":
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def is_open(self) -> bool:
+        return self.state != "closed" and self.retry_after() > 0
+
+    def before_call(self) -> None:
+        if self.state == "closed":
+            return
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected_total += 1
+                raise RedisUnavailable("Redis unavailable (circuit breaker open)")
+            self.state = "half_open"
+        if self.trial_in_flight:
+            self.rejected_total += 1
+            raise RedisUnavailable("Redis unavailable (circuit breaker half-open)")
+        self.trial_in_flight = True
+
+    def record(self, ok: Optional[bool]) -> None:
+        """ok=True reached Redis, ok=False connection/timeout failure, None = cancelled."""
+        if ok is None:
+            self.trial_in_flight = False
+            return
+        if ok:
+            if self.state != "closed":
+                logging.info("[Redis] Circuit breaker closed")
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+            return
+
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state == "closed":
+                logging.error(f"[Redis] Circuit breaker opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+            self.opened_total += 1
+
+
+async def _guarded(breaker: Optional[CircuitBreaker], name: str, func, *args, **kwargs):
+    """Run a Redis call through the circuit breaker (if any) and record its latency/outcome."""
+    if breaker is not None:
+        breaker.before_call()
+    start = time.perf_counter()
+    ok: Optional[bool] = None
+    try:
+        res = await func(*args, **kwargs)
+        ok = True
+        return res
+    except (RedisConnectionError, RedisTimeoutError):
+        ok = False
+        raise
+    except Exception:
+        ok = True  # Redis answered (e.g. ResponseError/NOSCRIPT): the link is fine
+        raise
+    finally:
+        if breaker is not None:
+            breaker.record(ok)
+        Metrics.observe_redis(name, time.perf_counter() - start, ok is not True)
+
+
+class InstrumentedPipeline(Pipeline):
+    """Pipeline that reports each execute() as one PIPELINE timing."""
+
+    use_breaker = True
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        breaker = RedisConnectionAsync.breaker if self.use_breaker else None
+        return await _guarded(breaker, "PIPELINE", super().execute, raise_on_error)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """redis.asyncio client that times every command and counts failures (see metrics.py),
+    behind the shared circuit breaker."""
+
+    use_breaker = True
+    pipeline_class = InstrumentedPipeline
+
+    async def execute_command(self, *args, **options):
+        name = args[0] if isinstance(args[0], str) else str(args[0])
+        breaker = RedisConnectionAsync.breaker if self.use_breaker else None
+        return await _guarded(breaker, name.upper(), super().execute_command, *args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return self.pipeline_class(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class ReplicaPipeline(InstrumentedPipeline):
+    use_breaker = False
+
+
+class ReplicaRedis(InstrumentedRedis):
+    """Client for a read replica: instrumented, but outside the primary's circuit breaker
+    (a failing replica is taken out of rotation by RedisConnectionAsync instead)."""
+
+    use_breaker = False
+    pipeline_class = ReplicaPipeline
+
+
+class RedisNode:
+    """Text + raw client pair of one server (the primary or a replica)."""
+
+    def __init__(self, name: str, client: aioredis.Redis, raw_client: aioredis.Redis, primary: bool = False):
+        self.name = name
+        self.client = client
+        self.raw_client = raw_client
+        self.primary = primary
+        self.healthy = True
+        self.lag: Optional[int] = None  # seconds since the last master I/O (replicas)
+        self.fallbacks = 0
+
+
+class InstrumentedClusterPipeline(ClusterPipeline):
+    async def execute(self, raise_on_error: bool = True, allow_redirections: bool = True) -> List[Any]:
+        return await _guarded(RedisConnectionAsync.breaker, "PIPELINE", self._execute_once, raise_on_error, allow_redirections)
+
+    async def _execute_once(self, raise_on_error: bool, allow_redirections: bool) -> List[Any]:
+        # RedisCluster re-sends the whole pipeline when a command in it raised a connection error
+        # or timeout, and the first attempt may already have run (upsert scripts are not
+        # idempotent): errors are collected in place and raised here instead, after the loop.
+        res = await super().execute(False, allow_redirections)
+        if raise_on_error:
+            for r in res:
+                if isinstance(r, Exception):
+                    raise r
+        return res
+
+
+class InstrumentedRedisCluster(RedisCluster):
+    """Cluster counterpart of InstrumentedRedis (same metrics and circuit breaker)."""
+
+    # A timed-out command may still have run on the node; only failures that never reached it
+    # (or a cluster still re-sharding) are retried.
+    ERRORS_ALLOW_RETRY = tuple(e for e in RedisCluster.ERRORS_ALLOW_RETRY if e is not RedisTimeoutError)
+
+    async def execute_command(self, *args, **kwargs):
+        name = args[0] if isinstance(args[0], str) else str(args[0])
+        return await _guarded(RedisConnectionAsync.breaker, name.upper(), super().execute_command, *args, **kwargs)
+
+    def pipeline(self, transaction: Optional[Any] = None, shard_hint: Optional[Any] = None) -> InstrumentedClusterPipeline:
+        if shard_hint:
+            raise ValueError("shard_hint is not supported in cluster mode")
+        return InstrumentedClusterPipeline(self, transaction)
 
 
 class RedisConnectionAsync:
-    """Async Redis wrapper with a single shared connection pool."""
+    """Async Redis wrapper with a shared text client plus a raw (bytes) client for binary values.
+
+    With cluster=True both clients are RedisCluster clients: commands are routed by key slot,
+    so callers must keep multi-key operations (scripts, transactions) within one hash tag.
+    """
 
     _client: Optional[aioredis.Redis] = None
+    _raw_client: Optional[aioredis.Redis] = None
+    _scripts: Dict[str, str] = {}  # name -> Lua source
+    _shas: Dict[str, str] = {}     # name -> SHA1 (computed locally, so pipelines never need a lookup)
+    breaker = CircuitBreaker()
+    cluster = False
+    _primary: Optional[RedisNode] = None
+    _replicas: List[RedisNode] = []
+    _next_replica = 0
+    _replica_task: Optional[asyncio.Task] = None
+    replica_check_interval = 2.0
+    replica_max_lag = 0
 
     @classmethod
     async def start(
@@ -20,22 +215,112 @@ class RedisConnectionAsync:
         port: int,
         password: Optional[str] = None,
         db: int = 0,
+        max_connections: int = 50,
+        pool_blocking: bool = False,
+        pool_timeout: float = 1.0,
+        connect_timeout: float = 2.0,
+        command_timeout: float = 2.0,
+        retries: int = 2,
+        breaker_failures: int = 5,
+        breaker_reset: float = 5.0,
+        cluster: bool = False,
+        replicas: Sequence[Tuple[str, int]] = (),
+        replica_check_interval: float = 2.0,
+        replica_max_lag: int = 0,
     ):
-        """Initialize a global async Redis client."""
-        cls._client = aioredis.Redis(
-            host=host,
-            port=port,
-            password=password,
-            db=db,
-            encoding="utf-8",
-            decode_responses=True,
-        )
+        """Initialize the global async Redis clients.
+
+        Each client gets a bounded pool (max_connections; with pool_blocking, callers wait up to
+        pool_timeout for a free connection instead of opening more), connect/command timeouts and
+        `retries` retries with jittered exponential backoff on connection errors. Timeouts are not
+        retried (the command may have run, and upserts are not idempotent): they fail the call and
+        count towards the circuit breaker.
+        In cluster mode host/port is only the seed node; max_connections applies per node and
+        pool_blocking is not available.
 
-        pong = await cls._client.ping()
-        if pong is not True:
-            raise RuntimeError("Redis PING failed")
+        `replicas` (standalone mode only) are read replicas for `read_node`. They are checked every
+        replica_check_interval seconds once `start_replica_checks` runs, and left out of rotation
+        while their link to the primary is down or older than replica_max_lag seconds (0 = any).
+        """
+        cls.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        cls.cluster = cluster
+        cls.replica_check_interval = replica_check_interval
+        cls.replica_max_lag = replica_max_lag
 
-        logging.info(f"[Redis] Connected to {host}:{port}, db={db}")
+        def _make_cluster_client(decode_responses: bool) -> InstrumentedRedisCluster:
+            return InstrumentedRedisCluster(
+                host=host,
+                port=port,
+                password=password,
+                max_connections=max_connections,
+                socket_connect_timeout=connect_timeout,
+                socket_timeout=command_timeout,
+                retry=Retry(EqualJitterBackoff(cap=1.0, base=0.05), retries, supported_errors=(RedisConnectionError,)),
+                decode_responses=decode_responses,
+            )
+
+        def _make_client(
+            decode_responses: bool,
+            node_host: str = host,
+            node_port: int = port,
+            client_class=InstrumentedRedis,
+            node_retries: int = retries,
+        ) -> InstrumentedRedis:
+            kwargs: Dict[str, Any] = dict(
+                host=node_host,
+                port=node_port,
+                password=password,
+                db=db,
+                max_connections=max_connections,
+                socket_connect_timeout=connect_timeout,
+                socket_timeout=command_timeout,
+                retry=Retry(EqualJitterBackoff(cap=1.0, base=0.05), node_retries, supported_errors=(RedisConnectionError,)),
+                decode_responses=decode_responses,
+            )
+            if decode_responses:
+                kwargs["encoding"] = "utf-8"
+            if pool_blocking:
+                pool = aioredis.BlockingConnectionPool(timeout=pool_timeout, **kwargs)
+            else:
+                pool = aioredis.ConnectionPool(**kwargs)
+            return client_class(connection_pool=pool)
+
+        make = _make_cluster_client if cluster else _make_client
+        cls._client = make(decode_responses=True)
+        # Same server, no response decoding: used for hashes holding compressed/binary payloads.
+        cls._raw_client = make(decode_responses=False)
+
+        try:
+            pong = await cls._client.ping()
+            if pong is not True:
+                raise RuntimeError("Redis PING failed")
+
+            await cls.load_scripts()
+
+            cls._primary = RedisNode(f"{host}:{port}", cls._client, cls._raw_client, primary=True)
+            cls._replicas = []
+            if replicas and cluster:
+                logging.warning("[Redis] Replicas are ignored in cluster mode")
+            for rhost, rport in (() if cluster else replicas):
+                # No retries on replicas: a failed read is retried on the primary instead.
+                cls._replicas.append(RedisNode(
+                    f"{rhost}:{rport}",
+                    _make_client(True, rhost, rport, ReplicaRedis, 0),
+                    _make_client(False, rhost, rport, ReplicaRedis, 0),
+                ))
+            if cls._replicas:
+                await cls.check_replicas()
+        except BaseException:
+            await cls.close()
+            raise
+
+        if cluster:
+            nodes = len(cls._client.get_primaries())
+            logging.info(f"[Redis] Connected to cluster via {host}:{port} ({nodes} primaries, "
+                         f"pool max={max_connections} per node)")
+        else:
+            logging.info(f"[Redis] Connected to {host}:{port}, db={db} "
+                         f"(pool max={max_connections}{', blocking' if pool_blocking else ''})")
 
     @classmethod
     def client(cls) -> aioredis.Redis:
@@ -44,10 +329,174 @@ class RedisConnectionAsync:
             raise RuntimeError("Redis not started. Call RedisConnectionAsync.start(...) first.")
         return cls._client
 
+    @classmethod
+    def register_script(cls, name: str, source: str) -> str:
+        """Register a Lua script to be loaded at start (and after NOSCRIPT). Returns its SHA."""
+        cls._scripts[name] = source
+        cls._shas[name] = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        return cls._shas[name]
+
+    @classmethod
+    async def load_scripts(cls):
+        """SCRIPT LOAD every registered script (server script cache is lost on restart/flush)."""
+        for name, source in cls._scripts.items():
+            sha = await cls.client().script_load(source)
+            if sha != cls._shas[name]:
+                raise RuntimeError(f"Redis returned an unexpected SHA for script '{name}'")
+        if cls._scripts:
+            logging.info(f"[Redis] Loaded {len(cls._scripts)} script(s): {', '.join(cls._scripts)}")
+
+    @classmethod
+    def script_sha(cls, name: str) -> str:
+        return cls._shas[name]
+
+    @classmethod
+    async def run_script(cls, name: str, keys: Sequence[Any], args: Sequence[Any], client=None):
+        """EVALSHA a registered script, reloading the scripts once on NOSCRIPT."""
+        client = client if client is not None else cls.client()
+        try:
+            return await client.evalsha(cls._shas[name], len(keys), *keys, *args)
+        except NoScriptError:
+            logging.warning(f"[Redis] NOSCRIPT for '{name}', reloading scripts")
+            await cls.load_scripts()
+            return await client.evalsha(cls._shas[name], len(keys), *keys, *args)
+
+    @classmethod
+    def raw_client(cls) -> aioredis.Redis:
+        """Return the shared client that leaves responses as bytes (decode_responses=False)."""
+        if cls._raw_client is None:
+            raise RuntimeError("Redis not started. Call RedisConnectionAsync.start(...) first.")
+        return cls._raw_client
+
+    @classmethod
+    def pool_usage(cls) -> List[Tuple[Tuple[str, str], int]]:
+        """Connection counts per client and state (in_use / idle / max), for the metrics gauge."""
+        out: List[Tuple[Tuple[str, str], int]] = []
+        clients = [("text", cls._client), ("raw", cls._raw_client)]
+        for node in cls._replicas:
+            clients += [(f"{node.name}/text", node.client), (f"{node.name}/raw", node.raw_client)]
+        for name, client in clients:
+            if client is None or not hasattr(client, "connection_pool"):
+                continue  # cluster clients keep one pool per node
+            pool = client.connection_pool
+            out.append(((name, "in_use"), len(getattr(pool, "_in_use_connections", ()))))
+            out.append(((name, "idle"), len(getattr(pool, "_available_connections", ()))))
+            max_conn = getattr(pool, "max_connections", None)
+            if max_conn and max_conn < 2 ** 31:  # redis-py's "unbounded" default
+                out.append(((name, "max"), max_conn))
+        return out
+
+    # ---- read routing
+
+    @classmethod
+    def primary_node(cls) -> RedisNode:
+        if cls._primary is None or cls._primary.client is not cls.client():
+            cls._primary = RedisNode("primary", cls.client(), cls.raw_client(), primary=True)
+        return cls._primary
+
+    @classmethod
+    def read_node(cls, primary: bool = False) -> RedisNode:
+        """Node to serve a read: the next healthy replica (round robin), or the primary when
+        `primary` is set or no replica is healthy."""
+        if not primary and cls._replicas:
+            n = len(cls._replicas)
+            for i in range(n):
+                node = cls._replicas[(cls._next_replica + i) % n]
+                if node.healthy:
+                    cls._next_replica = (cls._next_replica + i + 1) % n
+                    return node
+        return cls.primary_node()
+
+    @classmethod
+    def replica_failed(cls, node: RedisNode, exc: Exception) -> None:
+        """Take a replica out of rotation after a failed read; the health check brings it back."""
+        node.fallbacks += 1
+        if node.healthy:
+            node.healthy = False
+            logging.warning(f"[Redis] Replica {node.name} failed ({exc}); reading from the primary")
+
+    @classmethod
+    async def check_replicas(cls) -> None:
+        for node in cls._replicas:
+            try:
+                info = await node.client.info("replication")
+                lag = info.get("master_last_io_seconds_ago")
+                healthy = info.get("role") == "slave" and info.get("master_link_status") == "up"
+                if healthy and cls.replica_max_lag > 0:
+                    healthy = lag is not None and 0 <= lag <= cls.replica_max_lag
+                node.lag = lag
+            except Exception as exc:
+                healthy = False
+                if node.healthy:
+                    logging.warning(f"[Redis] Replica {node.name} health check failed: {exc}")
+            if healthy != node.healthy:
+                logging.info(f"[Redis] Replica {node.name} is {'back in' if healthy else 'out of'} rotation")
+            node.healthy = healthy
+
+    @classmethod
+    def start_replica_checks(cls) -> None:
+        if not cls._replicas or cls._replica_task is not None:
+            return
+        cls._replica_task = asyncio.create_task(cls._replica_loop())
+
+    @classmethod
+    async def stop_replica_checks(cls) -> None:
+        if cls._replica_task is None:
+            return
+        cls._replica_task.cancel()
+        try:
+            await cls._replica_task
+        except asyncio.CancelledError:
+            pass
+        cls._replica_task = None
+
+    @classmethod
+    async def _replica_loop(cls) -> None:
+        while True:
+            await asyncio.sleep(cls.replica_check_interval)
+            try:
+                await cls.check_replicas()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("[Redis] Replica health check failed")
+
+    @classmethod
+    def replica_stats(cls) -> List[Dict[str, Any]]:
+        return [
+            {"name": n.name, "healthy": n.healthy, "lag_seconds": n.lag, "fallbacks": n.fallbacks}
+            for n in cls._replicas
+        ]
+
+    @classmethod
+    def breaker_stats(cls) -> Dict[str, Any]:
+        b = cls.breaker
+        return {
+            "state": b.state,
+            "consecutive_failures": b.failures,
+            "opened_total": b.opened_total,
+            "rejected_total": b.rejected_total,
+        }
+
     @classmethod
     async def close(cls):
-        """Gracefully close the client/pool."""
+        """Gracefully close the clients/pools."""
+        for node in cls._replicas:
+            await cls._close_client(node.raw_client)
+            await cls._close_client(node.client)
+        cls._replicas = []
+        cls._primary = None
+        if cls._raw_client is not None:
+            await cls._close_client(cls._raw_client)
+            cls._raw_client = None
         if cls._client is not None:
-            await cls._client.close()
+            await cls._close_client(cls._client)
             cls._client = None
             logging.info("[Redis] Connection closed")
+
+    @staticmethod
+    async def _close_client(client) -> None:
+        if isinstance(client, RedisCluster):
+            await client.aclose()
+        else:
+            await client.aclose(close_connection_pool=True)
@@ -63,6 +63,23 @@ def test_upsert_record(input_data=None, output_data=None):
     pretty("POST /record (upsert)", resp)
 
 
+def test_upsert_batch(n=5):
+    """POST /records/batch -> upsert n records in one request."""
+    payload = {
+        "records": [
+            {"user_id": USER_ID, "match": f"{MATCH_ID}-{i}", "game": "fruits", "input": {"i": i}}
+            for i in range(n)
+        ],
+    }
+    resp = requests.post(
+        f"{BASE_URL}/records/batch",
+        headers=HEADERS,
+        json=payload,
+        timeout=15,
+    )
+    pretty("POST /records/batch", resp)
+
+
 def test_set_output(output_data):
     """PUT /record/output -> set/replace output only."""
     payload = {
@@ -79,12 +96,17 @@ def test_set_output(output_data):
     pretty("PUT /record/output", resp)
 
 
-def test_get_one():
-    """GET /record?user_id=...&match=..."""
+def test_get_one(fields=None, consistency=None):
+    """GET /record?user_id=...&game=...&match=...[&fields=match_id,updated_at][&consistency=primary]"""
     params = {
         "user_id": USER_ID,
+        "game": "fruits",
         "match": MATCH_ID,
     }
+    if fields:
+        params["fields"] = fields
+    if consistency:
+        params["consistency"] = consistency
     resp = requests.get(
         f"{BASE_URL}/record",
         headers=HEADERS,
@@ -109,6 +131,79 @@ def test_get_recent(n=LIMIT):
     pretty("GET /records (recent)", resp)
 
 
+def test_get_feed(n=LIMIT):
+    """GET /records/feed?user_id=...&limit=n (most recent across all games)"""
+    resp = requests.get(
+        f"{BASE_URL}/records/feed",
+        headers=HEADERS,
+        params={"user_id": USER_ID, "limit": n},
+        timeout=15,
+    )
+    pretty("GET /records/feed", resp)
+
+
+def test_get_stats(game="fruits"):
+    """GET /records/stats?user_id=...[&game=...]"""
+    params = {"user_id": USER_ID}
+    if game:
+        params["game"] = game
+    resp = requests.get(
+        f"{BASE_URL}/records/stats",
+        headers=HEADERS,
+        params=params,
+        timeout=15,
+    )
+    pretty("GET /records/stats", resp)
+
+
+def test_export(game=None):
+    """GET /records/export?user_id=...[&game=...] (NDJSON, one record per line)"""
+    params = {"user_id": USER_ID}
+    if game:
+        params["game"] = game
+    with requests.get(
+        f"{BASE_URL}/records/export",
+        headers=HEADERS,
+        params=params,
+        stream=True,
+        timeout=60,
+    ) as resp:
+        print("\n=== GET /records/export ===")
+        print("Status:", resp.status_code)
+        count = 0
+        for line in resp.iter_lines():
+            if line:
+                count += 1
+                if count <= 3:
+                    print(json.dumps(json.loads(line), ensure_ascii=False))
+        print("Records:", count)
+
+
+def test_events(game="fruits", max_events=3, last_id=None):
+    """GET /records/events?user_id=...&game=... (server-sent events; prints the first few)"""
+    headers = dict(HEADERS)
+    if last_id:
+        headers["Last-Event-ID"] = last_id
+    with requests.get(
+        f"{BASE_URL}/records/events",
+        headers=headers,
+        params={"user_id": USER_ID, "game": game},
+        stream=True,
+        timeout=60,
+    ) as resp:
+        print("\n=== GET /records/events ===")
+        print("Status:", resp.status_code)
+        seen = 0
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or line.startswith(":"):
+                continue  # event separator / keep-alive comment
+            print(line)
+            if line.startswith("data:"):
+                seen += 1
+                if seen >= max_events:
+                    break
+
+
 # ---------- Demo flow ----------
 
 if __name__ == "__main__":
@@ -117,8 +212,8 @@ if __name__ == "__main__":
     # # 1) Upsert with input only
     # test_upsert_record(input_data={"usuario": "Maria", "valor": 120})
     #
-    # # 2) Read single record
-    # test_get_one()
+    # # 2) Read single record (from the primary: replicas may not have the write yet)
+    # test_get_one(consistency="primary")
     #
     # # 3) Set/replace output
     # test_set_output({"status": "ok", "tempo": 3.2})
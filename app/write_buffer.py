@@ -0,0 +1,292 @@
+# write_buffer.py
+# Optional write-behind buffer: coalesces upserts of the same record before they reach Redis
+from __future__ import annotations
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from record_codec import RawJSON, to_json_text
+
+# Coalescing window in milliseconds (0 disables the buffer: every upsert goes straight to Redis)
+WRITE_BUFFER_MS = float(os.environ.get("WRITE_BUFFER_MS", "0"))
+# Max distinct records waiting to be flushed; writers wait for room when it is full
+WRITE_BUFFER_MAX = int(os.environ.get("WRITE_BUFFER_MAX", "10000"))
+# Seconds a writer waits for room before failing with WriteBufferFull
+WRITE_BUFFER_WAIT = float(os.environ.get("WRITE_BUFFER_WAIT", "2"))
+# Records per flush pipeline
+WRITE_BUFFER_BATCH = int(os.environ.get("WRITE_BUFFER_BATCH", "500"))
+
+RecordKey = Tuple[str, str, str]  # (user_id, game, match_id)
+
+
+class WriteBufferFull(Exception):
+    """No room freed up within WRITE_BUFFER_WAIT (Redis is not keeping up with the writes)."""
+
+
+class WriteBuffer:
+    """Per-process write-behind buffer for record upserts.
+
+    Writes to the same (user_id, game, match_id) within WRITE_BUFFER_MS are merged into one
+    pending entry (input and output kept separately, latest timestamps win) and flushed in
+    batches through the sink given to `start` (RecordsService.write_many). Reads in this
+    process overlay pending and in-flight entries on what Redis returns, so a client sees its
+    own writes; other processes only see them once flushed.
+    """
+
+    _pending: "OrderedDict[RecordKey, Dict[str, Any]]" = OrderedDict()
+    _flushing: Dict[RecordKey, Dict[str, Any]] = {}
+    _by_index: Dict[Tuple[str, str], Set[str]] = {}
+    _sink: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Any]]] = None
+    _task: Optional[asyncio.Task] = None
+    _lock: Optional[asyncio.Lock] = None
+    _wakeup: Optional[asyncio.Event] = None
+    _full: Optional[asyncio.Event] = None
+    _room: Optional[asyncio.Event] = None
+
+    writes = 0
+    coalesced = 0
+    flushed = 0
+    batches = 0
+    failures = 0
+    waits = 0
+    rejected = 0
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return WRITE_BUFFER_MS > 0 and cls._task is not None
+
+    @classmethod
+    def start(cls, sink: Callable[[List[Dict[str, Any]]], Awaitable[Any]]) -> None:
+        """Start the flusher; `sink` writes a list of upsert items (no-op when disabled)."""
+        if WRITE_BUFFER_MS <= 0 or cls._task is not None:
+            return
+        cls._sink = sink
+        cls._lock = asyncio.Lock()
+        cls._wakeup = asyncio.Event()
+        cls._full = asyncio.Event()
+        cls._room = asyncio.Event()
+        cls._task = asyncio.create_task(cls._run())
+        logging.info(f"[write-buffer] Started ({WRITE_BUFFER_MS:.0f}ms window, max {WRITE_BUFFER_MAX})")
+
+    @classmethod
+    async def stop(cls) -> None:
+        """Stop the flusher and write out everything still buffered."""
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        try:
+            await cls._task
+        except asyncio.CancelledError:
+            pass
+        cls._task = None
+
+        for attempt in range(3):
+            try:
+                await cls.flush()
+                break
+            except Exception:
+                logging.exception(f"[write-buffer] Final flush failed (attempt {attempt + 1})")
+                await asyncio.sleep(0.5)
+        if cls._pending:
+            logging.error(f"[write-buffer] {len(cls._pending)} buffered write(s) lost at shutdown")
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            "enabled": cls.enabled(),
+            "window_ms": WRITE_BUFFER_MS,
+            "pending": len(cls._pending),
+            "in_flight": len(cls._flushing),
+            "max_pending": WRITE_BUFFER_MAX,
+            "writes": cls.writes,
+            "coalesced": cls.coalesced,
+            "flushed": cls.flushed,
+            "batches": cls.batches,
+            "failures": cls.failures,
+            "waits": cls.waits,
+            "rejected": cls.rejected,
+        }
+
+    # ---- writes
+
+    @classmethod
+    async def add(
+        cls,
+        user_id: str,
+        match_id: str,
+        game: str,
+        input_data: Optional[Any],
+        output_data: Optional[Any],
+        updated_at: str,
+        score: float,
+    ) -> None:
+        """Queue an upsert, merging it into the pending entry of the same record if any.
+        Waits for room while the buffer is full; raises WriteBufferFull after WRITE_BUFFER_WAIT."""
+        key = (user_id, game, match_id)
+        if key not in cls._pending:
+            await cls._wait_for_room()
+
+        entry = cls._pending.get(key)
+        if entry is None:
+            in_flight = cls._flushing.get(key)
+            entry = cls._pending[key] = {
+                "user_id": user_id,
+                "match_id": match_id,
+                "game": game,
+                "input": None,
+                "output": None,
+                "created_at": in_flight["created_at"] if in_flight else updated_at,
+            }
+            cls._by_index.setdefault((user_id, game), set()).add(match_id)
+        else:
+            cls.coalesced += 1
+
+        # Canonical JSON text now, so reads from the buffer look exactly like reads from Redis.
+        if input_data is not None:
+            entry["input"] = to_json_text(input_data)
+        if output_data is not None:
+            entry["output"] = to_json_text(output_data)
+        entry["updated_at"] = updated_at
+        entry["score"] = score
+
+        cls.writes += 1
+        cls._wakeup.set()
+
+    @classmethod
+    async def _wait_for_room(cls) -> None:
+        if len(cls._pending) < WRITE_BUFFER_MAX:
+            return
+        cls.waits += 1
+        deadline = time.monotonic() + WRITE_BUFFER_WAIT
+        while len(cls._pending) >= WRITE_BUFFER_MAX:
+            cls._full.set()  # flush now instead of at the end of the window
+            cls._room.clear()
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(cls._room.wait(), remaining)
+            except asyncio.TimeoutError:
+                cls.rejected += 1
+                raise WriteBufferFull(f"Write buffer full ({len(cls._pending)} pending)") from None
+
+    # ---- flushing
+
+    @classmethod
+    async def _run(cls) -> None:
+        while True:
+            await cls._wakeup.wait()
+            try:
+                await asyncio.wait_for(cls._full.wait(), WRITE_BUFFER_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            cls._wakeup.clear()
+            cls._full.clear()
+            try:
+                await cls.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("[write-buffer] Flush failed; retrying in 1s")
+                cls._wakeup.set()
+                await asyncio.sleep(1)
+
+    @classmethod
+    async def flush(cls) -> None:
+        """Write out every pending entry, WRITE_BUFFER_BATCH records per sink call.
+        On failure the batch goes back to the buffer (under newer writes) and the error is raised."""
+        async with cls._lock:
+            while cls._pending:
+                n = min(WRITE_BUFFER_BATCH, len(cls._pending))
+                batch = [cls._pending.popitem(last=False) for _ in range(n)]
+                cls._flushing.update(batch)
+                cls._room.set()
+                try:
+                    await cls._sink([entry for _, entry in batch])
+                except BaseException:
+                    cls.failures += 1
+                    cls._requeue(batch)
+                    raise
+                finally:
+                    for key, _ in batch:
+                        cls._flushing.pop(key, None)
+                for key, _ in batch:
+                    cls._forget(key)
+                cls.flushed += n
+                cls.batches += 1
+
+    @classmethod
+    def _requeue(cls, batch: List[Tuple[RecordKey, Dict[str, Any]]]) -> None:
+        for key, entry in reversed(batch):
+            newer = cls._pending.get(key)
+            if newer is None:
+                cls._pending[key] = entry
+                cls._pending.move_to_end(key, last=False)
+                continue
+            # A write arrived while this one was in flight: keep its fields, fill the gaps.
+            for f in ("input", "output"):
+                if newer[f] is None:
+                    newer[f] = entry[f]
+            newer["created_at"] = entry["created_at"]
+
+    @classmethod
+    def _forget(cls, key: RecordKey) -> None:
+        if key in cls._pending or key in cls._flushing:
+            return
+        user_id, game, match_id = key
+        ids = cls._by_index.get((user_id, game))
+        if ids is not None:
+            ids.discard(match_id)
+            if not ids:
+                del cls._by_index[(user_id, game)]
+
+    # ---- read-your-writes
+
+    @classmethod
+    def layers(cls, user_id: str, game: str, match_id: str) -> List[Dict[str, Any]]:
+        """Buffered entries of a record, oldest first (in flight, then pending)."""
+        key = (user_id, game, match_id)
+        return [e for e in (cls._flushing.get(key), cls._pending.get(key)) if e is not None]
+
+    @classmethod
+    def buffered(cls, user_id: str, game: str) -> Dict[str, List[Dict[str, Any]]]:
+        """match_id -> layers for every buffered record of a user index."""
+        return {mid: cls.layers(user_id, game, mid) for mid in cls._by_index.get((user_id, game), ())}
+
+    @classmethod
+    def buffered_user(cls, user_id: str) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+        """(game, match_id) -> layers for every buffered record of a user, across games."""
+        return {
+            (game, mid): cls.layers(user_id, game, mid)
+            for (uid, game), mids in cls._by_index.items() if uid == user_id
+            for mid in mids
+        }
+
+    @staticmethod
+    def apply(
+        rec: Optional[Dict[str, Any]],
+        layers: List[Dict[str, Any]],
+        fields: Tuple[str, ...],
+        raw_json: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """Overlay buffered layers on a stored record projection (None if not stored yet)."""
+        if not layers:
+            return rec
+        out = dict(rec) if rec is not None else {f: None for f in fields}
+        for layer in layers:
+            for f in fields:
+                if f in ("input", "output"):
+                    text = layer[f]
+                    if text is not None:
+                        out[f] = RawJSON(text.encode("utf-8")) if raw_json else json.loads(text)
+                elif f == "created_at":
+                    if rec is None or out.get(f) is None:
+                        out[f] = layer[f]
+                else:
+                    out[f] = layer[f]
+        return out